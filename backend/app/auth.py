@@ -1,70 +1,158 @@
 from fastapi import Header, HTTPException
 from jose import jwt, jwk
 from jose.exceptions import JWTError
-import requests
+import asyncio
+import hashlib
+import httpx
+import logging
 import os
+import time
+
+from app.services.lookup_cache import LookupCache
+from app.services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-# Haal 1 keer JWKS op bij module load
+# JWKS wordt bij startup opgehaald en daarna periodiek in de achtergrond ververst
 SUPABASE_JWKS_URL = f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json"
 
-_jwks_keys = {}
+JWKS_REFRESH_SECONDS = float(os.getenv("JWKS_REFRESH_SECONDS", "3600"))
+JWKS_TIMEOUT = float(os.getenv("JWKS_TIMEOUT_SECONDS", "5"))
+# Onbekende kid: max. één reload per interval, anders kan elke client met een bogus kid de JWKS laten ophalen
+UNKNOWN_KID_RELOAD_SECONDS = float(os.getenv("JWKS_UNKNOWN_KID_RELOAD_SECONDS", "60"))
+
+# Geverifieerde tokens (sha256 digest -> user_id) tot hun exp, begrensd
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+TOKEN_CACHE_MAX_TTL = float(os.getenv("TOKEN_CACHE_MAX_TTL_SECONDS", "3600"))
+
+_jwks_keys = {}       # kid -> JWK
+_public_keys = {}     # kid -> geconstrueerde key (jwk.construct per request is duur)
+_last_reload = 0.0
+_reloading = False
+_refresh_task = None
 
-def _load_jwks():
-    global _jwks_keys
+_jwks_flights = SingleFlight("jwks")
+_verified_tokens = LookupCache(
+    "verified_tokens", max_entries=TOKEN_CACHE_MAX_ENTRIES, ttl=TOKEN_CACHE_MAX_TTL, negative_ttl=0
+)
+
+
+async def _fetch_jwks() -> bool:
+    global _jwks_keys, _public_keys, _last_reload, _reloading
+    _last_reload = time.monotonic()
+    _reloading = True
     try:
-        resp = requests.get(SUPABASE_JWKS_URL)
-        print("JWKS STATUS:", resp.status_code)
-
-        if resp.status_code == 200:
-            jwks = resp.json()
-            _jwks_keys = {
-                key["kid"]: key
-                for key in jwks.get("keys", [])
-            }
-        else:
-            print("JWKS BODY:", resp.text[:200])
+        async with httpx.AsyncClient(timeout=JWKS_TIMEOUT) as client:
+            resp = await client.get(SUPABASE_JWKS_URL)
+        logger.debug("JWKS status: %s", resp.status_code)
+
+        if resp.status_code != 200:
+            logger.warning("JWKS load failed (%s): %s", resp.status_code, resp.text[:200])
+            return False
+        keys = {key["kid"]: key for key in resp.json().get("keys", []) if "kid" in key}
 
     except Exception as e:
-        print("JWKS LOAD FOUT:", e)
+        logger.warning("JWKS load fout: %s", e)
+        return False
+    finally:
+        _reloading = False
+
+    # Geconstrueerde keys van ongewijzigde kids blijven bruikbaar
+    _public_keys = {kid: key for kid, key in _public_keys.items() if keys.get(kid) == _jwks_keys.get(kid)}
+    _jwks_keys = keys
+    return True
+
+
+async def refresh_jwks() -> bool:
+    """Reload the JWKS; concurrent callers share one request."""
+    return await _jwks_flights.do("jwks", _fetch_jwks)
+
+
+async def _refresh_loop():
+    while True:
+        await refresh_jwks()
+        await asyncio.sleep(JWKS_REFRESH_SECONDS)
+
 
-def get_current_user(authorization: str | None = Header(default=None)):
+def start_jwks_refresh():
+    """Prefetch the JWKS and keep refreshing it in the background (called on startup)."""
+    global _refresh_task
+    if SUPABASE_URL and _refresh_task is None:
+        _refresh_task = asyncio.create_task(_refresh_loop())
+
+
+def stop_jwks_refresh():
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        _refresh_task = None
+
+
+async def _public_key(kid: str):
+    if kid not in _jwks_keys and (_reloading or time.monotonic() - _last_reload >= UNKNOWN_KID_RELOAD_SECONDS):
+        logger.info("Kid %s niet gevonden, JWKS herladen", kid)
+        await refresh_jwks()  # probeer opnieuw bij key rotation
+
+    if kid not in _jwks_keys:
+        raise HTTPException(status_code=401, detail="Unknown key ID")
+
+    key = _public_keys.get(kid)
+    if key is None:
+        key = _public_keys[kid] = jwk.construct(_jwks_keys[kid], algorithm="ES256")
+    return key
+
+
+def _remember_token(digest: str, payload: dict):
+    exp = payload.get("exp")
+    if exp is None:
+        return
+    ttl = min(float(exp) - time.time(), TOKEN_CACHE_MAX_TTL)
+    if ttl > 0:
+        _verified_tokens.put(digest, payload["sub"], ttl=ttl)
+
+
+async def get_current_user(authorization: str | None = Header(default=None)):
     if authorization is None:
         raise HTTPException(status_code=401, detail="Missing token")
 
     try:
         token = authorization.split(" ")[1]
+
+        # Zelfde token al geverifieerd en nog niet verlopen: geen signature check
+        digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        found, user_id = _verified_tokens.get(digest)
+        if found and user_id:
+            return user_id
+
         header = jwt.get_unverified_header(token)
         alg = header.get("alg")
         kid = header.get("kid")
 
-        if alg == "ES256":
-            # Gebruik JWKS publieke key
-            if kid not in _jwks_keys:
-                print("KID NIET GEVONDEN, JWKS HERLADEN...")
-                _load_jwks()  # probeer opnieuw bij key rotation
-
-            if kid not in _jwks_keys:
-                raise HTTPException(status_code=401, detail="Unknown key ID")
+        if alg != "ES256":
+            raise HTTPException(status_code=401, detail=f"Unsupported token algorithm: {alg}")
 
-            public_key = jwk.construct(_jwks_keys[kid], algorithm="ES256")
-            payload = jwt.decode(
-                token,
-                public_key,
-                algorithms=["ES256"],
-                audience="authenticated",
-            )
+        # Gebruik JWKS publieke key
+        public_key = await _public_key(kid)
+        payload = jwt.decode(
+            token,
+            public_key,
+            algorithms=["ES256"],
+            audience="authenticated",
+        )
+        _remember_token(digest, payload)
 
-        print("AUTH OK")
+        # Enkel na een echte verificatie (cache hits loggen niet), en gesampled
+        logger.debug("Auth OK for %s", payload["sub"], extra={"sample": "auth_ok"})
         return payload["sub"]
 
     except HTTPException:
         raise
     except JWTError as e:
-        print("JWT ERROR:", e)
+        logger.info("JWT error: %s", e)
         raise HTTPException(status_code=401, detail=f"Invalid token: {e}")
     except Exception as e:
-        print("AUTH ERROR:", type(e).__name__, e)
-        raise HTTPException(status_code=401, detail=f"Auth error: {e}")
\ No newline at end of file
+        logger.warning("Auth error: %s %s", type(e).__name__, e)
+        raise HTTPException(status_code=401, detail=f"Auth error: {e}")
@@ -0,0 +1,169 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from typing import Dict, Optional
+
+# Logging zonder print(): records gaan via een begrensde queue naar één listener
+# thread die naar stdout schrijft, zodat request handlers nooit op de stream wachten.
+# Elke regel draagt de request id van de request die hem logde.
+#
+#   LOG_LEVEL=INFO                                   standaard level voor app.*
+#   LOG_LEVELS=auth=WARNING,openfoodfacts_service=DEBUG,gemini=INFO
+#   LOG_SAMPLE_EVERY=100                             1 op N voor high-frequency events
+#   LOG_QUEUE_SIZE=10000                             vol = record droppen (geteld), niet blokkeren
+#   LOG_FORMAT=text|json
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+SAMPLE_EVERY = max(1, int(os.getenv("LOG_SAMPLE_EVERY", "100")))
+QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
+# Korte namen in LOG_LEVELS -> logger namen
+MODULE_ALIASES = {
+    "auth": "app.auth",
+    "openfoodfacts_service": "app.services.openfoodfacts_service",
+    "database_service": "app.services.database_service",
+    "gemini": "app.services.gemini_service",
+    "gemini_service": "app.services.gemini_service",
+    "product_resolver": "app.services.product_resolver",
+    "product_service": "app.services.product_service",
+    "scan_log": "app.services.scan_log_queue",
+    "products": "app.routers.products",
+}
+
+request_id: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional["DroppingQueueHandler"] = None
+_sampler: Optional["SamplingFilter"] = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Attach the current request id (contextvar) to every record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep 1 in SAMPLE_EVERY records logged with extra={"sample": key}, counted per key.
+    Warnings and errors are never sampled away.
+    """
+
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = every
+        self.seen: Dict[str, int] = {}
+        self.suppressed = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample", None)
+        if key is None or self.every <= 1 or record.levelno >= logging.WARNING:
+            return True
+        with self._lock:
+            count = self.seen.get(key, 0)
+            self.seen[key] = count + 1
+            if count % self.every == 0:
+                record.sampled = self.every
+                return True
+            self.suppressed += 1
+            return False
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records when the queue is full instead of blocking."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "sampled", None):
+            data["sampled"] = record.sampled
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+def _parse_levels(value: str) -> Dict[str, str]:
+    """"auth=WARNING,gemini=DEBUG" -> {"app.auth": "WARNING", "app.services.gemini_service": "DEBUG"}."""
+    levels = {}
+    for part in value.split(","):
+        if "=" not in part:
+            continue
+        name, level = (s.strip() for s in part.split("=", 1))
+        if name and level:
+            levels[MODULE_ALIASES.get(name, name)] = level.upper()
+    return levels
+
+
+def setup_logging(stream=None) -> logging.Logger:
+    """Route the app.* loggers through the queue handler (idempotent, called at import of main)."""
+    global _listener, _queue_handler, _sampler
+    root = logging.getLogger("app")
+    if _listener is not None:
+        return root
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    if LOG_FORMAT == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+
+    _sampler = SamplingFilter(SAMPLE_EVERY)
+    _queue_handler = DroppingQueueHandler(queue.Queue(QUEUE_SIZE))
+    # Filters op de handler: request id wordt in de request context gezet, niet in de listener thread
+    _queue_handler.addFilter(_sampler)
+    _queue_handler.addFilter(RequestIdFilter())
+
+    root.handlers = [_queue_handler]
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+    for name, level in _parse_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    return root
+
+
+def shutdown_logging():
+    """Write out what is still queued (called on shutdown)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        logging.getLogger("app").handlers = []
+
+
+def stats() -> dict:
+    return {
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "sampled_out": _sampler.suppressed if _sampler else 0,
+        "sample_every": SAMPLE_EVERY,
+    }
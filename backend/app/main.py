@@ -1,6 +1,13 @@
 from fastapi import FastAPI
+import asyncio
 import asyncpg
 import os
+import uuid
+from app.logging_config import request_id, setup_logging, shutdown_logging
+
+# Voor de routers geïmporteerd worden: die loggen al bij import (Supabase init)
+setup_logging()
+
 from .routers import products # import products router (scraper endpoint)
 from .routers import user # import user router (preferences endpoint)
 from .routers import shopping_lists # import shopping lists router
@@ -10,6 +17,12 @@ from app.routers.barcode_api import router as barcode_router
 from .routers import suggestions
 from app.routers import shopping_lists
 from app.routers import favorites_router
+from app.services.off_database import shutdown_executor
+from app.services import fuzzy_matcher, off_api_client
+from app.services.database_service import close_database_pool
+from app.services import scan_log_queue
+from app.auth import start_jwks_refresh, stop_jwks_refresh
+from app.services.shopping_list_service import ensure_schema, start_totals_reconciler, stop_totals_reconciler
 
 app = FastAPI(title="MealPrep API")
 
@@ -24,6 +37,65 @@ app.include_router(favorites_router.router)
 # get database url
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+
+class RequestIdMiddleware:
+    """
+    Correlation id: taken from the client/proxy or new, set for the logging of the
+    request and returned as X-Request-ID. Plain ASGI: no BaseHTTPMiddleware task and
+    streams per request on the hot path.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        rid = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"x-request-id"), None)
+        rid = rid or uuid.uuid4().hex[:16]
+        header = (b"x-request-id", rid.encode("latin-1"))
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), header]
+            await send(message)
+
+        token = request_id.set(rid)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
+
+
+app.add_middleware(RequestIdMiddleware)
+
+
+@app.on_event("startup")
+async def startup():
+    # Item endpoints steunen op migrate_shopping_lists: migreren of niet starten
+    await ensure_schema()
+    await scan_log_queue.start()
+    start_jwks_refresh()
+    start_totals_reconciler()
+    if fuzzy_matcher.preload_enabled():
+        # Without products_fts: build the Delhaize name matcher in the background, startup is not blocked
+        asyncio.get_running_loop().run_in_executor(None, fuzzy_matcher.preload)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Eerst de scan log queue leegmaken, dan pas de pool sluiten
+    await scan_log_queue.stop()
+    # Reconciler eerst stoppen: hij gebruikt de pool
+    await stop_totals_reconciler()
+    await close_database_pool()
+    stop_jwks_refresh()
+    shutdown_executor()
+    off_api_client.close_client()
+    shutdown_logging()
+
+
 @app.get("/")
 def root():
     return {"message": "Mealprep API is running!"}
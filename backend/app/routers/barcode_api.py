@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from app.services.openfoodfacts_service import get_product_by_barcode
 from app.auth import get_current_user
 
@@ -6,13 +6,20 @@ router = APIRouter(prefix="/food", tags=["Food"])
 
 
 @router.get("/barcode/{barcode}")
-def lookup_barcode(
+async def lookup_barcode(
     barcode: str,
     user_id: str = Depends(get_current_user),
+    log_scan: bool = Query(True, description="Log deze scan naar database"),
+    allow_duplicates: bool = Query(False, description="Sta dubbele scans toe binnen time window"),
+    duplicate_window_minutes: int = Query(1440, description="Time window voor duplicate detection in minuten (24u)"),
 ):
-    product = get_product_by_barcode(
+    # Product lookup en duplicate check lopen gelijktijdig, de scan insert gebeurt na de response
+    product = await get_product_by_barcode(
         barcode=barcode,
         user_id=user_id,
+        log_scan=log_scan,
+        allow_duplicate_scans=allow_duplicates,
+        duplicate_window_minutes=duplicate_window_minutes,
     )
 
     if not product:
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Response
 from pydantic import BaseModel
 from typing import List, Optional
 from app.services.favorites_service import (
@@ -8,6 +8,7 @@ from app.services.favorites_service import (
     check_favorite as is_favorite,
 )
 from app.auth import get_current_user
+from app.services import resource_versions
 from uuid import UUID
 
 router = APIRouter()
@@ -36,9 +37,19 @@ class AddFavoriteRequest(BaseModel):
 
 
 @router.get("/favorites", response_model=List[FavoriteProduct])
-async def get_favorites(user_id: str = Depends(get_current_user)):
-    """Haal alle favoriete producten op van de ingelogde gebruiker."""
-    return await fetch_favorites(user_id)
+async def get_favorites(
+    response: Response,
+    user_id: str = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None),
+):
+    """Haal alle favoriete producten op van de ingelogde gebruiker (304 als niets veranderde)."""
+    etag = await resource_versions.etag(resource_versions.FAVORITES, user_id)
+    if resource_versions.not_modified(if_none_match, etag):
+        return Response(status_code=304, headers=resource_versions.headers(etag))
+
+    favorites = await fetch_favorites(user_id)
+    response.headers.update(resource_versions.headers(etag))
+    return favorites
 
 
 @router.post("/favorites")
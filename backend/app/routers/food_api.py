@@ -23,7 +23,7 @@ async def get_product(
             print(f"Scan logging enabled - duplicates {dup_msg} - user: {user_id or 'test-user'}")
         
         # Haal product op met duplicate prevention
-        product = get_product_by_barcode(
+        product = await get_product_by_barcode(
             barcode, 
             user_id=user_id, 
             log_scan=log_scan,
@@ -1,77 +1,36 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header
 from app.auth import get_current_user
 from fastapi.responses import Response
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
-import uuid
+import asyncio
+import logging
+import time
 import requests as http_requests
-from app.services.product_service import find_product_by_name, find_product_by_barcode, get_db_stats
+from app.services.product_service import (
+    find_product_by_name,
+    find_products_by_barcodes,
+    get_db_stats,
+)
 from app.services.database_service import get_database_service
+from app.services.shopping_list_service import bump_lists_with_products, reconcile_stats, set_item
+from app.services.list_repricing import repricing_stats, reprice_lists_for_promotions
+from app.services import (
+    lookup_cache, off_api_client, recent_scans, redis_cache, resource_versions, scan_log_queue, single_flight,
+)
+from app.services.product_resolver import resolve_products, resolve_via_api, resolver_stats
+from app.services.fuzzy_matcher import match_names
 from app.services.gemini_service import enrich_products_batched
+from app import logging_config
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
 # ==================== HELPER FUNCTIONS ====================
 
-async def _recalculate_list_totals_async(conn, list_id: str):
-    """
-    Herbereken estimated_total_price en estimated_savings voor een shopping list
-    via een asyncpg connectie. Houdt rekening met 'meerdere artikels' promoties.
-    """
-    items = await conn.fetch("""
-        SELECT
-            sli.quantity,
-            sli.has_promo,
-            COALESCE(pr.original_price, p.price) AS original_price,
-            pr.promo_price,
-            pr.deal_quantity,
-            pr.is_meerdere_artikels
-        FROM shopping_list_items sli
-        LEFT JOIN products p ON sli.product_id = p.product_id
-        LEFT JOIN promotions pr ON sli.promo_id = pr.promo_id AND sli.has_promo = true
-        WHERE sli.list_id = $1::uuid
-    """, list_id)
-
-    total_price = 0.0
-    total_savings = 0.0
-
-    for item in items:
-        quantity = item['quantity'] or 1
-        has_promo = item['has_promo']
-        original_price = float(item['original_price'] or 0)
-        promo_price = float(item['promo_price']) if item['promo_price'] is not None else None
-        deal_quantity = item['deal_quantity']
-        is_meerdere_artikels = item['is_meerdere_artikels']
-
-        if has_promo and original_price and promo_price:
-            if is_meerdere_artikels and deal_quantity and deal_quantity > 1:
-                complete_groups = quantity // deal_quantity
-                remaining = quantity % deal_quantity
-                line_total = complete_groups * deal_quantity * promo_price + remaining * original_price
-                item_savings = complete_groups * deal_quantity * (original_price - promo_price)
-            else:
-                line_total = promo_price * quantity
-                item_savings = (original_price - promo_price) * quantity
-        elif original_price:
-            line_total = original_price * quantity
-            item_savings = 0.0
-        else:
-            line_total = 0.0
-            item_savings = 0.0
-
-        total_price += line_total
-        total_savings += item_savings
-
-    await conn.execute("""
-        UPDATE shopping_lists
-        SET estimated_total_price = $1,
-            estimated_savings = $2
-        WHERE list_id = $3::uuid
-    """, round(total_price, 2), round(total_savings, 2), list_id)
-
-
 def parse_deal_info(discount: str) -> tuple:
     """
     Fallback: parse discount string to (is_meerdere_artikels, deal_quantity).
@@ -289,7 +248,7 @@ async def get_products(store: str = None, limit: int = 50):
             products = [dict(row) for row in rows]
             return products
     except Exception as e:
-        print(f"Error fetching products: {e}")
+        logger.error("Error fetching products: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/shopping-list/add")
@@ -299,61 +258,27 @@ async def add_to_shopping_list(req: AddToCartRequest, user_id: str = Depends(get
     """
     try:
         db = await get_database_service()
-        async with db.pool.acquire() as conn:
-            # Controleer of lijst van ingelogde gebruiker is
+        async with db.pool.acquire() as conn, conn.transaction():
+            # Controleer of lijst van ingelogde gebruiker is (en lock ze voor de totals)
             owner = await conn.fetchrow(
-                "SELECT list_id FROM shopping_lists WHERE list_id = $1::uuid AND user_id = $2::uuid",
+                "SELECT list_id FROM shopping_lists WHERE list_id = $1::uuid AND user_id = $2::uuid FOR UPDATE",
                 req.list_id, user_id
             )
             if not owner:
                 raise HTTPException(status_code=403, detail="Lijst niet gevonden of geen toegang")
 
-            # Check of product al in de lijst zit
-            existing = await conn.fetchrow(
-                """
-                SELECT item_id, quantity FROM shopping_list_items
-                WHERE list_id = $1::uuid AND product_id = $2::uuid
-                """,
-                req.list_id, req.product_id
+            # Insert of quantity overschrijven (promo info als meegegeven), totals delta in hetzelfde statement
+            await set_item(
+                conn, req.list_id, req.product_id, req.quantity,
+                has_promo=bool(req.has_promo), promo_id=req.promo_id, price_per_unit=req.price_per_unit
             )
 
-            if existing:
-                # Update quantity (en promo info als meegegeven)
-                await conn.execute(
-                    """
-                    UPDATE shopping_list_items
-                    SET quantity = $1,
-                        has_promo = COALESCE($3, has_promo),
-                        promo_id = COALESCE($4::uuid, promo_id),
-                        price_per_unit = COALESCE($5, price_per_unit)
-                    WHERE item_id = $2::uuid
-                    """,
-                    req.quantity, str(existing['item_id']),
-                    req.has_promo if req.has_promo else None,
-                    req.promo_id,
-                    req.price_per_unit
-                )
-            else:
-                # Insert nieuw item
-                item_id = str(uuid.uuid4())
-                await conn.execute(
-                    """
-                    INSERT INTO shopping_list_items
-                        (item_id, list_id, product_id, quantity, has_promo, promo_id, price_per_unit)
-                    VALUES ($1::uuid, $2::uuid, $3::uuid, $4, $5, $6::uuid, $7)
-                    """,
-                    item_id, req.list_id, req.product_id, req.quantity,
-                    req.has_promo, req.promo_id, req.price_per_unit
-                )
-
-            # Herbereken totalen voor de lijst (binnen async with block)
-            await _recalculate_list_totals_async(conn, req.list_id)
-
+        await resource_versions.bump(resource_versions.LIST, [req.list_id])
         return {"message": "Product succesvol toegevoegd aan lijst"}
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error adding to list: {e}")
+        logger.error("Error adding to list: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/products/db-stats")
@@ -362,13 +287,24 @@ def database_stats():
     return get_db_stats()
 
 
+@router.get("/products/lookup-stats")
+def lookup_stats():
+    """Hit/miss/eviction counters of the in-process barcode lookup caches (per worker) and Redis."""
+    return {**lookup_cache.all_stats(), "redis": redis_cache.stats(), "off_api": off_api_client.stats(),
+            "resolver": resolver_stats(), "single_flight": single_flight.all_stats(),
+            "scan_log": scan_log_queue.stats(), "recent_scans": recent_scans.stats(),
+            "logging": logging_config.stats(), "list_totals": reconcile_stats(),
+            "list_repricing": repricing_stats(),
+            "conditional_get": resource_versions.stats()}
+
+
 @router.post("/products/batch-upload-delhaize")
 def upload_delhaize_products(products: List[ProductSchema]):
     """
     Process products from Delhaize scraper.
     """
     try:
-        print(f"Received: {len(products)} products from Delhaize")
+        logger.info("Received: %d products from Delhaize", len(products))
 
         results = {
             "matched": [],
@@ -376,10 +312,25 @@ def upload_delhaize_products(products: List[ProductSchema]):
             "errors": []
         }
 
-        for product in products:
+        # One pass over all names with the in-process fuzzy matcher (fallback: FTS search per product)
+        match_start = time.perf_counter()
+        fuzzy_matches = match_names([product.name for product in products], min_score=70.0)
+        if fuzzy_matches is not None:
+            matched_products = find_products_by_barcodes([m.barcode for m in fuzzy_matches if m])
+            logger.info("Fuzzy matched %d/%d products in %.0f ms", len(matched_products), len(products),
+                        (time.perf_counter() - match_start) * 1000)
+
+        for index, product in enumerate(products):
             try:
                 delhaize_id = extract_delhaize_id(product.url)
-                matches = find_product_by_name(product.name, limit=1, min_score=70.0)
+                if fuzzy_matches is not None:
+                    fuzzy = fuzzy_matches[index]
+                    match = matched_products.get(fuzzy.barcode) if fuzzy else None
+                    if match:
+                        match.match_score = fuzzy.match_score
+                    matches = [match] if match else []
+                else:
+                    matches = find_product_by_name(product.name, limit=1, min_score=70.0)
 
                 if matches and matches[0].match_score >= 70.0:
                     match = matches[0]
@@ -443,14 +394,15 @@ async def upload_colruyt_products(batch: ColruytBatchUpload):
     Flow:
     1. Get or create Colruyt store in database
     2. Group products by URL (same product may have multiple barcodes)
-    3. For each URL, try barcodes until one matches in OpenFoodFacts
+    3. Resolve all barcodes in one batch against OpenFoodFacts (API fallback for URLs without a local match)
     4. Batch all product names → send to Gemini for AI enrichment (category, macro, healthy)
     5. Save product to database (upsert)
     6. Create promotion record with discount + Gemini enrichment
+    7. Reprice the shopping lists that had items on the expired promotions
     """
     try:
         products = batch.products
-        print(f"Received: {len(products)} products from Colruyt")
+        logger.info("Received: %d products from Colruyt", len(products))
 
         # Parse promotion dates
         valid_from = parse_date(batch.promotion_from) if batch.promotion_from else datetime.now()
@@ -467,7 +419,9 @@ async def upload_colruyt_products(batch: ColruytBatchUpload):
 
         # Deactivate old promotions for Colruyt
         deactivated = await db.deactivate_old_promotions(store_id)
-        print(f"Deactivated {deactivated} old promotions")
+        logger.info("Deactivated %d old promotions", len(deactivated))
+        if deactivated:
+            await resource_versions.bump(resource_versions.PROMOTIONS, ["Colruyt", resource_versions.ALL_STORES])
 
         # Group products by URL (same product may have multiple barcodes to try)
         products_by_url = {}
@@ -482,7 +436,7 @@ async def upload_colruyt_products(batch: ColruytBatchUpload):
                 }
             products_by_url[product.url]["barcodes"].append(product.barcode)
 
-        print(f"Grouped into {len(products_by_url)} unique products")
+        logger.info("Grouped into %d unique products", len(products_by_url))
 
         # ====================================================
         # PHASE 1: Match all barcodes against OpenFoodFacts
@@ -490,20 +444,42 @@ async def upload_colruyt_products(batch: ColruytBatchUpload):
         url_list = list(products_by_url.keys())
         matched_data = {}  # url -> {match, barcode, product_name, ...}
 
+        # Resolve all candidate barcodes of all URLs in one batch (cache, Postgres, local OFF DB)
+        all_barcodes = [b for url in url_list for b in products_by_url[url]["barcodes"]]
+        lookup_start = time.perf_counter()
+        local_matches = await resolve_products(all_barcodes, use_api=False)
+        logger.info("Local product lookup: %d/%d barcodes matched in %.1f ms", len(local_matches),
+                    len(set(all_barcodes)), (time.perf_counter() - lookup_start) * 1000)
+
+        async def resolve_url_via_api(barcodes):
+            # Not found locally → OpenFoodFacts API, barcodes of one URL in order until a match
+            for barcode in barcodes:
+                match = await resolve_via_api(barcode)
+                if match:
+                    logger.debug("Found API match for barcode %s", barcode)
+                    return barcode, match
+                logger.debug("No match for barcode %s", barcode)
+            return None, None
+
+        # API fallbacks of all URLs concurrently (the shared OFF client bounds concurrency and rate)
+        unmatched_urls = [
+            url for url in url_list
+            if not any(b in local_matches for b in products_by_url[url]["barcodes"])
+        ]
+        api_results = await asyncio.gather(
+            *(resolve_url_via_api(products_by_url[url]["barcodes"]) for url in unmatched_urls)
+        )
+        api_matches = dict(zip(unmatched_urls, api_results))
+
         for url in url_list:
             product_info = products_by_url[url]
             barcodes = product_info["barcodes"]
 
-            match = None
-            matched_barcode = None
-            for barcode in barcodes:
-                match = find_product_by_barcode(barcode)
-                if match:
-                    matched_barcode = barcode
-                    print(f"  Found match for barcode {barcode}")
-                    break
-                else:
-                    print(f"  No match for barcode {barcode}")
+            if url in api_matches:
+                matched_barcode, match = api_matches[url]
+            else:
+                matched_barcode = next(b for b in barcodes if b in local_matches)
+                match = local_matches[matched_barcode]
 
             # Name priority: scraped from Colruyt > OpenFoodFacts > fallback
             scraped_name = product_info.get("scraped_name")
@@ -524,9 +500,9 @@ async def upload_colruyt_products(batch: ColruytBatchUpload):
         product_names = [matched_data[url]["product_name"] for url in url_list]
         product_discounts = [products_by_url[url]["discount"] for url in url_list]
         product_prices = [products_by_url[url].get("price") for url in url_list]
-        print(f"\nSending {len(product_names)} products to Gemini for enrichment...")
+        logger.info("Sending %d products to Gemini for enrichment", len(product_names))
         enrichments = await enrich_products_batched(product_names, product_discounts, product_prices)
-        print(f"Gemini enrichment complete: {len(enrichments)} results")
+        logger.info("Gemini enrichment complete: %d results", len(enrichments))
 
         # Map enrichments back to URLs
         enrichment_by_url = {}
@@ -543,6 +519,7 @@ async def upload_colruyt_products(batch: ColruytBatchUpload):
             "not_found": [],
             "errors": []
         }
+        upserted_product_ids = []   # lijsten met deze producten tonen nu andere namen/prijzen
 
         for url in url_list:
             try:
@@ -602,6 +579,7 @@ async def upload_colruyt_products(batch: ColruytBatchUpload):
                         fat_g=match.fat_100g,
                         image_url=match.image_url,
                     )
+                    upserted_product_ids.append(product_id)
 
                     await db.create_promotion(
                         store_id=store_id,
@@ -644,6 +622,7 @@ async def upload_colruyt_products(batch: ColruytBatchUpload):
                         barcode=barcode,
                         product_name=display_name
                     )
+                    upserted_product_ids.append(product_id)
 
                     await db.create_promotion(
                         store_id=store_id,
@@ -687,6 +666,24 @@ async def upload_colruyt_products(batch: ColruytBatchUpload):
                     "error": str(e)
                 })
 
+        await resource_versions.bump(resource_versions.PROMOTIONS, ["Colruyt", resource_versions.ALL_STORES])
+
+        # ====================================================
+        # PHASE 4: Reprice shopping lists with items on the expired promotions
+        # ====================================================
+        try:
+            repricing = await reprice_lists_for_promotions(deactivated)
+        except Exception as e:
+            logger.error("Repricing shopping lists failed: %s", e)
+            repricing = {"error": str(e)}
+
+        # Items endpoint toont p.price/p.* van de net geüpserte producten: die lijsten niet langer 304
+        try:
+            refreshed = await bump_lists_with_products(upserted_product_ids)
+            logger.info("Bumped %d shopping lists with upserted products", refreshed)
+        except Exception as e:
+            logger.error("Bumping shopping lists with upserted products failed: %s", e)
+
         return {
             "status": "success",
             "store_id": store_id,
@@ -700,6 +697,8 @@ async def upload_colruyt_products(batch: ColruytBatchUpload):
             "not_found": len(results["not_found"]),
             "errors": len(results["errors"]),
             "enriched_by_gemini": len(product_names),
+            "deactivated_promotions": len(deactivated),
+            "repriced_lists": repricing,
             "results": results
         }
 
@@ -752,9 +751,18 @@ async def search_products(q: str, store_name: Optional[str] = None):
 
 
 @router.get("/products/promotions")
-async def get_promotions(store_name: Optional[str] = None):
-    """Get active promotions, optionally filtered by store name."""
+async def get_promotions(
+    response: Response,
+    store_name: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+):
+    """Get active promotions, optionally filtered by store name (304 when the store's version matches)."""
     try:
+        etag = await resource_versions.etag(resource_versions.PROMOTIONS, store_name or resource_versions.ALL_STORES)
+        if resource_versions.not_modified(if_none_match, etag):
+            return Response(status_code=304, headers=resource_versions.headers(etag))
+        response.headers.update(resource_versions.headers(etag))
+
         db = await get_database_service()
 
         store_id = None
@@ -1,129 +1,133 @@
 from app.auth import get_current_user
-from fastapi import APIRouter, HTTPException, Depends
-from app.supabase_client import supabase
-from app.services.shopping_list_service import add_item_by_barcode, get_list_items_with_names, recalculate_list_totals
+from fastapi import APIRouter, HTTPException, Depends, Header, Response
+from pydantic import BaseModel
+from typing import List, Optional
+from app.services import resource_versions, shopping_list_service
+from app.services.shopping_list_service import add_item_by_barcode, add_items_by_barcodes, get_list_items_with_names
+from app.services.product_resolver import resolve_product, resolve_products
 
 router = APIRouter()
 
+MAX_BATCH_ITEMS = 500
+
+
+class BarcodeItem(BaseModel):
+    barcode: str
+    quantity: int = 1
+
+
+class BarcodeItemsRequest(BaseModel):
+    items: List[BarcodeItem]
+
+
+def _valid_quantity(quantity) -> bool:
+    # bool is ook een int in Python; al de rest (strings, floats) zou een DataError (500) geven
+    return isinstance(quantity, int) and not isinstance(quantity, bool) and quantity >= 1
+
+
 @router.post("/shopping-lists", status_code=201)
-def create_shopping_list(data: dict, user_id: str = Depends(get_current_user)):
+async def create_shopping_list(data: dict, user_id: str = Depends(get_current_user)):
     list_name = data.get("list_name")
 
     if not list_name:
         raise HTTPException(status_code=400, detail="Missing list_name")
 
-    result = supabase.table("shopping_lists").insert({
-        "user_id": user_id,
-        "list_name": list_name,
-        "status": "active"
-    }).execute()
+    return await shopping_list_service.create_list(user_id, list_name)
 
-    return result.data[0]
 
-
-#Items ophalen
+#Items ophalen (If-None-Match op de lijst versie: 304 met enkel de eigenaarscheck)
 @router.get("/shopping-lists/{list_id}/items")
-def get_list_items(list_id: str, user_id: str = Depends(get_current_user)):
-    return get_list_items_with_names(supabase, list_id)
+async def get_list_items(
+    list_id: str,
+    response: Response,
+    user_id: str = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None),
+):
+    # Eerst eigenaarschap: geen versie (en dus geen Redis key) voor andermans of verzonnen ids
+    if not await shopping_list_service.owns_list(list_id, user_id):
+        return []
+
+    etag = await resource_versions.etag(resource_versions.LIST, list_id)
+    if resource_versions.not_modified(if_none_match, etag):
+        return Response(status_code=304, headers=resource_versions.headers(etag))
+
+    items = await get_list_items_with_names(list_id, user_id)
+    response.headers.update(resource_versions.headers(etag))
+    return items
 
 
 #Item toevoegen via barcode
 @router.post("/shopping-lists/{list_id}/items/by-barcode", status_code=201)
-def add_item_barcode(list_id: str, data: dict, user_id: str = Depends(get_current_user)):
+async def add_item_barcode(list_id: str, data: dict, user_id: str = Depends(get_current_user)):
     barcode = data.get("barcode")
     quantity = data.get("quantity", 1)
 
     if not barcode:
         raise HTTPException(status_code=400, detail="Missing barcode")
+    if not _valid_quantity(quantity):
+        raise HTTPException(status_code=400, detail="Quantity must be greater then 0")
+
+    match = await resolve_product(barcode)
+    result = await add_item_by_barcode(list_id, user_id, barcode, match, quantity)
 
-    result = add_item_by_barcode(supabase, list_id, barcode, quantity)
-    
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
-    
-    return result
 
-@router.get("/shopping-lists")
-def get_user_lists(user_id: str = Depends(get_current_user)):
-    result = supabase.table("shopping_lists") \
-        .select("*") \
-        .eq("user_id", user_id) \
-        .execute()
+    return result
 
-    return result.data or []
 
+#Meerdere items toevoegen via barcode (hele mand in één request)
+@router.post("/shopping-lists/{list_id}/items/by-barcodes", status_code=201)
+async def add_items_barcodes(list_id: str, data: BarcodeItemsRequest, user_id: str = Depends(get_current_user)):
+    if not data.items:
+        raise HTTPException(status_code=400, detail="Missing items")
+    if len(data.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Max {MAX_BATCH_ITEMS} items per request")
+    if any(not item.barcode for item in data.items):
+        raise HTTPException(status_code=400, detail="Missing barcode")
+    if any(item.quantity < 1 for item in data.items):
+        raise HTTPException(status_code=400, detail="Quantity must be greater then 0")
+
+    # Alle barcodes in één pass door de resolver tiers
+    matches = await resolve_products([item.barcode for item in data.items])
+    result = await add_items_by_barcodes(
+        list_id, user_id, [(item.barcode, item.quantity) for item in data.items], matches
+    )
+    if result is None:
+        raise HTTPException(status_code=404, detail="Lijst niet gevonden")
 
-@router.post("/shopping-lists/items/{item_id}/update")
-def update_item(item_id: str, data: dict, user_id: str = Depends(get_current_user)):
-
-    # Haal list_id op vóór de update (nodig voor herberekening)
-    item_row = supabase.table("shopping_list_items") \
-        .select("list_id, quantity") \
-        .eq("item_id", item_id) \
-        .single() \
-        .execute()
-    if not item_row.data:
-        raise HTTPException(status_code=404, detail="Item niet gevonden")
-    list_id = item_row.data["list_id"]
+    return result
 
-    update_data = {}
+@router.get("/shopping-lists")
+async def get_user_lists(user_id: str = Depends(get_current_user)):
+    return await shopping_list_service.get_user_lists(user_id)
 
-    if "is_checked" in data:
-        update_data["is_checked"] = data["is_checked"]
 
-    if "quantity" in data:
-        if data["quantity"] < 1:
-            raise HTTPException(status_code=400, detail="Quantity must be greater then 0")
-        update_data["quantity"] = data["quantity"]
+@router.post("/shopping-lists/items/{item_id}/update")
+async def update_item(item_id: str, data: dict, user_id: str = Depends(get_current_user)):
+    if "quantity" in data and not _valid_quantity(data["quantity"]):
+        raise HTTPException(status_code=400, detail="Quantity must be greater then 0")
 
-    if not update_data:
+    if "is_checked" not in data and "quantity" not in data:
         raise HTTPException(status_code=400, detail="Nothing to update")
 
-    result = supabase.table("shopping_list_items") \
-        .update(update_data) \
-        .eq("item_id", item_id) \
-        .execute()
-
-    # Herbereken list totals alleen als quantity is gewijzigd (niet bij is_checked)
-    if "quantity" in data:
-        recalculate_list_totals(supabase, list_id)
+    # Eén UPDATE (met eigenaarscheck), totals enkel herberekend als quantity wijzigt
+    item = await shopping_list_service.update_item(
+        item_id, user_id, is_checked=data.get("is_checked"), quantity=data.get("quantity")
+    )
+    if item is None:
+        raise HTTPException(status_code=404, detail="Item niet gevonden")
 
-    return result.data[0]
+    return item
 
 @router.delete("/shopping-lists/items/{item_id}", status_code=204)
-def delete_item(item_id: str, user_id: str = Depends(get_current_user)):
-    # Haal list_id op vóór het verwijderen
-    item_row = supabase.table("shopping_list_items") \
-        .select("list_id") \
-        .eq("item_id", item_id) \
-        .single() \
-        .execute()
-    list_id = item_row.data["list_id"] if item_row.data else None
-
-    supabase.table("shopping_list_items") \
-        .delete() \
-        .eq("item_id", item_id) \
-        .execute()
-
-    if list_id:
-        recalculate_list_totals(supabase, list_id)
+async def delete_item(item_id: str, user_id: str = Depends(get_current_user)):
+    await shopping_list_service.delete_item(item_id, user_id)
 
 
 @router.delete("/shopping-lists/{list_id}", status_code=204)
-def delete_shopping_list(list_id: str, user_id: str = Depends(get_current_user)):
-
-    existing = supabase.table("shopping_lists") \
-        .select("list_id") \
-        .eq("list_id", list_id) \
-        .eq("user_id", user_id) \
-        .execute()
-
-    if not existing.data:
+async def delete_shopping_list(list_id: str, user_id: str = Depends(get_current_user)):
+    if not await shopping_list_service.delete_list(list_id, user_id):
         raise HTTPException(status_code=404, detail="Lijst niet gevonden")
 
-    supabase.table("shopping_lists") \
-        .delete() \
-        .eq("list_id", list_id) \
-        .execute()
-
-    return
\ No newline at end of file
+    return
@@ -1,9 +1,12 @@
+import logging
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from typing import List, Optional
 from app.services.user_services import save_user_settings, get_user_settings
 from app.auth import get_current_user
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 # Schema for user data preferences
@@ -41,7 +44,7 @@ async def save_user_preferences(preferences: UserPreferences):
         return {"message": "User settings saved successfully"}
 
     except Exception as e:
-        print(f"Error saving user settings: {e}")
+        logger.error("Error saving user settings: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -53,5 +56,5 @@ async def get_user_preferences(user_id: str = Depends(get_current_user)):
             return {"total_savings": 0.0}
         return settings
     except Exception as e:
-        print(f"Error fetching user settings: {e}")
+        logger.error("Error fetching user settings: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
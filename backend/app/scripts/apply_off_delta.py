@@ -0,0 +1,193 @@
+"""
+Verwerk OpenFoodFacts delta exports incrementeel in openfoodfacts.db, zonder volledige rebuild.
+
+OFF publiceert dagelijkse deltas (https://static.openfoodfacts.org/data/delta/, JSONL .json.gz
+met de gewijzigde producten). Dit script:
+
+  1. kopieert openfoodfacts.db naar <db>.staging (de API leest ondertussen gewoon verder),
+  2. upsert de producten uit de deltas (zelfde landfilter en kolommen als build_off_database)
+     en houdt products_fts mee in sync,
+  3. onthoudt welke deltas al verwerkt zijn (tabel off_deltas, opnieuw draaien is veilig),
+  4. wisselt het bestand atomisch om (os.replace).
+
+Workers merken het nieuwe bestand op via inode/mtime (off_database.current_generation) en
+openen hun read-only connecties lazy opnieuw; lopende lookups lezen het oude bestand uit.
+Er wordt dus nooit een half geschreven database gelezen. Met dezelfde generatie check
+vergeten ze hun product caches (geheugen + Redis prefix), bouwen ze de fuzzy matcher
+opnieuw en laden ze de columnar store opnieuw; bestaat die export, dan wordt hij hier
+meteen opnieuw geëxporteerd (tot dan gaan lookups naar SQLite).
+
+Gebruik (vanuit backend/):
+    python -m app.scripts.apply_off_delta pad/naar/deltas/
+    python -m app.scripts.apply_off_delta openfoodfacts_products_1700000000_1700086400.json.gz
+    python -m app.scripts.apply_off_delta deltas/ --db pad/naar/openfoodfacts.db --countries be,nl
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from app.scripts.backfill_gtin import backfill_sqlite
+from app.scripts.build_fts_index import FTS_TABLE, index_products
+from app.scripts.build_off_database import (
+    COLUMNS, COUNTRY_TAGS, DEFAULT_COUNTRIES, create_indexes, iter_rows, parse_countries, peak_rss_mb,
+)
+from app.scripts.export_columnar_store import export_columnar_store
+from app.services.columnar_store import COLUMNAR_DIR, MANIFEST
+from app.services.off_database import DB_PATH
+
+UPSERT_BATCH_SIZE = 20000
+CHUNK_SIZE = 900   # max ? parameters per query
+
+
+def _delta_files(paths: List[Path]) -> List[Path]:
+    files = []
+    for path in paths:
+        if path.is_dir():
+            files += sorted(p for p in path.iterdir() if p.name.endswith((".json.gz", ".jsonl.gz", ".jsonl", ".json")))
+        else:
+            files.append(path)
+    return files
+
+
+def _prepare(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS off_deltas (
+            name TEXT PRIMARY KEY,
+            applied_at REAL NOT NULL,
+            rows INTEGER NOT NULL
+        )
+    """)
+    # Oudere databases: dubbele barcodes weg zodat de unieke index (upsert target) kan
+    has_unique = any(
+        index["unique"] and [c["name"] for c in conn.execute(f"PRAGMA index_info({index['name']})")] == ["barcode"]
+        for index in conn.execute("PRAGMA index_list(products)")
+    )
+    if not has_unique:
+        conn.execute("DELETE FROM products WHERE rowid NOT IN (SELECT MAX(rowid) FROM products GROUP BY barcode)")
+    create_indexes(conn)
+    conn.commit()
+
+
+def _reindex_fts(conn: sqlite3.Connection, barcodes: List[str]):
+    """Replace the products_fts entries of the upserted barcodes."""
+    for i in range(0, len(barcodes), CHUNK_SIZE):
+        chunk = barcodes[i:i + CHUNK_SIZE]
+        placeholders = ",".join("?" for _ in chunk)
+        rows = conn.execute(
+            f"SELECT rowid, product_name, brands FROM products WHERE barcode IN ({placeholders})", chunk
+        ).fetchall()
+        conn.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = ?", [(row[0],) for row in rows])
+        index_products(conn, rows)
+
+
+def _apply_file(conn: sqlite3.Connection, path: Path, countries: Optional[set], fts: bool) -> int:
+    upsert = f"""
+        INSERT INTO products ({", ".join(COLUMNS)})
+        VALUES ({", ".join("?" for _ in COLUMNS)})
+        ON CONFLICT(barcode) DO UPDATE SET
+            {", ".join(f"{c} = excluded.{c}" for c in COLUMNS[1:])}
+    """
+    rows = iter_rows(path, countries)
+    total = 0
+    while True:
+        batch = [row for _, row in zip(range(UPSERT_BATCH_SIZE), rows)]
+        if not batch:
+            break
+        conn.executemany(upsert, batch)
+        if fts:
+            _reindex_fts(conn, list(dict.fromkeys(row[0] for row in batch)))
+        total += len(batch)
+    conn.execute(
+        "INSERT OR REPLACE INTO off_deltas (name, applied_at, rows) VALUES (?, ?, ?)",
+        (path.name, time.time(), total),
+    )
+    conn.commit()
+    return total
+
+
+def apply_off_deltas(db_path: Path, files: List[Path], countries: Optional[set]) -> dict:
+    """Apply the delta files to a staging copy of db_path and swap it in; return stats."""
+    start = time.perf_counter()
+    staging = db_path.with_name(db_path.name + ".staging")
+    shutil.copyfile(db_path, staging)
+
+    with sqlite3.connect(staging) as conn:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(products)")}
+    if "gtin14" not in columns:
+        backfill_sqlite(staging)
+
+    conn = sqlite3.connect(staging)
+    conn.row_factory = sqlite3.Row
+    # Staging kopie: bij een crash wordt ze gewoon weggegooid, dus geen journal nodig
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -131072")   # 128 MB
+    _prepare(conn)
+    fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,)).fetchone() is not None
+
+    applied = {row[0] for row in conn.execute("SELECT name FROM off_deltas")}
+    stats = {"files": 0, "skipped": 0, "rows": 0}
+    for path in files:
+        if path.name in applied:
+            stats["skipped"] += 1
+            continue
+        rows = _apply_file(conn, path, countries, fts)
+        print(f"  {path.name}: {rows} products upserted", flush=True)
+        stats["files"] += 1
+        stats["rows"] += rows
+
+    if stats["files"]:
+        if fts:
+            conn.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        conn.execute("ANALYZE")
+        conn.commit()
+    conn.close()
+
+    if stats["files"]:
+        # Eerst naar schijf, dan pas omwisselen: workers zien enkel een volledig bestand
+        with open(staging, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(staging, db_path)
+    else:
+        staging.unlink()
+
+    stats["seconds"] = round(time.perf_counter() - start, 1)
+    stats["peak_rss_mb"] = peak_rss_mb()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("deltas", type=Path, nargs="+", help="delta bestanden of een map met deltas")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--countries", default=DEFAULT_COUNTRIES,
+                        help=f"landcodes ({', '.join(COUNTRY_TAGS)}) of 'all'")
+    args = parser.parse_args()
+
+    if not args.db.exists():
+        parser.error(f"{args.db} bestaat niet (bouw hem eerst met app.scripts.build_off_database)")
+    files = _delta_files(args.deltas)
+    missing = [str(f) for f in files if not f.exists()]
+    if missing:
+        parser.error(f"bestaat niet: {', '.join(missing)}")
+    try:
+        countries = parse_countries(args.countries)
+    except ValueError as e:
+        parser.error(str(e))
+
+    stats = apply_off_deltas(args.db, files, countries)
+    if stats["files"]:
+        print(f"{stats['rows']} products from {stats['files']} deltas applied to {args.db} in {stats['seconds']}s")
+        if args.db.resolve() == DB_PATH.resolve() and (COLUMNAR_DIR / MANIFEST).exists():
+            start = time.perf_counter()
+            total = export_columnar_store(args.db, COLUMNAR_DIR)
+            print(f"columnar store re-exported: {total} products in {time.perf_counter() - start:.1f}s")
+    print(f"{stats['skipped']} deltas already applied")
+
+
+if __name__ == "__main__":
+    main()
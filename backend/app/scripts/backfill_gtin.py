@@ -0,0 +1,130 @@
+"""
+Eenmalige backfill van de canonical GTIN-14 sleutel (kolom gtin14 + index).
+
+  SQLite  : products.gtin14 in openfoodfacts.db
+  Postgres: products.gtin14 in de Supabase database (DATABASE_URL), plus een trigger
+            (products_gtin14) die gtin14 vult bij elke insert en barcode update, ook voor
+            rijen van de scraper en de Supabase client. Zolang die trigger ontbreekt
+            zoeken de lookups ook nog op de barcode vormen van rijen zonder gtin14.
+
+De API opent openfoodfacts.db immutable: stop de backend tijdens de SQLite backfill
+(of draai op een kopie met --db en vervang het bestand daarna).
+
+Gebruik (vanuit backend/):
+    python -m app.scripts.backfill_gtin
+    python -m app.scripts.backfill_gtin --sqlite-only --db pad/naar/openfoodfacts.db
+    python -m app.scripts.backfill_gtin --postgres-only
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from app.services.gtin import normalize_gtin
+from app.services.off_database import DB_PATH
+
+# Zelfde sleutel als app.services.gtin.normalize_gtin: cijfers (spaties/streepjes weg),
+# hoogstens 14, links aangevuld met nullen; anders NULL
+POSTGRES_NORMALIZE_FUNCTION = """
+CREATE OR REPLACE FUNCTION normalize_gtin(code text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT CASE WHEN d ~ '^[0-9]{1,14}$' THEN lpad(d, 14, '0') END
+    FROM (SELECT translate(btrim(code, E' \\t\\n\\r\\f\\x0B'), ' -', '') AS d) s
+$$
+"""
+
+POSTGRES_TRIGGER_FUNCTION = """
+CREATE OR REPLACE FUNCTION products_fill_gtin14() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.gtin14 := normalize_gtin(NEW.barcode);
+    RETURN NEW;
+END
+$$
+"""
+
+POSTGRES_TRIGGER = """
+DROP TRIGGER IF EXISTS products_gtin14 ON products;
+CREATE TRIGGER products_gtin14
+BEFORE INSERT OR UPDATE OF barcode ON products
+FOR EACH ROW EXECUTE FUNCTION products_fill_gtin14()
+"""
+
+# Of de backfill gedraaid heeft; ook via de Supabase client op te vragen (rpc)
+POSTGRES_FILLED_FUNCTION = """
+CREATE OR REPLACE FUNCTION products_gtin14_filled() RETURNS boolean
+LANGUAGE sql STABLE AS $$
+    SELECT EXISTS (
+        SELECT 1 FROM pg_trigger
+        WHERE tgname = 'products_gtin14' AND tgrelid = 'products'::regclass
+    )
+$$
+"""
+
+
+def backfill_sqlite(db_path: Path):
+    start = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    conn.create_function("normalize_gtin", 1, normalize_gtin, deterministic=True)
+
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(products)")}
+    if "gtin14" not in columns:
+        conn.execute("ALTER TABLE products ADD COLUMN gtin14 TEXT")
+
+    updated = conn.execute(
+        "UPDATE products SET gtin14 = normalize_gtin(barcode) WHERE gtin14 IS NULL"
+    ).rowcount
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_gtin14 ON products (gtin14)")
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    print(f"SQLite: {updated} rows backfilled in {time.perf_counter() - start:.1f}s ({db_path})")
+
+
+async def backfill_postgres(database_url: str):
+    import asyncpg
+
+    start = time.perf_counter()
+    conn = await asyncpg.connect(database_url)
+    try:
+        await conn.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS gtin14 text")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_products_gtin14 ON products (gtin14)")
+
+        # Trigger en vulling in één transactie: vanaf de commit heeft elke rij zijn sleutel
+        async with conn.transaction():
+            for statement in (POSTGRES_NORMALIZE_FUNCTION, POSTGRES_TRIGGER_FUNCTION,
+                              POSTGRES_TRIGGER, POSTGRES_FILLED_FUNCTION):
+                await conn.execute(statement)
+            result = await conn.execute(
+                "UPDATE products SET gtin14 = normalize_gtin(barcode) "
+                "WHERE gtin14 IS DISTINCT FROM normalize_gtin(barcode)"
+            )
+
+        await conn.execute("ANALYZE products")
+        print(f"Postgres: {int(result.split()[-1])} rows backfilled, trigger products_gtin14 installed "
+              f"in {time.perf_counter() - start:.1f}s")
+    finally:
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--sqlite-only", action="store_true")
+    parser.add_argument("--postgres-only", action="store_true")
+    args = parser.parse_args()
+
+    if not args.postgres_only:
+        backfill_sqlite(args.db)
+
+    if not args.sqlite_only:
+        database_url = os.getenv("DATABASE_URL")
+        if not database_url:
+            parser.error("DATABASE_URL is niet gezet (of gebruik --sqlite-only)")
+        asyncio.run(backfill_postgres(database_url))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Benchmark: latency percentielen van /food/barcode, oude (seriële) vs nieuwe (async) pipeline.
+
+Netwerk round trips naar Supabase/Postgres worden gesimuleerd met --rtt-ms, zodat beide
+paden dezelfde I/O kosten hebben en enkel de structuur verschilt:
+
+  legacy : sync def in de threadpool, na elkaar: SQLite lookup, products select (image_url),
+           duplicate check, products select (product_id), scanned_items insert
+  async  : de echte get_product_by_barcode; product resolutie (één round trip) en duplicate
+           check gelijktijdig, de insert gaat gebundeld via de scan log queue
+
+Gebruik (vanuit backend/):
+    python -m app.scripts.benchmark_barcode_pipeline
+    python -m app.scripts.benchmark_barcode_pipeline --rtt-ms 40 --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services import openfoodfacts_service, scan_log_queue
+from app.services.product_service import ProductMatch
+
+THREADPOOL_SIZE = 40      # standaard limiet van de FastAPI/anyio threadpool voor sync routes
+LOCAL_LOOKUP_MS = 0.2     # SQLite lookup op een warme connectie
+
+
+def _match(barcode: str) -> ProductMatch:
+    return ProductMatch(
+        barcode=barcode, product_name="Benchmark product", brands="Bench",
+        energy_kcal_100g=100.0, proteins_100g=1.0, carbohydrates_100g=10.0, fat_100g=1.0,
+        sugars_100g=5.0, fiber_100g=1.0, salt_100g=0.1, product_id=None,
+    )
+
+
+def _legacy_request(barcode: str, rtt: float):
+    time.sleep(LOCAL_LOOKUP_MS / 1000)   # SQLite
+    time.sleep(rtt)                      # products select image_url
+    time.sleep(rtt)                      # check_recent_scan
+    time.sleep(rtt)                      # products select product_id
+    time.sleep(rtt)                      # scanned_items insert
+    return openfoodfacts_service.to_scan_payload(_match(barcode))
+
+
+class _SimulatedDatabase:
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+
+    async def last_scan_at(self, user_id, barcode, window_minutes):
+        await asyncio.sleep(self.rtt)
+        return None
+
+    async def insert_scans(self, scans):
+        await asyncio.sleep(self.rtt)
+        return len(scans)
+
+
+def _simulate_async_io(rtt: float):
+    """Point the async pipeline at simulated I/O with the same round trip cost."""
+    database = _SimulatedDatabase(rtt)
+
+    async def resolve_product(barcode, use_api=True):
+        await asyncio.sleep(rtt)   # memory/redis miss, één postgres round trip
+        return _match(barcode)
+
+    async def get_database_service():
+        return database
+
+    openfoodfacts_service.resolve_product = resolve_product
+    openfoodfacts_service.get_database_service = get_database_service
+    openfoodfacts_service.DATABASE_URL = "simulated"
+    scan_log_queue.get_database_service = get_database_service
+    scan_log_queue.DATABASE_URL = "simulated"
+
+
+async def _run(request, total: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await request(f"54000000{i:05d}")
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return latencies, total / (time.perf_counter() - start)
+
+
+def _percentile(sorted_values: list, p: float) -> float:
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _report(label: str, latencies: list, throughput: float):
+    values = sorted(latencies)
+    p50, p95, p99 = (_percentile(values, p) for p in (50, 95, 99))
+    print(f"{label:7s}: p50 {p50:7.1f} ms  p95 {p95:7.1f} ms  p99 {p99:7.1f} ms  ({throughput:.0f} req/s)")
+
+
+async def main_async(args):
+    rtt = args.rtt_ms / 1000
+    pool = ThreadPoolExecutor(max_workers=THREADPOOL_SIZE)
+    loop = asyncio.get_running_loop()
+
+    async def legacy(barcode):
+        return await loop.run_in_executor(pool, _legacy_request, barcode, rtt)
+
+    _simulate_async_io(rtt)
+
+    async def new(barcode):
+        return await openfoodfacts_service.get_product_by_barcode(barcode, user_id="benchmark-user")
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, simulated round trip {args.rtt_ms} ms")
+    _report("legacy", *await _run(legacy, args.requests, args.concurrency))
+    with contextlib.redirect_stdout(io.StringIO()):   # geen "Scan logged" regel per request
+        results = await _run(new, args.requests, args.concurrency)
+        await scan_log_queue.stop()
+    _report("async", *results)
+    pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt-ms", type=float, default=25.0)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark: Delhaize naam-matching over een opgenomen batch.
+
+  per product : find_product_by_name per naam (FTS5/LIKE), zoals voorheen
+  candidates  : FuzzyMatcher.for_names, index over enkel de FTS kandidaten van de batch
+  fuzzy batch : match_batch over de hele batch (gevectoriseerde scoring)
+  full table  : met --full-table ook de index over de hele tabel (fallback zonder products_fts)
+
+Gebruik (vanuit backend/):
+    python -m app.scripts.benchmark_fuzzy_matcher --batch delhaize_batch.json
+    python -m app.scripts.benchmark_fuzzy_matcher --sample 1500     # namen uit de DB als batch
+
+delhaize_batch.json is de body van een /products/batch-upload-delhaize request
+(lijst van objecten met minstens "name").
+"""
+import argparse
+import json
+import random
+import sqlite3
+import time
+from pathlib import Path
+
+from app.services import off_database
+from app.services.fuzzy_matcher import FuzzyMatcher
+from app.services.product_service import find_product_by_name
+
+
+def load_batch(path: Path) -> list:
+    data = json.loads(path.read_text(encoding="utf-8"))
+    if isinstance(data, dict):
+        data = data.get("products", [])
+    return [item["name"] for item in data if item.get("name")]
+
+
+def sample_batch(db_path: Path, n: int) -> list:
+    """Winkelstijl namen uit de DB: merk vooraan, zoals Delhaize ze toont."""
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        "SELECT product_name, brands FROM products WHERE product_name IS NOT NULL ORDER BY RANDOM() LIMIT ?", (n,)
+    ).fetchall()
+    conn.close()
+    rng = random.Random(5)
+    names = []
+    for name, brands in rows:
+        brand = (brands or "").split(",")[0].strip()
+        names.append(f"{brand} {name}".strip() if brand and rng.random() < 0.8 else name)
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, default=off_database.DB_PATH)
+    parser.add_argument("--batch", type=Path, help="opgenomen Delhaize batch (JSON)")
+    parser.add_argument("--sample", type=int, default=1500, help="aantal DB-namen als er geen --batch is")
+    parser.add_argument("--skip-baseline", action="store_true")
+    parser.add_argument("--full-table", action="store_true", help="ook de index over de hele tabel meten")
+    args = parser.parse_args()
+
+    if not args.db.exists():
+        parser.error(f"{args.db} bestaat niet")
+    off_database.DB_PATH = args.db
+    names = load_batch(args.batch) if args.batch else sample_batch(args.db, args.sample)
+    print(f"Batch: {len(names)} names, database: {args.db}")
+
+    if not args.skip_baseline:
+        start = time.perf_counter()
+        baseline = [find_product_by_name(name, limit=1, min_score=70.0) for name in names]
+        elapsed = time.perf_counter() - start
+        print(f"per product : {elapsed:8.3f}s  {len(names) / elapsed:>9,.0f} names/s  "
+              f"matched {sum(1 for m in baseline if m)}")
+
+    start = time.perf_counter()
+    matcher = FuzzyMatcher.for_names(names)
+    print(f"candidates  : {time.perf_counter() - start:8.3f}s  ({len(matcher)} products, per batch)")
+    run_batch("fuzzy batch", matcher, names)
+
+    if args.full_table:
+        start = time.perf_counter()
+        matcher = FuzzyMatcher.from_database()
+        print(f"full build  : {time.perf_counter() - start:8.3f}s  ({len(matcher)} products, once per worker)")
+        run_batch("full table", matcher, names)
+
+
+def run_batch(label: str, matcher: FuzzyMatcher, names: list):
+    start = time.perf_counter()
+    matches = matcher.match_batch(names, min_score=70.0)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12}: {elapsed:8.3f}s  {len(names) / elapsed:>9,.0f} names/s  "
+          f"matched {sum(1 for m in matches if m)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Benchmark: throughput van GET /food/barcode met synchrone vs queued logging, elk met en zonder sampling.
+
+De request gaat door de volledige ASGI app (middleware, auth dependency, router, pipeline);
+database round trips worden gesimuleerd zoals in benchmark_barcode_pipeline. De log output
+gaat naar een stream met een vaste kost per write (--write-us), zoals een terminal, docker
+log driver of pipe naar een log collector:
+
+  print  : elke log regel synchroon op de stream (gedrag van de oude print())
+  queued : logging_config.setup_logging(): QueueHandler + listener thread
+
+Beide lopen zonder sampling en met 1 op --sample-every voor high-frequency events, zodat
+de winst van de queue en die van sampling apart zichtbaar zijn.
+
+Gebruik (vanuit backend/):
+    python -m app.scripts.benchmark_logging
+    python -m app.scripts.benchmark_logging --requests 5000 --concurrency 50 --write-us 200
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+import httpx
+
+from app import auth, logging_config
+from app.main import app
+from app.scripts.benchmark_barcode_pipeline import _percentile, _simulate_async_io
+from app.services import scan_log_queue
+
+
+class _SlowStream:
+    """File-like stream with a fixed blocking cost per write."""
+
+    def __init__(self, write_us: float):
+        self.delay = write_us / 1_000_000
+        self.lines = 0
+        self._out = open(os.devnull, "w")
+
+    def write(self, text: str):
+        time.sleep(self.delay)
+        self.lines += 1
+        self._out.write(text)
+
+    def flush(self):
+        self._out.flush()
+
+
+def _configure(mode: str, sample_every: int, stream: _SlowStream):
+    logging_config.shutdown_logging()
+    root = logging.getLogger("app")
+    if mode == "print":
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        handler.addFilter(logging_config.SamplingFilter(sample_every))
+        root.handlers = [handler]
+        root.setLevel(logging.DEBUG)
+    else:
+        logging_config.LOG_LEVEL = "DEBUG"
+        logging_config.SAMPLE_EVERY = sample_every
+        logging_config.setup_logging(stream)
+
+
+async def _fake_user():
+    # Zelfde log event als een echte token verificatie ("AUTH OK" in de oude code)
+    auth.logger.debug("Auth OK for %s", "benchmark-user", extra={"sample": "auth_ok"})
+    return "benchmark-user"
+
+
+async def _run(total: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one(i: int):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(f"/food/barcode/54000000{i:05d}")
+                response.raise_for_status()
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+    await scan_log_queue.stop()
+    return latencies, total / elapsed
+
+
+async def main_async(args):
+    _simulate_async_io(args.rtt_ms / 1000)
+    app.dependency_overrides[auth.get_current_user] = _fake_user
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, "
+          f"simulated round trip {args.rtt_ms} ms, {args.write_us} µs per log write")
+    throughputs = {}
+    for mode in ("print", "queued"):
+        for sample_every in (1, args.sample_every):
+            stream = _SlowStream(args.write_us)
+            _configure(mode, sample_every, stream)
+            latencies, throughput = await _run(args.requests, args.concurrency)
+            logging_config.shutdown_logging()   # wacht tot de listener alles geschreven heeft
+            throughputs[mode, sample_every] = throughput
+            values = sorted(latencies)
+            p50, p99 = _percentile(values, 50), _percentile(values, 99)
+            sampling = f"1/{sample_every}" if sample_every > 1 else "off"
+            print(f"{mode:6s} sampling {sampling:5s}: {throughput:7.0f} req/s  p50 {p50:6.1f} ms  "
+                  f"p99 {p99:6.1f} ms  ({stream.lines} log lines written)")
+
+    sampled = args.sample_every
+    print(f"queue alone    : {throughputs['queued', 1] / throughputs['print', 1]:.2f}x  (both unsampled)")
+    print(f"sampling alone : {throughputs['print', sampled] / throughputs['print', 1]:.2f}x  (both print)")
+    print(f"combined       : {throughputs['queued', sampled] / throughputs['print', 1]:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt-ms", type=float, default=2.0)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--write-us", type=float, default=100.0)
+    parser.add_argument("--sample-every", type=int, default=logging_config.SAMPLE_EVERY)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Benchmark: barcode lookups/sec tegen openfoodfacts.db, oude vs nieuwe connectie-aanpak.
+
+  legacy   : nieuwe sqlite3 connectie per lookup + close (oude get_db_connection)
+  pooled   : herbruikbare read-only/immutable/mmap connectie per thread (off_database)
+  columnar : memory-mapped kolommen + searchsorted (columnar_store), per barcode en als batch
+
+Gebruik (vanuit backend/):
+    python -m app.scripts.benchmark_off_lookups
+    python -m app.scripts.benchmark_off_lookups --db pad/naar/openfoodfacts.db --lookups 20000
+    python -m app.scripts.benchmark_off_lookups --synthetic 200000   # zonder echte DB
+    python -m app.scripts.benchmark_off_lookups --columnar           # export naar een tijdelijke map
+"""
+import argparse
+import random
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from app.services import off_database
+from app.services.columnar_store import ColumnarStore
+
+LOOKUP_SQL = """
+    SELECT barcode, product_name, brands,
+           energy_kcal_100g, proteins_100g, carbohydrates_100g,
+           fat_100g, sugars_100g, fiber_100g, salt_100g
+    FROM products
+    WHERE barcode IN ({placeholders})
+"""
+
+
+def _variations(barcode: str) -> list:
+    variations = [barcode]
+    stripped = barcode.lstrip('0')
+    if stripped != barcode:
+        variations.append(stripped)
+    if len(barcode) == 12:
+        variations.append('0' + barcode)
+    if len(stripped) == 12:
+        variations.append('0' + stripped)
+    return variations
+
+
+def _lookup(conn: sqlite3.Connection, barcode: str):
+    variations = _variations(barcode)
+    sql = LOOKUP_SQL.format(placeholders=','.join('?' for _ in variations))
+    return conn.execute(sql, variations).fetchone()
+
+
+def legacy_lookup(db_path: Path, barcode: str):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    row = _lookup(conn, barcode)
+    conn.close()
+    return row
+
+
+def pooled_lookup(barcode: str):
+    return _lookup(off_database.get_connection(), barcode)
+
+
+def build_synthetic_db(rows: int) -> Path:
+    path = Path(tempfile.mkdtemp()) / "openfoodfacts_bench.db"
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE products (
+            barcode TEXT PRIMARY KEY, product_name TEXT, brands TEXT,
+            energy_kcal_100g REAL, proteins_100g REAL, carbohydrates_100g REAL,
+            fat_100g REAL, sugars_100g REAL, fiber_100g REAL, salt_100g REAL
+        )
+    """)
+    rng = random.Random(42)
+    conn.executemany(
+        "INSERT OR IGNORE INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            (f"54{i:011d}", f"Product {i}", f"Merk {i % 500}",
+             rng.uniform(0, 900), rng.uniform(0, 40), rng.uniform(0, 90),
+             rng.uniform(0, 60), rng.uniform(0, 50), rng.uniform(0, 15), rng.uniform(0, 3))
+            for i in range(rows)
+        ),
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def sample_barcodes(db_path: Path, n: int) -> list:
+    conn = sqlite3.connect(db_path)
+    known = [r[0] for r in conn.execute("SELECT barcode FROM products ORDER BY RANDOM() LIMIT ?", (n,))]
+    conn.close()
+    # ~20% misses, zoals bij onbekende promo-barcodes
+    misses = [f"99{i:011d}" for i in range(max(1, n // 5))]
+    barcodes = known + misses
+    random.Random(7).shuffle(barcodes)
+    return barcodes
+
+
+def run(label: str, fn, barcodes: list) -> float:
+    start = time.perf_counter()
+    for barcode in barcodes:
+        fn(barcode)
+    elapsed = time.perf_counter() - start
+    rate = len(barcodes) / elapsed
+    print(f"{label:<8} {len(barcodes):>7} lookups in {elapsed:7.3f}s  -> {rate:>10,.0f} lookups/s")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, default=off_database.DB_PATH)
+    parser.add_argument("--lookups", type=int, default=10000)
+    parser.add_argument("--synthetic", type=int, default=0, help="bouw een tijdelijke DB met N rijen")
+    parser.add_argument("--columnar", action="store_true", help="meet ook de kolomgewijze store")
+    args = parser.parse_args()
+
+    db_path = build_synthetic_db(args.synthetic) if args.synthetic else args.db
+    if not db_path.exists():
+        parser.error(f"{db_path} bestaat niet (gebruik --synthetic N)")
+
+    off_database.DB_PATH = db_path
+    barcodes = sample_barcodes(db_path, args.lookups)
+
+    print(f"Database: {db_path}")
+    legacy = run("legacy", lambda b: legacy_lookup(db_path, b), barcodes)
+    pooled = run("pooled", pooled_lookup, barcodes)
+    print(f"Speedup: {pooled / legacy:.1f}x")
+
+    if args.columnar:
+        from app.scripts.export_columnar_store import export_columnar_store
+
+        out = Path(tempfile.mkdtemp()) / "off_columnar"
+        export_columnar_store(db_path, out)
+        store = ColumnarStore(out)
+        columnar = run("columnar", store.get, barcodes)
+        start = time.perf_counter()
+        store.nutrients_for_slots(store.slots(barcodes))
+        batch = len(barcodes) / (time.perf_counter() - start)
+        print(f"{'batch':<8} {len(barcodes):>7} lookups in one call -> {batch:>10,.0f} lookups/s")
+        print(f"Columnar vs pooled: {columnar / pooled:.1f}x per barcode, {batch / pooled:.1f}x batched")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Bouw de FTS5 full-text index (products_fts) voor naam-zoeken in openfoodfacts.db.
+
+De index bevat genormaliseerde naam- en merk-tokens (lowercase, zonder accenten,
+ligaturen uitgeschreven, Franse elisies en NL/FR lidwoorden weg) met rowid = products.rowid.
+find_product_by_name gebruikt hem automatisch zodra de tabel bestaat.
+
+De API opent openfoodfacts.db immutable: stop de backend tijdens het bouwen
+(of bouw op een kopie met --db en vervang het bestand daarna).
+
+Gebruik (vanuit backend/):
+    python -m app.scripts.build_fts_index
+    python -m app.scripts.build_fts_index --db pad/naar/openfoodfacts.db
+"""
+import argparse
+import sqlite3
+import time
+from pathlib import Path
+
+from app.services.off_database import DB_PATH
+from app.services.text_normalization import tokenize
+
+FTS_TABLE = "products_fts"
+INSERT_BATCH_SIZE = 50000
+
+
+def _index_text(text) -> str:
+    # Stopwoorden blijven weg uit de index; de query doet hetzelfde
+    return " ".join(tokenize(text))
+
+
+def index_products(conn: sqlite3.Connection, rows):
+    """Add (rowid, product_name, brands) rows to products_fts."""
+    conn.executemany(
+        f"INSERT INTO {FTS_TABLE} (rowid, name, brands) VALUES (?, ?, ?)",
+        [(rowid, _index_text(name), _index_text(brands)) for rowid, name, brands in rows],
+    )
+
+
+def build_fts_index(conn: sqlite3.Connection) -> int:
+    """(Re)create products_fts from the products table, return the number of indexed rows."""
+    conn.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    conn.execute(f"""
+        CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+            name, brands,
+            tokenize = "unicode61 remove_diacritics 2 tokenchars '.'"
+        )
+    """)
+
+    read = conn.execute("SELECT rowid, product_name, brands FROM products")
+    total = 0
+    while True:
+        rows = read.fetchmany(INSERT_BATCH_SIZE)
+        if not rows:
+            break
+        index_products(conn, rows)
+        total += len(rows)
+
+    conn.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    conn.commit()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    # Offline bulk insert: journaling uit
+    conn = sqlite3.connect(args.db)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    total = build_fts_index(conn)
+    conn.close()
+    print(f"{FTS_TABLE}: {total} products indexed in {time.perf_counter() - start:.1f}s ({args.db})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+Bouw openfoodfacts.db opnieuw op uit de OpenFoodFacts export, streaming (constant geheugen).
+
+Ondersteunde bronnen (optioneel .gz):
+  en.openfoodfacts.org.products.csv    tab-gescheiden CSV export
+  openfoodfacts-products.jsonl         JSONL export (één product per regel)
+
+Alleen producten verkocht in de gekozen landen (standaard BE/NL/FR) en alleen de kolommen
+die de services lezen worden bewaard. Laden gebeurt in grote transacties met journaling uit;
+daarna dubbele barcodes weg, indexen (barcode, gtin14), FTS5 index, ANALYZE en VACUUM.
+
+Er wordt naar <db>.building geschreven en pas op het einde omgewisseld (os.replace): een
+draaiende API blijft het oude bestand lezen tot zijn connecties opnieuw geopend worden.
+
+Gebruik (vanuit backend/):
+    python -m app.scripts.build_off_database --source en.openfoodfacts.org.products.csv.gz
+    python -m app.scripts.build_off_database --source openfoodfacts-products.jsonl.gz --countries be,nl
+    python -m app.scripts.build_off_database --source dump.csv --out pad/naar/openfoodfacts.db --no-fts
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+from app.scripts.build_fts_index import build_fts_index
+from app.services.gtin import normalize_gtin
+from app.services.off_database import DB_PATH
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+INSERT_BATCH_SIZE = 100000
+
+COUNTRY_TAGS = {
+    "be": "en:belgium",
+    "nl": "en:netherlands",
+    "fr": "en:france",
+    "lu": "en:luxembourg",
+    "de": "en:germany",
+}
+DEFAULT_COUNTRIES = "be,nl,fr"
+
+# Kolommen van de products tabel, in deze volgorde ingevoegd
+COLUMNS = (
+    "barcode", "gtin14", "product_name", "brands",
+    "energy_kcal_100g", "proteins_100g", "carbohydrates_100g",
+    "fat_100g", "sugars_100g", "fiber_100g", "salt_100g",
+)
+
+# OFF veldnaam per nutriënt kolom
+NUTRIENT_FIELDS = {
+    "energy_kcal_100g": "energy-kcal_100g",
+    "proteins_100g": "proteins_100g",
+    "carbohydrates_100g": "carbohydrates_100g",
+    "fat_100g": "fat_100g",
+    "sugars_100g": "sugars_100g",
+    "fiber_100g": "fiber_100g",
+    "salt_100g": "salt_100g",
+}
+
+CREATE_PRODUCTS = """
+    CREATE TABLE products (
+        id INTEGER PRIMARY KEY,            -- vaste rowid: products_fts verwijst ernaar, ook na VACUUM
+        barcode TEXT NOT NULL,
+        gtin14 TEXT,
+        product_name TEXT,
+        brands TEXT,
+        energy_kcal_100g REAL,
+        proteins_100g REAL,
+        carbohydrates_100g REAL,
+        fat_100g REAL,
+        sugars_100g REAL,
+        fiber_100g REAL,
+        salt_100g REAL
+    )
+"""
+
+
+def parse_countries(value: str) -> Optional[set]:
+    """OFF country tags for "be,nl,fr" (None for "all" = no filter)."""
+    if value == "all":
+        return None
+    codes = [c.strip().lower() for c in value.split(",") if c.strip()]
+    unknown = [c for c in codes if c not in COUNTRY_TAGS]
+    if unknown:
+        raise ValueError(f"onbekende landcodes: {', '.join(unknown)}")
+    return {COUNTRY_TAGS[c] for c in codes}
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident memory of this process in MB (None where the platform can't tell)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux geeft KB, macOS bytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def _open_text(path: Path):
+    if path.suffix == ".gz":
+        return io.TextIOWrapper(gzip.open(path, "rb"), encoding="utf-8", errors="replace", newline="")
+    return open(path, encoding="utf-8", errors="replace", newline="")
+
+
+def _number(value) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number == number else None   # NaN weg
+
+
+def _text(value) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _tags(value) -> set:
+    if not value:
+        return set()
+    if isinstance(value, str):
+        return {tag.strip() for tag in value.split(",")}
+    return set(value)
+
+
+def _energy_kcal(nutriments: dict) -> Optional[float]:
+    kcal = _number(nutriments.get("energy-kcal_100g"))
+    if kcal is None:
+        # Sommige producten hebben enkel kJ
+        kj = _number(nutriments.get("energy-kj_100g")) or _number(nutriments.get("energy_100g"))
+        if kj is not None:
+            kcal = round(kj / 4.184, 1)
+    return kcal
+
+
+def record_to_row(record: dict, countries: Optional[set]) -> Optional[tuple]:
+    """
+    Row for the products table (in COLUMNS order) from one OFF product, or None when
+    it has no barcode or isn't sold in one of the countries (None = no country filter).
+    Works for CSV rows (flat) and JSONL products (nutriments nested).
+    """
+    barcode = _text(record.get("code"))
+    if not barcode:
+        return None
+    if countries is not None and not countries & _tags(record.get("countries_tags")):
+        return None
+
+    nutriments = record.get("nutriments")
+    if not isinstance(nutriments, dict):
+        nutriments = record
+    values = [_energy_kcal(nutriments)]
+    values += [_number(nutriments.get(NUTRIENT_FIELDS[c])) for c in COLUMNS[5:]]
+    return (
+        barcode, normalize_gtin(barcode),
+        _text(record.get("product_name")), _text(record.get("brands")),
+        *values,
+    )
+
+
+def _iter_csv(path: Path) -> Iterator[dict]:
+    csv.field_size_limit(2 ** 31 - 1)   # sommige OFF velden zijn enorm
+    with _open_text(path) as f:
+        reader = csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE)
+        header = next(reader)
+        wanted = {"code", "product_name", "brands", "countries_tags", "energy_100g", "energy-kj_100g"}
+        wanted |= set(NUTRIENT_FIELDS.values())
+        # Alleen de nodige kolommen per rij omzetten, niet de ~200 van de export
+        positions = [(i, name) for i, name in enumerate(header) if name in wanted]
+        for fields in reader:
+            if len(fields) < len(header):
+                continue   # afgebroken regel
+            yield {name: fields[i] for i, name in positions}
+
+
+def _iter_jsonl(path: Path) -> Iterator[dict]:
+    with _open_text(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def iter_records(path: Path) -> Iterator[dict]:
+    """Stream OFF products (as dicts) from a CSV or JSONL export, .gz or plain."""
+    name = path.name.lower().removesuffix(".gz")
+    if name.endswith((".jsonl", ".json", ".ndjson")):
+        return _iter_jsonl(path)
+    return _iter_csv(path)
+
+
+def iter_rows(path: Path, countries: Optional[set]) -> Iterator[tuple]:
+    for record in iter_records(path):
+        row = record_to_row(record, countries)
+        if row is not None:
+            yield row
+
+
+def create_indexes(conn: sqlite3.Connection):
+    """Unique barcode index (ON CONFLICT target for delta updates) and the gtin14 lookup index."""
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_barcode ON products (barcode)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_gtin14 ON products (gtin14)")
+
+
+def build_off_database(source: Path, out: Path, countries: Optional[set], fts: bool = True) -> dict:
+    """Build a fresh database from source into out (swapped in atomically), return build stats."""
+    start = time.perf_counter()
+    building = out.with_name(out.name + ".building")
+    building.unlink(missing_ok=True)
+    building.parent.mkdir(parents=True, exist_ok=True)
+
+    conn = sqlite3.connect(building, isolation_level=None)
+    # Offline bulk load: geen journal, geen fsync, één schrijver
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -262144")   # 256 MB
+    conn.execute(CREATE_PRODUCTS)
+
+    insert = f"INSERT INTO products ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})"
+    rows = iter_rows(source, countries)
+    loaded = 0
+    while True:
+        batch = [row for _, row in zip(range(INSERT_BATCH_SIZE), rows)]
+        if not batch:
+            break
+        conn.execute("BEGIN")
+        conn.executemany(insert, batch)
+        conn.execute("COMMIT")
+        loaded += len(batch)
+        elapsed = time.perf_counter() - start
+        print(f"  {loaded} rows loaded ({loaded / elapsed:.0f} rows/s)", flush=True)
+    load_seconds = time.perf_counter() - start
+
+    # Dubbele barcodes: de laatste in de export wint
+    duplicates = conn.execute("""
+        DELETE FROM products WHERE id NOT IN (SELECT MAX(id) FROM products GROUP BY barcode)
+    """).rowcount
+    conn.execute("BEGIN")
+    create_indexes(conn)
+    conn.execute("COMMIT")
+    if fts:
+        conn.execute("BEGIN")
+    indexed = build_fts_index(conn) if fts else 0   # commit zit in build_fts_index
+    conn.execute("ANALYZE")
+    conn.execute("VACUUM")
+    conn.close()
+
+    os.replace(building, out)
+    return {
+        "rows": loaded - max(duplicates, 0),
+        "duplicates": max(duplicates, 0),
+        "fts_rows": indexed,
+        "load_rows_per_second": round(loaded / load_seconds) if load_seconds else None,
+        "seconds": round(time.perf_counter() - start, 1),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", type=Path, required=True, help="OFF CSV of JSONL export (.gz mag)")
+    parser.add_argument("--out", type=Path, default=DB_PATH)
+    parser.add_argument("--countries", default=DEFAULT_COUNTRIES,
+                        help=f"landcodes ({', '.join(COUNTRY_TAGS)}) of 'all'")
+    parser.add_argument("--no-fts", action="store_true", help="products_fts niet bouwen")
+    args = parser.parse_args()
+
+    if not args.source.exists():
+        parser.error(f"{args.source} bestaat niet")
+    try:
+        countries = parse_countries(args.countries)
+    except ValueError as e:
+        parser.error(str(e))
+
+    stats = build_off_database(args.source, args.out, countries, fts=not args.no_fts)
+    rss = f"{stats['peak_rss_mb']:.0f} MB" if stats["peak_rss_mb"] is not None else "n/a"
+    print(
+        f"{stats['rows']} products ({stats['duplicates']} duplicates dropped) written to {args.out} "
+        f"in {stats['seconds']}s - load {stats['load_rows_per_second']} rows/s, peak RSS {rss}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Exporteer de hot-path kolommen van openfoodfacts.db naar een kolomgewijze store
+(app/data/off_columnar/) die columnar_store memory-mapped inleest:
+
+  gtin14.npy                 gesorteerde int64 GTIN-14 keys (binary search index)
+  <nutrient>.npy             float32 per nutriënt, NaN = onbekend
+  <kolom>.offsets.npy/.bin   string tabel (utf-8) voor barcode, product_name, brands
+  manifest.json              aantal rijen, kolommen, bron
+
+Barcodes zonder geldige GTIN worden overgeslagen (die blijven via SQLite opzoekbaar).
+Er wordt eerst naar een tijdelijke map geschreven en daarna omgewisseld, zodat een
+draaiende API nooit een half geschreven store ziet; workers laden de nieuwe vanzelf.
+Het manifest onthoudt de versie van de bron-DB: na een nieuwe openfoodfacts.db gebruikt
+de API de store pas weer na een nieuwe export (tot dan SQLite).
+
+Gebruik (vanuit backend/):
+    python -m app.scripts.export_columnar_store
+    python -m app.scripts.export_columnar_store --db pad/naar/openfoodfacts.db --out pad/naar/off_columnar
+"""
+import argparse
+import json
+import shutil
+import sqlite3
+import time
+from array import array
+from pathlib import Path
+
+import numpy as np
+
+from app.services.columnar_store import COLUMNAR_DIR, MANIFEST, NUTRIENT_COLUMNS, STRING_COLUMNS, gtin_key
+from app.services.off_database import DB_PATH, file_version
+
+FETCH_SIZE = 50000
+
+
+def _write_strings(out: Path, column: str, values: list, order: np.ndarray):
+    offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    with open(out / f"{column}.bin", "wb") as blob:
+        position = 0
+        for i, index in enumerate(order):
+            encoded = (values[index] or "").encode("utf-8")
+            blob.write(encoded)
+            position += len(encoded)
+            offsets[i + 1] = position
+        blob.write(b"\0")  # nooit een leeg bestand (mmap van 0 bytes faalt)
+    np.save(out / f"{column}.offsets.npy", offsets)
+
+
+def export_columnar_store(db_path: Path, out: Path) -> int:
+    """Write the store for db_path into out (replaced atomically), return the number of products."""
+    source_version = file_version(Path(db_path))
+    conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+    cursor = conn.execute(f"""
+        SELECT {", ".join(STRING_COLUMNS + NUTRIENT_COLUMNS)} FROM products
+    """)
+
+    keys = array("q")
+    nutrients = {c: array("f") for c in NUTRIENT_COLUMNS}
+    strings = {c: [] for c in STRING_COLUMNS}
+    seen = set()
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            key = gtin_key(row[0])
+            if key < 0 or key in seen:
+                continue  # geen GTIN, of dubbele GTIN (eerste wint, zoals de SQLite lookup)
+            seen.add(key)
+            keys.append(key)
+            for i, column in enumerate(STRING_COLUMNS):
+                strings[column].append(row[i])
+            for i, column in enumerate(NUTRIENT_COLUMNS, start=len(STRING_COLUMNS)):
+                nutrients[column].append(float("nan") if row[i] is None else float(row[i]))
+    conn.close()
+
+    keys = np.frombuffer(keys, dtype=np.int64) if keys else np.zeros(0, dtype=np.int64)
+    order = np.argsort(keys, kind="stable")
+
+    tmp = out.with_name(out.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    np.save(tmp / "gtin14.npy", keys[order])
+    for column, values in nutrients.items():
+        column_values = np.frombuffer(values, dtype=np.float32) if values else np.zeros(0, dtype=np.float32)
+        np.save(tmp / f"{column}.npy", column_values[order])
+    for column, values in strings.items():
+        _write_strings(tmp, column, values, order)
+    (tmp / MANIFEST).write_text(json.dumps({
+        "rows": int(len(keys)),
+        "nutrient_columns": list(NUTRIENT_COLUMNS),
+        "string_columns": list(STRING_COLUMNS),
+        "source": str(db_path),
+        "source_version": list(source_version) if source_version else None,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }, indent=2), encoding="utf-8")
+
+    # Omwisselen: oude store weg, nieuwe op zijn plaats
+    old = out.with_name(out.name + ".old")
+    shutil.rmtree(old, ignore_errors=True)
+    if out.exists():
+        out.rename(old)
+    tmp.rename(out)
+    shutil.rmtree(old, ignore_errors=True)
+    return int(len(keys))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--out", type=Path, default=COLUMNAR_DIR)
+    args = parser.parse_args()
+
+    if not args.db.exists():
+        parser.error(f"{args.db} bestaat niet")
+    start = time.perf_counter()
+    total = export_columnar_store(args.db, args.out)
+    size = sum(f.stat().st_size for f in args.out.iterdir()) / 1024 / 1024
+    print(f"{total} products exported to {args.out} ({size:.1f} MB) in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Postgres migratie voor de boodschappenlijsten (idempotent, mag opnieuw gedraaid worden).
+
+  - dubbele items (zelfde list_id + product_id) samenvoegen: quantities opgeteld in één rij
+  - unieke index op shopping_list_items (list_id, product_id), nodig voor
+    INSERT ... ON CONFLICT (list_id, product_id) bij het toevoegen van items
+  - shopping_line_pricing(): de deal-groep prijsregel per lijn (enige plek waar die staat)
+  - shopping_line_contribution(): bijdrage van één lijn aan de list totals (voor deltas)
+  - view shopping_list_item_lines: items met product, promotie en berekende lijnprijzen
+
+De app draait deze migratie zelf bij startup (shopping_list_service.ensure_schema,
+SHOPPING_LISTS_MIGRATE_ON_STARTUP=1, standaard); met 0 weigert ze te starten zolang
+index, functies of view ontbreken en draai je dit script bij de deploy.
+
+Gebruik (vanuit backend/):
+    python -m app.scripts.migrate_shopping_lists
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import List
+
+_MIGRATION_LOCK_KEY = 0x4D50_534C   # pg advisory lock: workers die tegelijk starten migreren na elkaar
+
+MERGE_DUPLICATE_ITEMS = """
+WITH merged AS (
+    SELECT list_id, product_id,
+           (array_agg(item_id ORDER BY item_id))[1] AS keep_id,
+           sum(quantity) AS quantity
+    FROM shopping_list_items
+    GROUP BY list_id, product_id
+    HAVING count(*) > 1
+), kept AS (
+    UPDATE shopping_list_items i SET quantity = m.quantity
+    FROM merged m
+    WHERE i.item_id = m.keep_id
+)
+DELETE FROM shopping_list_items i
+USING merged m
+WHERE i.list_id = m.list_id AND i.product_id = m.product_id AND i.item_id <> m.keep_id
+"""
+
+# Complete groepen van deal_quantity stuks aan promo_price, de rest aan original_price;
+# gewone korting: elke unit aan promo_price. Bedragen afgerond op centen. Een verlopen
+# (niet meer actieve) promotie telt niet: de lijn kost dan de gewone prijs.
+# app.services.list_repricing rekent dezelfde regel gevectoriseerd na: samen wijzigen.
+LINE_PRICING_FUNCTION = """
+CREATE OR REPLACE FUNCTION shopping_line_pricing(
+    quantity integer,
+    has_promo boolean,
+    original_price double precision,
+    promo_price double precision,
+    deal_quantity integer,
+    is_meerdere_artikels boolean,
+    OUT price_per_unit double precision,
+    OUT line_total double precision,
+    OUT savings double precision,
+    OUT savings_per_unit double precision
+)
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT
+        CASE WHEN NOT f.promo THEN original_price
+             WHEN NOT f.deal THEN promo_price
+             WHEN f.groups > 0 AND f.remaining = 0 THEN promo_price
+             ELSE original_price END,
+        CASE WHEN NOT f.promo THEN
+                 CASE WHEN COALESCE(original_price, 0) <> 0
+                      THEN round((original_price * quantity)::numeric, 2)::float8 END
+             WHEN NOT f.deal THEN round((promo_price * quantity)::numeric, 2)::float8
+             ELSE round((f.groups * deal_quantity * promo_price + f.remaining * original_price)::numeric, 2)::float8 END,
+        CASE WHEN NOT f.promo THEN 0
+             WHEN NOT f.deal THEN round(((original_price - promo_price) * quantity)::numeric, 2)::float8
+             ELSE round((f.groups * deal_quantity * (original_price - promo_price))::numeric, 2)::float8 END,
+        -- savings_per_unit * quantity = besparing van de lijn (zo rekent de frontend)
+        CASE WHEN NOT f.promo THEN NULL
+             WHEN NOT f.deal THEN round((original_price - promo_price)::numeric, 2)::float8
+             WHEN quantity > 0
+                 THEN round((f.groups * deal_quantity * (original_price - promo_price) / quantity)::numeric, 4)::float8
+             ELSE 0 END
+    FROM (
+        SELECT COALESCE(has_promo, false) AND COALESCE(original_price, 0) <> 0
+                   AND COALESCE(promo_price, 0) <> 0 AS promo,
+               COALESCE(is_meerdere_artikels, false) AND COALESCE(deal_quantity, 0) > 1 AS deal,
+               CASE WHEN deal_quantity > 1 THEN quantity / deal_quantity ELSE 0 END AS groups,
+               CASE WHEN deal_quantity > 1 THEN quantity % deal_quantity ELSE quantity END AS remaining
+    ) f
+$$
+"""
+
+# Bijdrage van één lijn (in een bepaalde toestand) aan estimated_total_price/estimated_savings
+LINE_CONTRIBUTION_FUNCTION = """
+CREATE OR REPLACE FUNCTION shopping_line_contribution(
+    line_product_id uuid,
+    line_promo_id uuid,
+    line_has_promo boolean,
+    line_quantity integer,
+    OUT line_total double precision,
+    OUT savings double precision
+)
+LANGUAGE sql STABLE AS $$
+    SELECT COALESCE(l.line_total, 0), COALESCE(l.savings, 0)
+    FROM (SELECT 1) AS one
+    LEFT JOIN products p ON p.product_id = line_product_id
+    LEFT JOIN promotions pr ON pr.promo_id = line_promo_id AND line_has_promo AND pr.is_active
+    CROSS JOIN LATERAL shopping_line_pricing(
+        line_quantity, line_has_promo, COALESCE(pr.original_price, p.price)::float8,
+        pr.promo_price::float8, pr.deal_quantity::int, pr.is_meerdere_artikels
+    ) l
+    WHERE line_quantity IS NOT NULL
+$$
+"""
+
+ITEM_LINES_VIEW = """
+CREATE OR REPLACE VIEW shopping_list_item_lines AS
+SELECT sli.item_id, sli.list_id, sli.product_id, sli.quantity, sli.is_checked,
+       sli.has_promo, sli.promo_id,
+       p.product_name, p.barcode, p.brand, p.image_url,
+       COALESCE(pr.original_price, p.price)::float8 AS original_price,
+       pr.promo_price::float8 AS promo_price,
+       pr.deal_quantity, pr.is_meerdere_artikels,
+       pr.discount_percentage AS discount_label,
+       l.price_per_unit, l.line_total, l.savings, l.savings_per_unit
+FROM shopping_list_items sli
+LEFT JOIN products p ON p.product_id = sli.product_id
+LEFT JOIN promotions pr ON pr.promo_id = sli.promo_id AND sli.has_promo AND pr.is_active
+CROSS JOIN LATERAL shopping_line_pricing(
+    sli.quantity, sli.has_promo, COALESCE(pr.original_price, p.price)::float8,
+    pr.promo_price::float8, pr.deal_quantity::int, pr.is_meerdere_artikels
+) l
+"""
+
+STATEMENTS = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS shopping_list_items_list_product_key "
+    "ON shopping_list_items (list_id, product_id)",
+    LINE_PRICING_FUNCTION,
+    LINE_CONTRIBUTION_FUNCTION,
+    ITEM_LINES_VIEW,
+]
+
+
+# Objecten waarop de items endpoints steunen, met hoe Postgres ze terugvindt
+REQUIRED_OBJECTS = {
+    "unique index shopping_list_items_list_product_key":
+        "to_regclass('shopping_list_items_list_product_key')",
+    "function shopping_line_pricing()":
+        "to_regprocedure('shopping_line_pricing(integer, boolean, double precision, double precision, integer, boolean)')",
+    "function shopping_line_contribution()":
+        "to_regprocedure('shopping_line_contribution(uuid, uuid, boolean, integer)')",
+    "view shopping_list_item_lines":
+        "to_regclass('shopping_list_item_lines')",
+}
+
+
+async def missing_objects(conn) -> List[str]:
+    """The required index, functions and view that don't exist (yet) in the database."""
+    row = await conn.fetchrow(
+        "SELECT " + ", ".join(f"{lookup} IS NULL AS m{i}" for i, lookup in enumerate(REQUIRED_OBJECTS.values()))
+    )
+    return [name for i, name in enumerate(REQUIRED_OBJECTS) if row[f"m{i}"]]
+
+
+async def apply(conn) -> int:
+    """Run the migration on an open connection in one transaction; returns the number of merged items."""
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", _MIGRATION_LOCK_KEY)
+        result = await conn.execute(MERGE_DUPLICATE_ITEMS)
+        for statement in STATEMENTS:
+            await conn.execute(statement)
+    return int(result.split()[-1])
+
+
+async def migrate(database_url: str):
+    import asyncpg
+
+    start = time.perf_counter()
+    conn = await asyncpg.connect(database_url)
+    try:
+        merged = await apply(conn)
+        print(f"Postgres: {merged} duplicate items merged, "
+              f"schema up to date in {time.perf_counter() - start:.1f}s")
+    finally:
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        parser.error("DATABASE_URL is niet gezet")
+    asyncio.run(migrate(database_url))
+
+
+if __name__ == "__main__":
+    main()
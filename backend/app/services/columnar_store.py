@@ -0,0 +1,189 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app.services import off_database
+from app.services.gtin import normalize_gtin
+from app.services.off_database import DB_PATH
+
+logger = logging.getLogger(__name__)
+
+# Kolomgewijze, memory-mapped kopie van de hot-path velden uit openfoodfacts.db
+# (gebouwd met app.scripts.export_columnar_store). Barcodes zitten als gesorteerde
+# int64 GTIN-14 array, lookups zijn een searchsorted; alle workers delen de pagina's
+# via de OS page cache.
+#
+# Het manifest bevat de versie (inode/mtime/grootte) van de openfoodfacts.db waaruit
+# geëxporteerd werd. Wordt die DB vervangen (build_off_database, apply_off_delta) of de
+# export opnieuw gedraaid, dan laadt get_store() opnieuw; hoort de export niet bij de
+# huidige DB, dan is er geen store en gaan lookups naar SQLite.
+
+COLUMNAR_DIR = Path(os.getenv("OFF_COLUMNAR_DIR", str(DB_PATH.parent / "off_columnar")))
+
+NUTRIENT_COLUMNS = (
+    "energy_kcal_100g", "proteins_100g", "carbohydrates_100g",
+    "fat_100g", "sugars_100g", "fiber_100g", "salt_100g",
+)
+STRING_COLUMNS = ("barcode", "product_name", "brands")
+
+MANIFEST = "manifest.json"
+
+
+def gtin_key(barcode) -> int:
+    """int64 key of a barcode (its GTIN-14), -1 when it has none."""
+    gtin = normalize_gtin(barcode)
+    return int(gtin) if gtin else -1
+
+
+class NutrientRecord:
+    """One product as a slot in the store; fields are read from the arrays on access."""
+
+    __slots__ = ("store", "slot")
+
+    def __init__(self, store: "ColumnarStore", slot: int):
+        self.store = store
+        self.slot = slot
+
+    def __getitem__(self, column: str):
+        if column in STRING_COLUMNS:
+            return self.store.string(column, self.slot)
+        value = self.store.nutrients[column][self.slot]
+        # str() van een float32 is de kortste exacte weergave: 0.1 blijft 0.1 i.p.v. 0.10000000149
+        return None if math.isnan(value) else float(str(value))
+
+    def __getattr__(self, column: str):
+        if column in STRING_COLUMNS or column in NUTRIENT_COLUMNS:
+            return self[column]
+        raise AttributeError(column)
+
+    def as_dict(self) -> dict:
+        return {column: self[column] for column in STRING_COLUMNS + NUTRIENT_COLUMNS}
+
+
+def _floats(values: np.ndarray) -> list:
+    # Zoals NutrientRecord: kortste exacte weergave van de float32, NaN → None
+    return [None if text == "nan" else float(text) for text in values.astype(str).tolist()]
+
+
+class ColumnarStore:
+    def __init__(self, path: Path = COLUMNAR_DIR):
+        self.path = Path(path)
+        self.manifest = json.loads((self.path / MANIFEST).read_text(encoding="utf-8"))
+        self.gtins = np.load(self.path / "gtin14.npy", mmap_mode="r")
+        self.nutrients = {c: np.load(self.path / f"{c}.npy", mmap_mode="r") for c in NUTRIENT_COLUMNS}
+        self._offsets = {c: np.load(self.path / f"{c}.offsets.npy", mmap_mode="r") for c in STRING_COLUMNS}
+        self._blobs = {c: np.memmap(self.path / f"{c}.bin", dtype=np.uint8, mode="r") for c in STRING_COLUMNS}
+
+    def __len__(self) -> int:
+        return len(self.gtins)
+
+    def slots(self, barcodes: Iterable[str]) -> np.ndarray:
+        """Slot per barcode (vectorized binary search), -1 where the barcode is unknown."""
+        keys = np.fromiter((gtin_key(b) for b in barcodes), dtype=np.int64)
+        if len(keys) == 0 or len(self.gtins) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        positions = np.searchsorted(self.gtins, keys)
+        positions = np.minimum(positions, len(self.gtins) - 1)
+        return np.where(self.gtins[positions] == keys, positions, -1)
+
+    def string(self, column: str, slot: int) -> Optional[str]:
+        offsets = self._offsets[column]
+        start, end = int(offsets[slot]), int(offsets[slot + 1])
+        if start == end:
+            return None
+        return self._blobs[column][start:end].tobytes().decode("utf-8")
+
+    def get(self, barcode: str) -> Optional[NutrientRecord]:
+        # Scalair pad: geen array-opbouw voor één barcode
+        key = gtin_key(barcode)
+        slot = int(self.gtins.searchsorted(key))
+        if key < 0 or slot >= len(self.gtins) or int(self.gtins[slot]) != key:
+            return None
+        return NutrientRecord(self, slot)
+
+    def get_many(self, barcodes: List[str]) -> Dict[str, NutrientRecord]:
+        """{barcode: record} for the barcodes in the store, one searchsorted for all."""
+        return {
+            barcode: NutrientRecord(self, int(slot))
+            for barcode, slot in zip(barcodes, self.slots(barcodes)) if slot >= 0
+        }
+
+    def nutrients_for_slots(self, slots: np.ndarray) -> Dict[str, np.ndarray]:
+        """Nutrient columns for many slots at once (NaN where missing or unknown slot)."""
+        slots = np.asarray(slots, dtype=np.int64)
+        known = slots >= 0
+        result = {}
+        for column, values in self.nutrients.items():
+            out = np.full(len(slots), np.nan, dtype=np.float32)
+            out[known] = values[slots[known]]
+            result[column] = out
+        return result
+
+    def fields(self, records: List[NutrientRecord]) -> List[dict]:
+        """All fields of many records, the nutrients read column-wise for all slots at once."""
+        slots = np.fromiter((record.slot for record in records), dtype=np.int64, count=len(records))
+        columns = {column: _floats(values) for column, values in self.nutrients_for_slots(slots).items()}
+        columns.update({column: [self.string(column, slot) for slot in slots.tolist()] for column in STRING_COLUMNS})
+        return [{column: values[i] for column, values in columns.items()} for i in range(len(records))]
+
+
+# ==================== SHARED INSTANCE ====================
+
+_store: Optional[ColumnarStore] = None
+_store_lock = threading.Lock()
+_loaded_for: Optional[tuple] = None    # (DB generatie, manifest mtime) van de laatste load
+_checked_at: Optional[float] = None
+
+
+def _manifest_version() -> Optional[int]:
+    try:
+        return (COLUMNAR_DIR / MANIFEST).stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def _load_store() -> Optional[ColumnarStore]:
+    if not (COLUMNAR_DIR / MANIFEST).exists():
+        return None
+    try:
+        store = ColumnarStore(COLUMNAR_DIR)
+    except Exception as e:
+        logger.warning("Columnar nutrient store not available: %s", e)
+        return None
+    source = store.manifest.get("source_version")
+    if source is None or tuple(source) != off_database.file_version():
+        logger.warning("Columnar nutrient store in %s was not exported from the current openfoodfacts.db, "
+                       "using SQLite (re-run export_columnar_store)", COLUMNAR_DIR)
+        return None
+    logger.info("Columnar nutrient store loaded: %d products (%s)", len(store), COLUMNAR_DIR)
+    return store
+
+
+def get_store() -> Optional[ColumnarStore]:
+    """
+    The shared store if it matches the current openfoodfacts.db, else None (lookups then
+    use SQLite). Reloaded when the DB is swapped or the export replaced (checked at most
+    every OFF_DB_VERSION_CHECK_SECONDS).
+    """
+    global _store, _loaded_for, _checked_at
+    if os.getenv("OFF_COLUMNAR_ENABLED", "1") != "1":
+        return None
+    now = time.monotonic()
+    if _checked_at is not None and now - _checked_at < off_database.VERSION_CHECK_SECONDS:
+        return _store
+    with _store_lock:
+        if _checked_at is None or now - _checked_at >= off_database.VERSION_CHECK_SECONDS:
+            version = (off_database.current_generation(), _manifest_version())
+            if version != _loaded_for:
+                # Oude store niet sluiten: lopende lookups houden hun mmaps zelf vast
+                _store = _load_store()
+                _loaded_for = version
+            _checked_at = now
+    return _store
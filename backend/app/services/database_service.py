@@ -1,13 +1,60 @@
 import asyncpg
+import logging
 import os
 from typing import Optional, List, Dict, Any
 from datetime import date
 import uuid
+from app.services.gtin import barcode_forms, normalize_gtin
+
+logger = logging.getLogger(__name__)
 
 # Get database URL from environment
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 
+# products.gtin14 (app.scripts.backfill_gtin) kan ontbreken op oudere databases. Na de
+# backfill vult de trigger products_gtin14 elke rij: één equality probe op gtin14. Ervoor
+# hebben rijen NULL en wordt ook op de tekstvormen van de barcode gezocht.
+_products_gtin14: Optional[bool] = None
+_products_gtin14_filled: Optional[bool] = None
+
+PRODUCT_LOOKUP_COLUMNS = """
+    product_id, barcode, product_name, brand,
+    energy_kcal, proteins_g, carbohydrates_g, fat_g,
+    sugars_g, fiber_g, salt_g, image_url
+"""
+
+
+async def products_have_gtin14(conn) -> bool:
+    """Whether products has the gtin14 column (checked once per process)."""
+    global _products_gtin14
+    if _products_gtin14 is None:
+        _products_gtin14 = await conn.fetchval(
+            """
+            SELECT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'products' AND column_name = 'gtin14'
+            )
+            """
+        )
+    return _products_gtin14
+
+
+async def products_gtin14_filled(conn) -> bool:
+    """Whether backfill_gtin ran: every products row has its gtin14 (trigger; checked once per process)."""
+    global _products_gtin14_filled
+    if _products_gtin14_filled is None:
+        _products_gtin14_filled = await products_have_gtin14(conn) and await conn.fetchval(
+            """
+            SELECT EXISTS (
+                SELECT 1 FROM pg_trigger
+                WHERE tgname = 'products_gtin14' AND tgrelid = 'products'::regclass
+            )
+            """
+        )
+    return _products_gtin14_filled
+
+
 async def get_db_pool():
     """Create and return a database connection pool."""
     return await asyncpg.create_pool(DATABASE_URL)
@@ -54,14 +101,62 @@ class DatabaseService:
     # ==================== PRODUCTS ====================
 
     async def get_product_by_barcode(self, barcode: str) -> Optional[Dict[str, Any]]:
-        """Get product by barcode."""
+        """Get product by barcode (via the canonical gtin14 key, or the barcode forms where it is missing)."""
+        gtin = normalize_gtin(barcode)
         async with self.pool.acquire() as conn:
-            row = await conn.fetchrow(
-                "SELECT * FROM products WHERE barcode = $1",
-                barcode
-            )
+            if gtin and await products_gtin14_filled(conn):
+                row = await conn.fetchrow("SELECT * FROM products WHERE gtin14 = $1 LIMIT 1", gtin)
+            elif gtin and await products_have_gtin14(conn):
+                row = await conn.fetchrow(
+                    """
+                    SELECT * FROM products
+                    WHERE gtin14 = $1 OR (gtin14 IS NULL AND barcode = ANY($2::text[]))
+                    LIMIT 1
+                    """,
+                    gtin, barcode_forms(barcode)
+                )
+            else:
+                row = await conn.fetchrow(
+                    "SELECT * FROM products WHERE barcode = ANY($1::text[]) LIMIT 1",
+                    barcode_forms(barcode)
+                )
             return dict(row) if row else None
 
+    async def get_products_by_gtins(self, gtins: List[str]) -> List[Dict[str, Any]]:
+        """
+        Products for many canonical GTIN-14 keys in one query (lookup fields only). gtin14 is
+        filled in from the barcode for rows (or databases) without it.
+        """
+        if not gtins:
+            return []
+        forms = list(dict.fromkeys(f for gtin in gtins for f in barcode_forms(gtin)))
+        async with self.pool.acquire() as conn:
+            if await products_gtin14_filled(conn):
+                rows = await conn.fetch(
+                    f"SELECT {PRODUCT_LOOKUP_COLUMNS}, gtin14 FROM products WHERE gtin14 = ANY($1::text[])",
+                    gtins
+                )
+            elif await products_have_gtin14(conn):
+                rows = await conn.fetch(
+                    f"""
+                    SELECT {PRODUCT_LOOKUP_COLUMNS}, gtin14
+                    FROM products
+                    WHERE gtin14 = ANY($1::text[])
+                       OR (gtin14 IS NULL AND barcode = ANY($2::text[]))
+                    """,
+                    gtins, forms
+                )
+            else:
+                rows = await conn.fetch(
+                    f"""
+                    SELECT {PRODUCT_LOOKUP_COLUMNS}, NULL::text AS gtin14
+                    FROM products
+                    WHERE barcode = ANY($1::text[])
+                    """,
+                    forms
+                )
+            return [{**dict(row), "gtin14": row["gtin14"] or normalize_gtin(row["barcode"])} for row in rows]
+
     async def upsert_product(
         self,
         barcode: str,
@@ -78,17 +173,33 @@ class DatabaseService:
         image_url: Optional[str] = None
     ) -> str:
         """Insert or update a product, return product_id."""
+        gtin = normalize_gtin(barcode)
         async with self.pool.acquire() as conn:
-            # Check if product exists
-            existing = await conn.fetchrow(
-                "SELECT product_id FROM products WHERE barcode = $1",
-                barcode
-            )
+            has_gtin14 = await products_have_gtin14(conn)
+            # Check if product exists (same GTIN-14, also when stored with/without leading zeros)
+            if gtin and await products_gtin14_filled(conn):
+                existing = await conn.fetchrow("SELECT product_id FROM products WHERE gtin14 = $1 LIMIT 1", gtin)
+            elif has_gtin14:
+                existing = await conn.fetchrow(
+                    """
+                    SELECT product_id FROM products
+                    WHERE gtin14 = $1 OR (gtin14 IS NULL AND barcode = ANY($2::text[]))
+                    LIMIT 1
+                    """,
+                    gtin, barcode_forms(barcode)
+                )
+            else:
+                existing = await conn.fetchrow(
+                    "SELECT product_id FROM products WHERE barcode = ANY($1::text[]) LIMIT 1",
+                    barcode_forms(barcode)
+                )
 
+            # Zonder gtin14 kolom (oudere database) enkel op barcode
+            gtin_args = (gtin,) if has_gtin14 else ()
             if existing:
-                # Update existing product
+                # Update existing product (rij van vóór de backfill: gtin14 meteen invullen)
                 await conn.execute(
-                    """
+                    f"""
                     UPDATE products SET
                         product_name = COALESCE($2, product_name),
                         brand = COALESCE($3, brand),
@@ -101,27 +212,28 @@ class DatabaseService:
                         nova_group = COALESCE($10, nova_group),
                         allergens = COALESCE($11, allergens),
                         image_url = COALESCE($12, image_url)
-                    WHERE barcode = $1
+                        {", gtin14 = COALESCE(gtin14, $13)" if has_gtin14 else ""}
+                    WHERE product_id = $1
                     """,
-                    barcode, product_name, brand, energy_kcal, proteins_g,
+                    existing["product_id"], product_name, brand, energy_kcal, proteins_g,
                     carbohydrates_g, sugars_g, fat_g, nutriscore_grade,
-                    nova_group, allergens, image_url
+                    nova_group, allergens, image_url, *gtin_args
                 )
                 return str(existing["product_id"])
             else:
                 # Insert new product
                 product_id = str(uuid.uuid4())
                 await conn.execute(
-                    """
+                    f"""
                     INSERT INTO products (
                         product_id, barcode, product_name, brand,
                         energy_kcal, proteins_g, carbohydrates_g, sugars_g, fat_g,
-                        nutriscore_grade, nova_group, allergens, image_url
-                    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13)
+                        nutriscore_grade, nova_group, allergens, image_url{", gtin14" if has_gtin14 else ""}
+                    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13{", $14" if has_gtin14 else ""})
                     """,
                     product_id, barcode, product_name, brand,
                     energy_kcal, proteins_g, carbohydrates_g, sugars_g, fat_g,
-                    nutriscore_grade, nova_group, allergens, image_url
+                    nutriscore_grade, nova_group, allergens, image_url, *gtin_args
                 )
                 return product_id
 
@@ -175,25 +287,27 @@ class DatabaseService:
                     category, primary_macro, is_healthy,
                     is_meerdere_artikels, deal_quantity,
                 )
-            print(f"Created promotion {promo_id} for {barcode} [{category}]")
+            # Eén regel per rij tijdens ingestion: gesampled
+            logger.debug("Created promotion %s for %s [%s]", promo_id, barcode, category,
+                         extra={"sample": "promotion_created"})
             return promo_id
         except Exception as e:
-            print(f"ERROR creating promotion for {barcode}: {e}")
+            logger.error("Error creating promotion for %s: %s", barcode, e)
             raise e
 
-    async def deactivate_old_promotions(self, store_id: str) -> int:
-        """Deactivate promotions that have expired."""
+    async def deactivate_old_promotions(self, store_id: str) -> List[str]:
+        """Deactivate promotions that have expired; returns the promo_ids deactivated by this call."""
         async with self.pool.acquire() as conn:
-            result = await conn.execute(
+            rows = await conn.fetch(
                 """
                 UPDATE promotions
                 SET is_active = false
-                WHERE store_id = $1 AND valid_until < CURRENT_DATE
+                WHERE store_id = $1 AND valid_until < CURRENT_DATE AND is_active
+                RETURNING promo_id
                 """,
                 store_id
             )
-            # Extract count from result string like "UPDATE 5"
-            return int(result.split()[-1]) if result else 0
+            return [str(row["promo_id"]) for row in rows]
 
     async def get_active_promotions(self, store_id: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get active promotions, optionally filtered by store."""
@@ -245,6 +359,66 @@ class DatabaseService:
             )
             return [dict(row) for row in rows]
 
+    # ==================== SCANS ====================
+
+    async def last_scan_at(self, user_id: str, barcode: str, window_minutes: int):
+        """Time of the user's latest scan of this barcode within the last window_minutes, or None."""
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(
+                """
+                SELECT max(scanned_at) FROM scanned_items
+                WHERE user_id = $1 AND barcode = $2
+                  AND scanned_at >= now() - make_interval(mins => $3)
+                """,
+                user_id, barcode, window_minutes
+            )
+
+    async def insert_scans(self, scans: List[Dict[str, Any]]) -> int:
+        """
+        Log many scans (user_id, barcode, scan_mode, product_id, scanned_at) with one
+        multi-row insert; missing product_ids are looked up in the same statement.
+        """
+        if not scans:
+            return 0
+        # Per scan de sleutel (GTIN-14, anders de barcode) en de tekstvormen ervan, voor
+        # products rijen zonder gtin14
+        keys = [normalize_gtin(s["barcode"]) or s["barcode"] for s in scans]
+        async with self.pool.acquire() as conn:
+            by_forms = "p.barcode IN (SELECT f.form FROM forms f WHERE f.lookup_key = s.lookup_key)"
+            if await products_gtin14_filled(conn):
+                # Elke GTIN staat op gtin14: tekstvormen enkel nog voor codes die geen GTIN zijn
+                forms = [(key, key) for key in dict.fromkeys(keys) if normalize_gtin(key) is None]
+                lookups = ["p.gtin14 = s.lookup_key", by_forms]
+            elif await products_have_gtin14(conn):
+                forms = [(key, form) for key in dict.fromkeys(keys) for form in barcode_forms(key)]
+                lookups = [f"p.gtin14 = s.lookup_key OR (p.gtin14 IS NULL AND {by_forms})"]
+            else:
+                forms = [(key, form) for key in dict.fromkeys(keys) for form in barcode_forms(key)]
+                lookups = [by_forms]
+            product_id = ", ".join(
+                f"(SELECT p.product_id FROM products p WHERE {lookup} LIMIT 1)" for lookup in lookups
+            )
+            await conn.execute(
+                f"""
+                WITH forms AS (
+                    SELECT * FROM unnest($7::text[], $8::text[]) AS f(lookup_key, form)
+                )
+                INSERT INTO scanned_items (user_id, barcode, scan_mode, product_id, scanned_at)
+                SELECT s.user_id, s.barcode, s.scan_mode, COALESCE(s.product_id, {product_id}), s.scanned_at
+                FROM unnest($1::uuid[], $2::text[], $3::text[], $4::uuid[], $5::text[], $6::timestamptz[])
+                     AS s(user_id, barcode, scan_mode, product_id, lookup_key, scanned_at)
+                """,
+                [s["user_id"] for s in scans],
+                [s["barcode"] for s in scans],
+                [s.get("scan_mode") or "barcode" for s in scans],
+                [str(s["product_id"]) if s.get("product_id") else None for s in scans],
+                keys,
+                [s["scanned_at"] for s in scans],
+                [key for key, _ in forms],
+                [form for _, form in forms],
+            )
+        return len(scans)
+
 
 # Global pool instance
 _pool: Optional[asyncpg.Pool] = None
@@ -1,4 +1,5 @@
 import uuid
+from app.services import resource_versions
 from app.services.database_service import get_database_service
 
 
@@ -43,7 +44,8 @@ async def add_favorite(user_id: str, product_id: str) -> str:
             """,
             favorite_id, user_id, product_id,
         )
-        return favorite_id
+    await resource_versions.bump(resource_versions.FAVORITES, [user_id])
+    return favorite_id
 
 
 async def remove_favorite(user_id: str, product_id: str) -> None:
@@ -59,6 +61,7 @@ async def remove_favorite(user_id: str, product_id: str) -> None:
         )
         if result == "DELETE 0":
             raise ValueError("Favoriet niet gevonden")
+    await resource_versions.bump(resource_versions.FAVORITES, [user_id])
 
 
 async def check_favorite(user_id: str, product_id: str) -> bool:
@@ -0,0 +1,377 @@
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.services.off_database import current_generation, get_connection, has_table
+from app.services.product_service import _search_fts
+from app.services.text_normalization import STOPWORDS, normalize_text, tokenize
+
+logger = logging.getLogger(__name__)
+
+# In-process fuzzy matching van winkelnamen (Delhaize heeft geen barcode) op OpenFoodFacts:
+# trigram inverted index voor kandidaten, daarna score op naam, merk en verpakkingsgrootte.
+# Met products_fts wordt de index per batch gebouwd over enkel de FTS kandidaten van die
+# namen (klein, altijd de huidige openfoodfacts.db); zonder FTS over de hele tabel, gedeeld.
+
+CANDIDATES_PER_QUERY = 25       # kandidaten die volledig herscoord worden
+QUERY_TRIGRAMS = 12             # zeldzaamste trigrams van de query voor kandidaatgeneratie
+MAX_POSTING_FRACTION = 0.02     # trigrams in >2% van de producten zijn niet selectief
+QUERY_CHUNK_SIZE = 64           # queries per gevectoriseerde stap (begrenst geheugen)
+FTS_CANDIDATES_PER_NAME = int(os.getenv("FUZZY_FTS_CANDIDATES", "100"))   # bm25 kandidaten per naam
+RETRY_SECONDS = float(os.getenv("FUZZY_MATCHER_RETRY_SECONDS", "300"))  # na een mislukte build
+
+NAME_WEIGHT = 0.7
+BRAND_WEIGHT = 0.15
+PACK_WEIGHT = 0.15
+
+_UNITS = {
+    "kg": (1000.0, "g"), "g": (1.0, "g"), "gr": (1.0, "g"), "mg": (0.001, "g"),
+    "l": (1000.0, "ml"), "dl": (100.0, "ml"), "cl": (10.0, "ml"), "ml": (1.0, "ml"),
+}
+_MULTI_PACK = re.compile(r"\b(\d+)\s*x\s*(\d+(?:\.\d+)?)\s*(kg|gr|g|mg|l|dl|cl|ml)\b")
+_SINGLE_PACK = re.compile(r"\b(\d+(?:\.\d+)?)\s*(kg|gr|g|mg|l|dl|cl|ml)\b")
+
+
+@dataclass
+class FuzzyMatch:
+    barcode: str
+    product_name: Optional[str]
+    brands: Optional[str]
+    match_score: float
+
+
+def parse_pack_size(text) -> Optional[Tuple[float, str]]:
+    """Total pack size in g or ml: "6x33cl" → (1980.0, "ml"), "1kg" → (1000.0, "g")."""
+    normalized = normalize_text(text)
+    multi = _MULTI_PACK.search(normalized)
+    if multi:
+        factor, dimension = _UNITS[multi.group(3)]
+        return int(multi.group(1)) * float(multi.group(2)) * factor, dimension
+    single = _SINGLE_PACK.search(normalized)
+    if single:
+        factor, dimension = _UNITS[single.group(2)]
+        return float(single.group(1)) * factor, dimension
+    return None
+
+
+def _trigrams(text: str) -> set:
+    """Trigrams per word (padded with spaces), so word order does not matter."""
+    grams = set()
+    for word in text.split():
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+@lru_cache(maxsize=65536)
+def _brand_tokens(brands: Optional[str]) -> frozenset:
+    return frozenset(tokenize(brands))
+
+
+def _csr(id_lists: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    """(offsets, ids): the ids of row r are ids[offsets[r]:offsets[r + 1]]."""
+    lengths = np.fromiter((len(ids) for ids in id_lists), dtype=np.int64, count=len(id_lists))
+    offsets = np.zeros(len(id_lists) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    ids = np.fromiter((i for row in id_lists for i in row), dtype=np.int64, count=int(offsets[-1]))
+    return offsets, ids
+
+
+def _overlap(csr: Tuple[np.ndarray, np.ndarray], pair_products: np.ndarray, pair_queries: np.ndarray,
+             query_keys: np.ndarray, vocabulary_size: int) -> np.ndarray:
+    """
+    Per (query, product) pair: how many ids of the product's row are in the query's set.
+    query_keys = sorted unique query_index * vocabulary_size + id.
+    """
+    offsets, ids = csr
+    starts = offsets[pair_products]
+    lengths = offsets[pair_products + 1] - starts
+    pair_index = np.repeat(np.arange(len(pair_products)), lengths)
+    # Posities van alle ids van alle paren in één array
+    positions = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+    keys = pair_queries[pair_index] * vocabulary_size + ids[positions]
+    found = np.searchsorted(query_keys, keys)
+    hit = query_keys[np.minimum(found, len(query_keys) - 1)] == keys if len(query_keys) else np.zeros(len(keys), bool)
+    return np.bincount(pair_index, weights=hit, minlength=len(pair_products))
+
+
+def _dice_array(shared: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    total = a + b
+    return np.where((a > 0) & (b > 0), 2.0 * shared / np.maximum(total, 1), 0.0)
+
+
+class FuzzyMatcher:
+    """Trigram inverted index + token-set similarity over OpenFoodFacts names and brands."""
+
+    def __init__(self, barcodes: List[str], names: List[Optional[str]], brands: List[Optional[str]]):
+        self.barcodes = barcodes
+        self.names = names
+        self.brands = brands
+        # Genormaliseerde zoektekst per product: naam + merk
+        self._texts = [" ".join(tokenize(f"{n or ''} {b or ''}", drop_stopwords=False)) for n, b in zip(names, brands)]
+
+        # Per product de trigram-, token- en merktoken-ids (CSR); tokens en merken delen één vocabulary
+        self._vocabulary = {}
+        self._tokens = {}
+        self._product_trigrams = _csr([
+            [self._vocabulary.setdefault(g, len(self._vocabulary)) for g in _trigrams(text)] for text in self._texts
+        ])
+        self._product_tokens = _csr([
+            [self._tokens.setdefault(t, len(self._tokens)) for t in set(text.split()) - STOPWORDS]
+            for text in self._texts
+        ])
+        self._product_brands = _csr([
+            [self._tokens.setdefault(t, len(self._tokens)) for t in _brand_tokens(b)] for b in brands
+        ])
+
+        # Inverted index (CSR): postings van trigram t = self._postings[offsets[t]:offsets[t + 1]]
+        offsets, trigram_ids = self._product_trigrams
+        product_ids = np.repeat(np.arange(len(self._texts), dtype=np.int32), np.diff(offsets))
+        order = np.argsort(trigram_ids, kind="stable")
+        self._postings = product_ids[order]
+        self._offsets = np.zeros(len(self._vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(trigram_ids, minlength=len(self._vocabulary)), out=self._offsets[1:])
+        self._max_posting = max(50, int(len(self._texts) * MAX_POSTING_FRACTION))
+
+        # Verpakkingsgrootte per product, lazily bij het scoren (dimensie 0 = nog niet geparsed)
+        self._pack_amount = np.zeros(len(self._texts))
+        self._pack_dimension = np.zeros(len(self._texts), dtype=np.int8)   # 1 g, 2 ml, -1 geen
+
+    @classmethod
+    def from_rows(cls, rows) -> "FuzzyMatcher":
+        return cls([r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows])
+
+    @classmethod
+    def from_database(cls) -> "FuzzyMatcher":
+        """Index over the whole products table (fallback when openfoodfacts.db has no products_fts)."""
+        return cls.from_rows(get_connection().execute("SELECT barcode, product_name, brands FROM products").fetchall())
+
+    @classmethod
+    def for_names(cls, names: List[str], per_name: int = FTS_CANDIDATES_PER_NAME) -> "FuzzyMatcher":
+        """
+        Index over just the candidates of this batch: the union of the best bm25 hits in
+        products_fts per name. Small enough to build per batch.
+        """
+        conn = get_connection()
+        rows = {}
+        for tokens in dict.fromkeys(tuple(dict.fromkeys(tokenize(name))) for name in names):
+            if tokens:
+                for row in _search_fts(conn, list(tokens), per_name):
+                    rows.setdefault(row["barcode"], (row["barcode"], row["product_name"], row["brands"]))
+        return cls.from_rows(list(rows.values()))
+
+    def __len__(self) -> int:
+        return len(self.barcodes)
+
+    def _query_postings(self, text: str) -> np.ndarray:
+        """Postings of the rarest, still selective trigrams of the query."""
+        ids = [self._vocabulary[g] for g in _trigrams(text) if g in self._vocabulary]
+        if not ids:
+            return np.empty(0, dtype=np.int32)
+        ids = np.asarray(ids, dtype=np.int64)
+        lengths = self._offsets[ids + 1] - self._offsets[ids]
+        order = np.argsort(lengths, kind="stable")
+        selective = order[lengths[order] <= self._max_posting]
+        # Enkel niet-selectieve trigrams (heel korte/generieke naam): neem toch de zeldzaamste paar
+        rarest = ids[selective[:QUERY_TRIGRAMS]] if len(selective) else ids[order[:3]]
+        return np.concatenate([self._postings[self._offsets[t]:self._offsets[t + 1]] for t in rarest])
+
+    def _candidates(self, texts: List[str]) -> List[np.ndarray]:
+        """Top candidates per query for a chunk of queries in one vectorized pass."""
+        n = np.int64(len(self._texts))
+        parts = []
+        for query_index, text in enumerate(texts):
+            postings = self._query_postings(text)
+            parts.append(postings.astype(np.int64) + query_index * n)
+        keys = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+        if len(keys) == 0:
+            return [np.empty(0, dtype=np.int64) for _ in texts]
+
+        # Gedeelde (selectieve) trigrams per (query, product) paar
+        unique_keys, shared = np.unique(keys, return_counts=True)
+        query_ids = unique_keys // n
+        product_ids = unique_keys % n
+
+        # Per query sorteren op aantal gedeelde trigrams, eerste CANDIDATES_PER_QUERY houden
+        order = np.lexsort((-shared, query_ids))
+        query_ids = query_ids[order]
+        product_ids = product_ids[order]
+        starts = np.searchsorted(query_ids, np.arange(len(texts)))
+        ends = np.searchsorted(query_ids, np.arange(len(texts)), side="right")
+        return [product_ids[s:min(e, s + CANDIDATES_PER_QUERY)] for s, e in zip(starts, ends)]
+
+    def _parse_packs(self, product_ids: np.ndarray):
+        for product_id in np.unique(product_ids[self._pack_dimension[product_ids] == 0]).tolist():
+            pack = parse_pack_size(self.names[product_id])
+            if pack is None:
+                self._pack_dimension[product_id] = -1
+            else:
+                self._pack_amount[product_id] = pack[0]
+                self._pack_dimension[product_id] = 1 if pack[1] == "g" else 2
+
+    def _score_pairs(self, names: List[str], texts: List[str], pair_queries: np.ndarray,
+                     pair_products: np.ndarray) -> np.ndarray:
+        """Scores (0-100, one decimal) of all (query, candidate) pairs of a chunk at once."""
+        trigram_keys, token_keys = [], []
+        query_grams = np.zeros(len(names))
+        query_tokens = np.zeros(len(names))
+        query_pack_amount = np.zeros(len(names))
+        query_pack_dimension = np.full(len(names), -1, dtype=np.int8)
+        for query_index, (name, text) in enumerate(zip(names, texts)):
+            grams = _trigrams(text)
+            tokens = set(tokenize(name))
+            query_grams[query_index] = len(grams)
+            query_tokens[query_index] = len(tokens)
+            base = query_index * len(self._vocabulary)
+            trigram_keys.extend(base + self._vocabulary[g] for g in grams if g in self._vocabulary)
+            base = query_index * len(self._tokens)
+            token_keys.extend(base + self._tokens[t] for t in tokens if t in self._tokens)
+            pack = parse_pack_size(name)
+            if pack is not None:
+                query_pack_amount[query_index] = pack[0]
+                query_pack_dimension[query_index] = 1 if pack[1] == "g" else 2
+        trigram_keys = np.unique(np.asarray(trigram_keys, dtype=np.int64))
+        token_keys = np.unique(np.asarray(token_keys, dtype=np.int64))
+
+        # Naam: gemiddelde van trigram- en token-Dice
+        shared_grams = _overlap(self._product_trigrams, pair_products, pair_queries, trigram_keys, len(self._vocabulary))
+        shared_tokens = _overlap(self._product_tokens, pair_products, pair_queries, token_keys, len(self._tokens))
+        name_score = (
+            0.5 * _dice_array(shared_grams, query_grams[pair_queries], np.diff(self._product_trigrams[0])[pair_products])
+            + 0.5 * _dice_array(shared_tokens, query_tokens[pair_queries], np.diff(self._product_tokens[0])[pair_products])
+        )
+        score = NAME_WEIGHT * name_score
+        weight = np.full(len(pair_products), NAME_WEIGHT)
+
+        # Merk: welk deel van de OFF-merktokens staat in de winkelnaam? (Delhaize zet het merk vooraan)
+        brand_sizes = np.diff(self._product_brands[0])[pair_products]
+        shared_brands = _overlap(self._product_brands, pair_products, pair_queries, token_keys, len(self._tokens))
+        has_brand = brand_sizes > 0
+        score += np.where(has_brand, BRAND_WEIGHT * shared_brands / np.maximum(brand_sizes, 1), 0.0)
+        weight += np.where(has_brand, BRAND_WEIGHT, 0.0)
+
+        # Verpakking: enkel als beide kanten een grootte hebben
+        self._parse_packs(pair_products)
+        a_amount, a_dimension = query_pack_amount[pair_queries], query_pack_dimension[pair_queries]
+        b_amount, b_dimension = self._pack_amount[pair_products], self._pack_dimension[pair_products]
+        has_pack = (a_dimension > 0) & (b_dimension > 0)
+        largest = np.maximum(a_amount, b_amount)
+        ratio = np.where((a_dimension == b_dimension) & (largest > 0), np.minimum(a_amount, b_amount) / np.maximum(largest, 1e-12), 0.0)
+        pack_score = np.where(ratio >= 0.98, 1.0, np.where(ratio >= 0.9, 0.5, 0.0))
+        score += np.where(has_pack, PACK_WEIGHT * pack_score, 0.0)
+        weight += np.where(has_pack, PACK_WEIGHT, 0.0)
+
+        return np.round(100.0 * score / weight, 1)
+
+    def match_batch(self, names: List[str], min_score: float = 70.0) -> List[Optional[FuzzyMatch]]:
+        """Best match (or None) per name, for a whole batch at once."""
+        results: List[Optional[FuzzyMatch]] = []
+        for start in range(0, len(names), QUERY_CHUNK_SIZE):
+            chunk = names[start:start + QUERY_CHUNK_SIZE]
+            texts = [" ".join(tokenize(name, drop_stopwords=False)) for name in chunk]
+            candidates = self._candidates(texts)
+            pair_queries = np.repeat(np.arange(len(chunk), dtype=np.int64), [len(c) for c in candidates])
+            pair_products = np.concatenate(candidates).astype(np.int64) if candidates else np.empty(0, np.int64)
+            scores = self._score_pairs(chunk, texts, pair_queries, pair_products)
+
+            # Beste paar per query; bij gelijke score de kandidaat met de meeste gedeelde trigrams
+            order = np.lexsort((np.arange(len(scores)), -scores, pair_queries))
+            firsts = np.searchsorted(pair_queries[order], np.arange(len(chunk)))
+            for query_index, first in enumerate(firsts.tolist()):
+                if first >= len(order) or pair_queries[order[first]] != query_index:
+                    results.append(None)
+                    continue
+                pair = order[first]
+                best_id, best_score = int(pair_products[pair]), float(scores[pair])
+                if best_score > 0 and best_score >= min_score:
+                    results.append(FuzzyMatch(
+                        barcode=self.barcodes[best_id],
+                        product_name=self.names[best_id],
+                        brands=self.brands[best_id],
+                        match_score=best_score,
+                    ))
+                else:
+                    results.append(None)
+        return results
+
+    def match(self, name: str, min_score: float = 70.0) -> Optional[FuzzyMatch]:
+        return self.match_batch([name], min_score=min_score)[0]
+
+
+# ==================== SHARED INSTANCE ====================
+
+_matcher: Optional[FuzzyMatcher] = None
+_matcher_generation: Optional[int] = None
+_matcher_lock = threading.Lock()
+_failed_at: Optional[float] = None
+
+
+def get_fuzzy_matcher() -> Optional[FuzzyMatcher]:
+    """
+    Shared whole-table matcher (only used without products_fts). Rebuilt when openfoodfacts.db
+    is swapped; a failed build is retried after RETRY_SECONDS. Blocks while building.
+    None if the OFF database is unavailable.
+    """
+    global _matcher, _matcher_generation, _failed_at
+    generation = current_generation()
+    if _matcher is not None and _matcher_generation == generation:
+        return _matcher
+    if _failed_at is not None and time.monotonic() - _failed_at < RETRY_SECONDS:
+        return _matcher
+    with _matcher_lock:
+        if (_matcher is None or _matcher_generation != generation) and \
+                (_failed_at is None or time.monotonic() - _failed_at >= RETRY_SECONDS):
+            try:
+                start = time.perf_counter()
+                _matcher = FuzzyMatcher.from_database()
+                _matcher_generation = generation
+                _failed_at = None
+                logger.info("Fuzzy matcher built: %d products in %.1fs", len(_matcher), time.perf_counter() - start)
+            except Exception as e:
+                _failed_at = time.monotonic()
+                logger.warning("Fuzzy matcher not available (retry in %.0fs): %s", RETRY_SECONDS, e)
+    return _matcher
+
+
+def match_names(names: List[str], min_score: float = 70.0) -> Optional[List[Optional[FuzzyMatch]]]:
+    """
+    Best match (or None) per name for a whole batch. With products_fts the index only
+    covers the batch's FTS candidates; without it the shared whole-table matcher is used.
+    None if the OFF database is unavailable.
+    """
+    try:
+        if has_table("products_fts"):
+            start = time.perf_counter()
+            matcher = FuzzyMatcher.for_names(names)
+            logger.info("Fuzzy matcher: %d candidates for %d names in %.0f ms",
+                        len(matcher), len(names), (time.perf_counter() - start) * 1000)
+        else:
+            matcher = get_fuzzy_matcher()
+    except Exception as e:
+        logger.warning("Fuzzy matcher not available: %s", e)
+        return None
+    if matcher is None:
+        return None
+    return matcher.match_batch(names, min_score=min_score)
+
+
+def preload():
+    """Build the whole-table matcher ahead of the first batch, if it will be needed (no products_fts)."""
+    try:
+        if has_table("products_fts"):
+            return
+    except Exception as e:
+        logger.warning("Fuzzy matcher preload skipped: %s", e)
+        return
+    get_fuzzy_matcher()
+
+
+def preload_enabled() -> bool:
+    return os.getenv("FUZZY_MATCHER_PRELOAD", "1") == "1"
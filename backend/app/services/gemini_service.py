@@ -1,7 +1,11 @@
 from google import genai
 import json
+import logging
 import os
 import asyncio
+from app.services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
 
 client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
 
@@ -40,6 +44,9 @@ Voor elk product, geef een JSON object terug met:
 Antwoord ALLEEN met een JSON array. Geen uitleg."""
 
 
+# Gelijktijdige uploads met dezelfde producten delen één Gemini call per item
+_enrichment_flights = SingleFlight("gemini_enrichment")
+
 _GEMINI_DEFAULT = {"clean_name": None, "category": "Overig", "primary_macro": "None", "is_healthy": False, "promo_price": None, "is_meerdere_artikels": False, "deal_quantity": 1}
 
 
@@ -82,7 +89,7 @@ Geef exact {len(items)} JSON objecten terug in een array."""
 
             # Validate that we got the right number of results
             if len(results) != len(product_names):
-                print(f"WARNING: Gemini returned {len(results)} results for {len(product_names)} products")
+                logger.warning("Gemini returned %d results for %d products", len(results), len(product_names))
                 while len(results) < len(product_names):
                     results.append({**_GEMINI_DEFAULT})
                 results = results[:len(product_names)]
@@ -92,10 +99,10 @@ Geef exact {len(items)} JSON objecten terug in een array."""
         except Exception as e:
             if attempt < max_retries:
                 wait = 3 * (attempt + 1)
-                print(f"WARNING: Gemini attempt {attempt + 1}/{max_retries + 1} failed: {e}. Retrying in {wait}s...")
+                logger.warning("Gemini attempt %d/%d failed: %s. Retrying in %ss...", attempt + 1, max_retries + 1, e, wait)
                 await asyncio.sleep(wait)
             else:
-                print(f"ERROR: Gemini enrichment failed after {max_retries + 1} attempts: {e}")
+                logger.error("Gemini enrichment failed after %d attempts: %s", max_retries + 1, e)
 
     return [{**_GEMINI_DEFAULT} for _ in product_names]
 
@@ -103,16 +110,39 @@ Geef exact {len(items)} JSON objecten terug in een array."""
 async def enrich_products_batched(product_names: list[str], discounts: list[str] = None, prices: list[float] = None, batch_size: int = 20) -> list[dict]:
     """
     Enrich products in batches to stay within Gemini token limits.
+    Identical (name, discount, price) items are sent once, also across concurrent
+    uploads: they share the enrichment that is already in flight.
     Returns list of enrichments in same order as input.
     """
-    all_results = []
-
-    for i in range(0, len(product_names), batch_size):
-        batch_names = product_names[i:i + batch_size]
-        batch_discounts = discounts[i:i + batch_size] if discounts else None
-        batch_prices = prices[i:i + batch_size] if prices else None
-        print(f"  Gemini batch {i // batch_size + 1}: enriching {len(batch_names)} products...")
-        batch_results = await enrich_products(batch_names, batch_discounts, batch_prices)
-        all_results.extend(batch_results)
-
-    return all_results
+    keys = [
+        (
+            name,
+            discounts[i] if discounts and i < len(discounts) else None,
+            prices[i] if prices and i < len(prices) else None,
+        )
+        for i, name in enumerate(product_names)
+    ]
+    owned, waiting = _enrichment_flights.claim(keys)
+    enriched = {}
+
+    async def enrich_owned():
+        results = {}
+        for i in range(0, len(owned), batch_size):
+            batch_keys = owned[i:i + batch_size]
+            logger.info("Gemini batch %d: enriching %d products", i // batch_size + 1, len(batch_keys))
+            batch_results = await enrich_products(
+                [k[0] for k in batch_keys], [k[1] for k in batch_keys], [k[2] for k in batch_keys]
+            )
+            for key, result in zip(batch_keys, batch_results):
+                results[key] = result
+                _enrichment_flights.resolve(key, result)
+        return results
+
+    if owned:
+        enriched.update(await _enrichment_flights.lead(owned, enrich_owned))
+    if waiting:
+        logger.info("Gemini: %d products already being enriched by another request", len(waiting))
+        enriched.update(await _enrichment_flights.wait(waiting))
+
+    # Eigen kopie per positie: de caller past de dicts niet gedeeld aan
+    return [{**enriched[key]} for key in keys]
@@ -0,0 +1,67 @@
+from typing import List, Optional
+
+# Centrale barcode normalisatie: elke EAN-8 / UPC-A / EAN-13 / GTIN-14 (met of zonder
+# weggestripte voorloopnullen) wordt dezelfde 14-cijferige sleutel.
+
+GTIN_LENGTH = 14
+VALID_LENGTHS = (8, 12, 13, 14)
+
+
+def gtin_check_digit(body: str) -> int:
+    """Compute the GS1 check digit for the digits before the check digit."""
+    total = 0
+    # Van rechts naar links: gewicht 3, 1, 3, 1, ...
+    for i, digit in enumerate(reversed(body)):
+        total += int(digit) * (3 if i % 2 == 0 else 1)
+    return (10 - total % 10) % 10
+
+
+def _digits(code) -> str:
+    return "".join(ch for ch in str(code).strip() if ch not in " -")
+
+
+def is_valid_gtin(code) -> bool:
+    """True if code is an EAN-8/UPC-A/EAN-13/GTIN-14 (after zero padding) with a correct check digit."""
+    digits = _digits(code)
+    if not digits.isdigit() or len(digits) > GTIN_LENGTH:
+        return False
+    padded = digits.zfill(GTIN_LENGTH)
+    if len(padded.lstrip("0")) < 2:
+        return False
+    return gtin_check_digit(padded[:-1]) == int(padded[-1])
+
+
+def normalize_gtin(code, validate: bool = False) -> Optional[str]:
+    """
+    Canonical GTIN-14 key: digits only, left-padded with zeros to 14 digits.
+    "5400141123456", "05400141123456" and "012345678905" / "12345678905"
+    map to the same key as their padded form.
+
+    Returns None for empty, non-numeric or too long codes, and with
+    validate=True also for codes with a wrong check digit.
+    """
+    if code is None:
+        return None
+    digits = _digits(code)
+    if not digits or not digits.isdigit() or len(digits) > GTIN_LENGTH:
+        return None
+    if validate and not is_valid_gtin(digits):
+        return None
+    return digits.zfill(GTIN_LENGTH)
+
+
+def barcode_forms(code) -> List[str]:
+    """
+    The ways a barcode can be stored as text: as given, and its GTIN without and with the
+    zero padding of every GTIN length ("5400141123456", "05400141123456", ...).
+    For rows where the gtin14 key is missing; non-numeric codes only match as given.
+    """
+    if code is None:
+        return []
+    raw = str(code).strip()
+    gtin = normalize_gtin(code)
+    if gtin is None:
+        return [raw] if raw else []
+    body = gtin.lstrip("0") or "0"
+    forms = [raw, body] + [body.zfill(length) for length in VALID_LENGTHS if length >= len(body)]
+    return list(dict.fromkeys(forms))
@@ -0,0 +1,185 @@
+import logging
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from app.services import resource_versions
+from app.services.database_service import get_database_service
+
+logger = logging.getLogger(__name__)
+
+# Herprijzen van boodschappenlijsten na een promotie-ingestion. Lijsten met items die naar
+# een net gedeactiveerde promotie verwijzen hebben verouderde estimated_total_price/
+# estimated_savings: die lijsten worden set-based gezocht en gelockt, hun items komen als
+# arrays binnen (één rij), alle lijnen worden in één numpy pass geprijsd en de nieuwe
+# totals gaan terug met één UPDATE ... FROM unnest().
+#
+# price_lines() is dezelfde regel als shopping_line_pricing() in
+# app.scripts.migrate_shopping_lists: samen wijzigen. tests/test_list_repricing.py houdt
+# beide gelijk (de SQL kant alleen met TEST_DATABASE_URL).
+
+_repricing_stats = {"runs": 0, "lists_repriced": 0, "lists_changed": 0, "last_lists_per_second": None}
+
+
+def _split(values: np.ndarray):
+    high = values * 134217729.0 - (values * 134217729.0 - values)
+    return high, values - high
+
+
+def _product_error(a: np.ndarray, b: np.ndarray, product: np.ndarray) -> np.ndarray:
+    # a * b - product exact (Dekker)
+    a_high, a_low = _split(a)
+    b_high, b_low = _split(b)
+    return ((a_high * b_high - product) + a_high * b_low + a_low * b_high) + a_low * b_low
+
+
+def _round_cents(values: np.ndarray) -> np.ndarray:
+    # Zoals round(x::numeric, 2) in Postgres: float8 -> numeric houdt 15 significante cijfers
+    # (1.005 * 100 = 100.49999... wordt 100.500000000000), daarna half weg van nul. Een vaste
+    # epsilon rondt bedragen als 0.04499999999999987 verkeerd naar boven af.
+    values = np.asarray(values, dtype=float)
+    magnitude = np.abs(values)
+    nonzero = magnitude > 0
+    safe = np.where(nonzero, magnitude, 1.0)
+    exponent = np.floor(np.log10(safe))
+    exponent += safe >= 10.0 ** (exponent + 1)
+    exponent -= safe < 10.0 ** exponent
+    # Mantisse van 15 cijfers als geheel getal (zoals printf %.15g): valt het product op
+    # precies .5, dan beslist de afrondingsfout van de vermenigvuldiging, een echte tie gaat
+    # naar even. Daarna exact in gehele getallen naar centen. Onder 1e-8 is het toch 0.
+    shift = np.minimum(14 - exponent, 22)
+    scale = 10.0 ** shift
+    scaled = safe * scale
+    digits = np.floor(scaled)
+    half = scaled - digits == 0.5
+    error = _product_error(safe, scale, scaled)
+    digits += (scaled - digits > 0.5) | (half & ((error > 0) | ((error == 0) & (digits % 2 == 1))))
+    digits = digits.astype(np.int64)
+    divisor = 10 ** np.clip(shift - 2, 0, 18).astype(np.int64)
+    cents = np.where(shift >= 2, (digits + divisor // 2) // divisor, np.rint(safe * 100))
+    # Geen -0.0: numeric kent dat niet
+    return np.where(nonzero & (cents > 0), np.sign(values) * cents / 100, 0.0)
+
+
+def price_lines(
+    quantity: np.ndarray,
+    has_promo: np.ndarray,
+    original_price: np.ndarray,
+    promo_price: np.ndarray,
+    deal_quantity: np.ndarray,
+    is_meerdere_artikels: np.ndarray,
+):
+    """
+    (line_total, savings) per line, rounded to cents. Prices are float arrays with NaN for
+    NULL, deal_quantity an int array with 0 for NULL. A line without a price counts as 0.
+    """
+    original = np.nan_to_num(original_price)
+    promo_unit = np.nan_to_num(promo_price)
+    promo = has_promo & (original != 0) & (promo_unit != 0)
+    deal = promo & is_meerdere_artikels & (deal_quantity > 1)
+
+    group_size = np.where(deal_quantity > 1, deal_quantity, 1)
+    groups = np.where(deal_quantity > 1, quantity // group_size, 0)
+    remaining = np.where(deal_quantity > 1, quantity % group_size, quantity)
+
+    line_total = np.select(
+        [deal, promo],
+        [groups * deal_quantity * promo_unit + remaining * original, promo_unit * quantity],
+        original * quantity,
+    )
+    savings = np.select(
+        [deal, promo],
+        [groups * deal_quantity * (original - promo_unit), (original - promo_unit) * quantity],
+        0.0,
+    )
+    return _round_cents(line_total), _round_cents(savings)
+
+
+async def reprice_lists_for_promotions(promo_ids: List[str]) -> Dict[str, Any]:
+    """
+    Recompute the totals of every list with an item on one of these promotions
+    (e.g. the ones deactivate_old_promotions() just expired), in one transaction.
+    """
+    if not promo_ids:
+        return {"lists": 0, "changed": 0, "seconds": 0.0, "lists_per_second": None}
+
+    start = time.perf_counter()
+    db = await get_database_service()
+    async with db.pool.acquire() as conn, conn.transaction():
+        # Getroffen lijsten locken (vaste volgorde): deltas van gelijktijdige bewerkingen
+        # komen na de nieuwe totals
+        list_ids = [row["list_id"] for row in await conn.fetch(
+            """
+            SELECT sl.list_id
+            FROM shopping_lists sl
+            WHERE sl.list_id IN (
+                SELECT list_id FROM shopping_list_items WHERE promo_id = ANY($1::uuid[])
+            )
+            ORDER BY sl.list_id
+            FOR UPDATE
+            """,
+            promo_ids
+        )]
+        if not list_ids:
+            return {"lists": 0, "changed": 0, "seconds": round(time.perf_counter() - start, 3), "lists_per_second": None}
+
+        # Alle items van die lijsten als kolom-arrays in één rij
+        items = await conn.fetchrow(
+            """
+            SELECT array_agg(l.idx - 1) AS list_index,
+                   array_agg(sli.quantity) AS quantity,
+                   array_agg(COALESCE(sli.has_promo, false)) AS has_promo,
+                   array_agg(COALESCE(pr.original_price, p.price)::float8) AS original_price,
+                   array_agg(pr.promo_price::float8) AS promo_price,
+                   array_agg(COALESCE(pr.deal_quantity, 0)::int) AS deal_quantity,
+                   array_agg(COALESCE(pr.is_meerdere_artikels, false)) AS is_meerdere_artikels
+            FROM unnest($1::uuid[]) WITH ORDINALITY AS l(list_id, idx)
+            JOIN shopping_list_items sli ON sli.list_id = l.list_id
+            LEFT JOIN products p ON p.product_id = sli.product_id
+            LEFT JOIN promotions pr ON pr.promo_id = sli.promo_id AND sli.has_promo AND pr.is_active
+            """,
+            list_ids
+        )
+
+        list_index = np.array(items["list_index"] or [], dtype=np.int64)
+        line_total, savings = price_lines(
+            np.nan_to_num(np.array(items["quantity"] or [], dtype=float)).astype(np.int64),
+            np.array(items["has_promo"] or [], dtype=bool),
+            np.array(items["original_price"] or [], dtype=float),
+            np.array(items["promo_price"] or [], dtype=float),
+            np.array(items["deal_quantity"] or [], dtype=np.int64),
+            np.array(items["is_meerdere_artikels"] or [], dtype=bool),
+        )
+        totals = _round_cents(np.bincount(list_index, weights=line_total, minlength=len(list_ids)))
+        savings_totals = _round_cents(np.bincount(list_index, weights=savings, minlength=len(list_ids)))
+
+        result = await conn.execute(
+            """
+            UPDATE shopping_lists sl
+            SET estimated_total_price = t.total, estimated_savings = t.savings
+            FROM unnest($1::uuid[], $2::float8[], $3::float8[]) AS t(list_id, total, savings)
+            WHERE sl.list_id = t.list_id
+              AND (sl.estimated_total_price IS DISTINCT FROM t.total::numeric
+                   OR sl.estimated_savings IS DISTINCT FROM t.savings::numeric)
+            """,
+            list_ids, totals.tolist(), savings_totals.tolist()
+        )
+    changed = int(result.split()[-1])
+    # Lijnprijzen in de items response zijn mee veranderd
+    await resource_versions.bump(resource_versions.LIST, list_ids)
+
+    elapsed = time.perf_counter() - start
+    lists_per_second = len(list_ids) / elapsed if elapsed > 0 else None
+    _repricing_stats["runs"] += 1
+    _repricing_stats["lists_repriced"] += len(list_ids)
+    _repricing_stats["lists_changed"] += changed
+    _repricing_stats["last_lists_per_second"] = round(lists_per_second, 1) if lists_per_second else None
+    logger.info("Repriced %d lists (%d items, %d totals changed) in %.2fs: %.0f lists/s",
+                len(list_ids), len(list_index), changed, elapsed, lists_per_second or 0)
+    return {"lists": len(list_ids), "changed": changed, "seconds": round(elapsed, 3),
+            "lists_per_second": _repricing_stats["last_lists_per_second"]}
+
+
+def repricing_stats() -> dict:
+    return dict(_repricing_stats)
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+# Begrensde in-process cache voor barcode lookups: LRU + TTL, met expliciete
+# negatieve entries voor barcodes die nergens gevonden werden (ook niet via de API).
+
+DEFAULT_MAX_ENTRIES = int(os.getenv("LOOKUP_CACHE_MAX_ENTRIES", "20000"))
+DEFAULT_TTL = float(os.getenv("LOOKUP_CACHE_TTL_SECONDS", str(6 * 3600)))
+DEFAULT_NEGATIVE_TTL = float(os.getenv("LOOKUP_CACHE_NEGATIVE_TTL_SECONDS", str(30 * 60)))
+
+_NOT_FOUND = object()  # waarde van een negatieve entry
+
+_caches: List["LookupCache"] = []
+
+
+class LookupCache:
+    """Thread-safe LRU cache with per-entry expiry and negative entries."""
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl: float = DEFAULT_TTL,
+        negative_ttl: float = DEFAULT_NEGATIVE_TTL,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        _caches.append(self)
+
+    def get(self, key: Hashable) -> Tuple[bool, object]:
+        """
+        Returns (found, value). found=True with value None means a cached
+        "not found anywhere"; found=False means the caller has to look it up.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            if value is _NOT_FOUND:
+                self.negative_hits += 1
+                return True, None
+            self.hits += 1
+            return True, value
+
+    def put(self, key: Hashable, value: object, ttl: Optional[float] = None):
+        """Cache value (None = negative entry); ttl overrides the cache's TTL for this entry."""
+        if value is None:
+            self.put_negative(key)
+        else:
+            self._store(key, value, self.ttl if ttl is None else ttl)
+
+    def put_negative(self, key: Hashable):
+        """Remember that this key was not found anywhere (for negative_ttl seconds)."""
+        if self.negative_ttl > 0:
+            self._store(key, _NOT_FOUND, self.negative_ttl)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, key: Hashable, value: object, ttl: float):
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            negative_entries = sum(1 for _, value in self._entries.values() if value is _NOT_FOUND)
+            return {
+                "entries": len(self._entries),
+                "negative_entries": negative_entries,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "negative_ttl_seconds": self.negative_ttl,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round((self.hits + self.negative_hits) / lookups, 4) if lookups else None,
+            }
+
+
+def all_stats() -> Dict[str, Dict[str, object]]:
+    """Counters of every lookup cache in this process, keyed by cache name."""
+    return {cache.name: cache.stats() for cache in _caches}
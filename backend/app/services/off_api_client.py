@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+from app.services import redis_cache
+
+logger = logging.getLogger(__name__)
+
+# Eén gedeelde async client voor de publieke OpenFoodFacts API:
+# keep-alive connection pool, enkel de velden die we gebruiken (fields=),
+# begrensde concurrency, globale rate limit, retry met jitter en een circuit breaker.
+# De client draait op een eigen event loop thread zodat zowel async routes als
+# sync code (threads) dezelfde pool en dezelfde rate limit delen.
+#
+# De token bucket is per proces: met N uvicorn workers zou dat N x OFF_API_RATE_PER_MINUTE
+# zijn. Met Redis telt daarom elke worker ook mee in een gedeeld venster per minuut
+# (INCR op rate:off_api:<minuut>), zodat alle workers samen onder de limiet blijven.
+# Zonder Redis geldt enkel de limiet per proces.
+
+OFF_PRODUCT_URL = "https://world.openfoodfacts.org/api/v2/product/{barcode}.json"
+USER_AGENT = "MealPrepApp/1.0"
+
+# Velden die de app gebruikt; de rest van het product JSON wordt niet gedownload
+FIELDS = "code,product_name,brands,nutriments,image_front_url,image_url"
+
+# OFF publiceert 100 product reads per minuut per IP
+RATE_PER_MINUTE = float(os.getenv("OFF_API_RATE_PER_MINUTE", "100"))
+MAX_CONCURRENCY = int(os.getenv("OFF_API_MAX_CONCURRENCY", "8"))
+TIMEOUT = float(os.getenv("OFF_API_TIMEOUT", "5"))
+MAX_RETRIES = int(os.getenv("OFF_API_MAX_RETRIES", "2"))
+BACKOFF_BASE = 0.5        # seconden, verdubbelt per poging (+ jitter)
+BREAKER_FAILURES = int(os.getenv("OFF_API_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("OFF_API_BREAKER_RESET_SECONDS", "60"))
+
+
+class OffApiUnavailable(Exception):
+    """The OFF API could not answer (network error, 5xx, rate limited or circuit open)."""
+
+
+class _TokenBucket:
+    """
+    Rate limiter: `rate` requests per second with a small burst in this process, and
+    at most `per_minute` per minute over all workers when Redis is available.
+    """
+
+    def __init__(self, rate: float, burst: int, per_minute: float):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.per_minute = per_minute
+        self.shared_waits = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+            await self._acquire_shared()
+
+    async def _acquire_shared(self):
+        while redis_cache.available():
+            window = int(time.time() // 60)
+            count = await asyncio.to_thread(redis_cache.incr, redis_cache.RATES, f"off_api:{window}", 120)
+            if count is None or count <= self.per_minute:
+                return
+            # Venster vol (andere workers): wachten tot de volgende minuut
+            self.shared_waits += 1
+            await asyncio.sleep((window + 1) * 60 - time.time() + random.random())
+
+
+class _CircuitBreaker:
+    """Open after N consecutive failures; one trial request after the reset period."""
+
+    def __init__(self, failures: int, reset_seconds: float):
+        self.max_failures = failures
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.reset_seconds and not self.trial_running:
+            self.trial_running = True  # half-open
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def end_trial(self):
+        """The trial request ended without a verdict (e.g. cancelled): allow a new trial."""
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_running = False
+        if self.failures >= self.max_failures:
+            if self.opened_at is None:
+                logger.warning("OpenFoodFacts API circuit open after %d failures", self.failures)
+            self.opened_at = time.monotonic()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.trial_running else "open"
+
+
+class OpenFoodFactsClient:
+    """Async OFF API client; create it and use it on one event loop."""
+
+    def __init__(self):
+        self._http = httpx.AsyncClient(
+            timeout=TIMEOUT,
+            headers={"User-Agent": USER_AGENT},
+            limits=httpx.Limits(max_connections=MAX_CONCURRENCY, max_keepalive_connections=MAX_CONCURRENCY),
+        )
+        self._semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+        self._bucket = _TokenBucket(RATE_PER_MINUTE / 60.0, burst=max(1, MAX_CONCURRENCY), per_minute=RATE_PER_MINUTE)
+        self._breaker = _CircuitBreaker(BREAKER_FAILURES, BREAKER_RESET_SECONDS)
+        self.stats = {"requests": 0, "found": 0, "not_found": 0, "retries": 0, "failures": 0, "rejected": 0}
+
+    async def fetch_product(self, barcode: str) -> Optional[dict]:
+        """
+        The projected OFF product dict, or None if OFF does not know the barcode.
+        Raises OffApiUnavailable when OFF could not answer (do not cache that as "not found").
+        """
+        if not self._breaker.allow():
+            self.stats["rejected"] += 1
+            raise OffApiUnavailable("circuit open")
+        trial = self._breaker.trial_running
+        try:
+            return await self._fetch(barcode)
+        finally:
+            # Half-open trial zonder uitkomst (geannuleerd): anders blijft de breaker dicht
+            if trial and self._breaker.trial_running:
+                self._breaker.end_trial()
+
+    async def _fetch(self, barcode: str) -> Optional[dict]:
+        async with self._semaphore:
+            for attempt in range(MAX_RETRIES + 1):
+                if attempt:
+                    self.stats["retries"] += 1
+                    await asyncio.sleep(BACKOFF_BASE * 2 ** (attempt - 1) * (0.5 + random.random()))
+                await self._bucket.acquire()
+                self.stats["requests"] += 1
+                try:
+                    response = await self._http.get(OFF_PRODUCT_URL.format(barcode=barcode), params={"fields": FIELDS})
+                except httpx.HTTPError as e:
+                    error = f"{type(e).__name__}: {e}"
+                    continue
+                if response.status_code == 404:
+                    # Onbekende barcode: v2 antwoordt met 404 + status 0
+                    return self._not_found()
+                if response.status_code == 429 or response.status_code >= 500:
+                    error = f"HTTP {response.status_code}"
+                    continue
+                try:
+                    data = response.json()
+                except ValueError:
+                    error = "invalid JSON"
+                    continue
+                if data.get("status") != 1:
+                    return self._not_found()
+                self._breaker.record_success()
+                self.stats["found"] += 1
+                return data.get("product") or {}
+
+        self._breaker.record_failure()
+        self.stats["failures"] += 1
+        raise OffApiUnavailable(f"OpenFoodFacts API failed for {barcode}: {error}")
+
+    def _not_found(self) -> None:
+        self._breaker.record_success()
+        self.stats["not_found"] += 1
+        return None
+
+    @property
+    def circuit_state(self) -> str:
+        return self._breaker.state
+
+    async def aclose(self):
+        await self._http.aclose()
+
+
+# ==================== SHARED INSTANCE ====================
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_client: Optional[OpenFoodFactsClient] = None
+_start_lock = threading.Lock()
+
+
+def _ensure_started() -> asyncio.AbstractEventLoop:
+    """Start the dedicated event loop thread with the shared client (once)."""
+    global _loop, _client
+    if _loop is None:
+        with _start_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="off-api", daemon=True).start()
+                _client = asyncio.run_coroutine_threadsafe(_create_client(), loop).result()
+                _loop = loop
+    return _loop
+
+
+async def _create_client() -> OpenFoodFactsClient:
+    return OpenFoodFactsClient()
+
+
+async def fetch_product(barcode: str) -> Optional[dict]:
+    """Async entry point, usable from any event loop (awaits the shared client)."""
+    future = asyncio.run_coroutine_threadsafe(_client_fetch(barcode), _ensure_started())
+    return await asyncio.wrap_future(future)
+
+
+def fetch_product_sync(barcode: str) -> Optional[dict]:
+    """Blocking entry point for sync code running in a worker thread (never on the event loop)."""
+    future = asyncio.run_coroutine_threadsafe(_client_fetch(barcode), _ensure_started())
+    return future.result()
+
+
+async def _client_fetch(barcode: str) -> Optional[dict]:
+    return await _client.fetch_product(barcode)
+
+
+def stats() -> dict:
+    if _client is None:
+        return {"started": False}
+    return {"started": True, "circuit": _client.circuit_state, "shared_rate_waits": _client._bucket.shared_waits,
+            **_client.stats}
+
+
+def close_client():
+    """Close the HTTP pool and stop the loop thread (called on app shutdown)."""
+    global _loop, _client
+    if _loop is None:
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_client.aclose(), _loop).result(timeout=5)
+    except Exception as e:
+        logger.warning("Error closing OpenFoodFacts client: %s", e)
+    _loop.call_soon_threadsafe(_loop.stop)
+    _loop, _client = None, None
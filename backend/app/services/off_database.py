@@ -0,0 +1,161 @@
+import asyncio
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Gedeelde, read-only toegang tot de lokale OpenFoodFacts SQLite database.
+# Elke thread krijgt één herbruikbare connectie i.p.v. connect/close per lookup.
+# Een nieuwe versie van het bestand (os.replace door build_off_database/apply_off_delta)
+# wordt opgemerkt via inode/mtime; connecties gaan dan lazy opnieuw open.
+
+DB_PATH = Path(__file__).resolve().parent.parent / "data" / "openfoodfacts.db"
+
+MMAP_SIZE = int(os.getenv("OFF_DB_MMAP_SIZE", str(512 * 1024 * 1024)))   # bytes
+CACHE_SIZE_KB = int(os.getenv("OFF_DB_CACHE_KB", str(64 * 1024)))         # page cache per connectie
+MAX_WORKERS = int(os.getenv("OFF_DB_MAX_WORKERS", "4"))                   # threads voor async routes
+VERSION_CHECK_SECONDS = float(os.getenv("OFF_DB_VERSION_CHECK_SECONDS", "5"))  # max. één stat() per interval
+
+_local = threading.local()
+_version_lock = threading.Lock()
+_file_version: Optional[tuple] = None
+_version_checked_at = 0.0
+_generation = 0    # +1 telkens het bestand vervangen werd
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def open_readonly_connection(path: Path = DB_PATH) -> sqlite3.Connection:
+    """
+    Open a read-only, immutable connection with mmap and a tuned page cache.
+    immutable=1 skips file locking and change detection: the file must not be
+    modified while it is open (write a new file and os.replace it instead; open
+    connections keep reading the old inode until they are reopened).
+    """
+    uri = f"{Path(path).resolve().as_uri()}?mode=ro&immutable=1"
+    conn = sqlite3.connect(uri, uri=True)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    conn.execute("PRAGMA query_only = ON")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def _stat_version(path: Path) -> Optional[tuple]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def file_version(path: Optional[Path] = None) -> Optional[tuple]:
+    """(device, inode, mtime, size) of the database file; unchanged by an os.replace into place."""
+    return _stat_version(path or DB_PATH)
+
+
+def current_generation() -> int:
+    """Generation of DB_PATH; increases when the file was swapped (checked at most every few seconds)."""
+    global _file_version, _version_checked_at, _generation
+    now = time.monotonic()
+    if now - _version_checked_at < VERSION_CHECK_SECONDS:
+        return _generation
+    with _version_lock:
+        if now - _version_checked_at >= VERSION_CHECK_SECONDS:
+            version = _stat_version(DB_PATH)
+            if version is not None:
+                if _file_version is not None and version != _file_version:
+                    _generation += 1
+                    logger.info("openfoodfacts.db changed on disk, reopening connections (generation %d)", _generation)
+                _file_version = version
+            _version_checked_at = now
+    return _generation
+
+
+def version_tag() -> str:
+    """
+    Short id of the current file (mtime + size), the same in every worker and on every host
+    with the same copy: for shared cache keys that must not outlive a swap.
+    """
+    current_generation()
+    version = _file_version
+    return f"{version[2]:x}{version[3]:x}" if version else "0"
+
+
+def get_connection() -> sqlite3.Connection:
+    """Return the connection of the current thread, opening it on first use. Do not close it."""
+    generation = current_generation()
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.generation != generation:
+        # Nieuw bestand: schema caches vergeten en een nieuwe connectie openen. De oude
+        # wordt niet expliciet gesloten (een lopende lookup kan ze nog vasthouden); ze
+        # sluit zodra de laatste referentie verdwijnt en geeft dan de oude inode vrij.
+        conn = None
+        _local.columns = {}
+        _local.tables = {}
+    if conn is None:
+        conn = open_readonly_connection(DB_PATH)
+        _local.conn = conn
+        _local.generation = generation
+    return conn
+
+
+def _current_connection() -> sqlite3.Connection:
+    # Schema checks horen bij de connectie die de lookup al gebruikt (geen versie check)
+    return getattr(_local, "conn", None) or get_connection()
+
+
+def has_column(table: str, column: str) -> bool:
+    """Whether the OFF database has table.column (e.g. products.gtin14), cached per thread."""
+    cache = getattr(_local, "columns", None)
+    if cache is None:
+        cache = _local.columns = {}
+    key = (table, column)
+    if key not in cache:
+        columns = {row[1] for row in _current_connection().execute(f"PRAGMA table_info({table})")}
+        cache[key] = column in columns
+    return cache[key]
+
+
+def has_table(table: str) -> bool:
+    """Whether the OFF database has the given table (e.g. products_fts), cached per thread."""
+    cache = getattr(_local, "tables", None)
+    if cache is None:
+        cache = _local.tables = {}
+    if table not in cache:
+        row = _current_connection().execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ? AND type IN ('table', 'view')", (table,)
+        ).fetchone()
+        cache[table] = row is not None
+    return cache[table]
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="off-db")
+    return _executor
+
+
+async def run_in_db_executor(func, *args, **kwargs):
+    """Run a blocking SQLite lookup on the bounded executor so it never blocks the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executor():
+    """Stop the lookup executor (called on app shutdown)."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
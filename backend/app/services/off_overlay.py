@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app.services.gtin import normalize_gtin
+from app.services.off_database import DB_PATH
+
+# Schrijfbare overlay naast de (immutable) openfoodfacts.db: producten die via de
+# OpenFoodFacts API gevonden werden, zodat de volgende scan een lokale lookup is.
+# Ook "niet gevonden" wordt bewaard, met een kortere refresh.
+
+OVERLAY_PATH = Path(os.getenv("OFF_OVERLAY_PATH", str(DB_PATH.parent / "off_overlay.db")))
+REFRESH_DAYS = float(os.getenv("OFF_OVERLAY_REFRESH_DAYS", "30"))            # daarna opnieuw via de API
+NOT_FOUND_REFRESH_DAYS = float(os.getenv("OFF_OVERLAY_NOT_FOUND_DAYS", "7"))
+
+COLUMNS = (
+    "barcode", "product_name", "brands",
+    "energy_kcal_100g", "proteins_100g", "carbohydrates_100g",
+    "fat_100g", "sugars_100g", "fiber_100g", "salt_100g", "image_url",
+)
+
+CHUNK_SIZE = 900   # max ? parameters per query
+
+_local = threading.local()
+
+
+def _key(barcode: str) -> str:
+    return normalize_gtin(barcode) or barcode
+
+
+def get_connection() -> sqlite3.Connection:
+    """Writable connection of the current thread; creates the overlay on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        OVERLAY_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(OVERLAY_PATH, timeout=5)
+        conn.row_factory = sqlite3.Row
+        # WAL: lezers blokkeren niet tijdens een write, ook niet over workers heen
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS api_products (
+                key TEXT PRIMARY KEY,          -- GTIN-14 (of de barcode als die niet numeriek is)
+                found INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,      -- unix timestamp van de API call
+                {", ".join(f"{c} {'TEXT' if c in ('barcode', 'product_name', 'brands', 'image_url') else 'REAL'}" for c in COLUMNS)}
+            )
+        """)
+        conn.commit()
+        _local.conn = conn
+    return conn
+
+
+def lookup(barcodes: List[str]) -> Dict[str, Optional[sqlite3.Row]]:
+    """
+    Fresh overlay entries per input barcode: a row for products the API found,
+    None for barcodes the API did not know. Stale or absent barcodes are left out.
+    """
+    keys = {b: _key(b) for b in barcodes}
+    if not keys:
+        return {}
+    now = time.time()
+    unique_keys = list(set(keys.values()))
+    rows = {}
+    for i in range(0, len(unique_keys), CHUNK_SIZE):
+        chunk = unique_keys[i:i + CHUNK_SIZE]
+        placeholders = ",".join("?" for _ in chunk)
+        for row in get_connection().execute(f"SELECT * FROM api_products WHERE key IN ({placeholders})", chunk):
+            rows[row["key"]] = row
+
+    fresh = {}
+    for barcode, key in keys.items():
+        row = rows.get(key)
+        if row is None:
+            continue
+        max_age = (REFRESH_DAYS if row["found"] else NOT_FOUND_REFRESH_DAYS) * 86400
+        if now - row["fetched_at"] < max_age:
+            fresh[barcode] = row if row["found"] else None
+    return fresh
+
+
+def lookup_stale(barcode: str) -> Optional[sqlite3.Row]:
+    """Any found entry regardless of age (fallback when the API is unavailable)."""
+    return get_connection().execute(
+        "SELECT * FROM api_products WHERE key = ? AND found = 1", (_key(barcode),)
+    ).fetchone()
+
+
+def save(barcode: str, values: Optional[dict]):
+    """Store an API result (values keyed by COLUMNS), or None for "not found"."""
+    found = values is not None
+    values = {**(values or {}), "barcode": (values or {}).get("barcode") or barcode}
+    row = [_key(barcode), int(found), time.time()] + [values.get(c) for c in COLUMNS]
+    conn = get_connection()
+    conn.execute(
+        f"""
+        INSERT INTO api_products (key, found, fetched_at, {", ".join(COLUMNS)})
+        VALUES ({",".join("?" for _ in row)})
+        ON CONFLICT(key) DO UPDATE SET
+            found = excluded.found,
+            fetched_at = excluded.fetched_at,
+            {", ".join(f"{c} = excluded.{c}" for c in COLUMNS)}
+        """,
+        row,
+    )
+    conn.commit()
@@ -1,15 +1,21 @@
 from email.header import Header
-import sqlite3
+import asyncio
 import httpx
-from pathlib import Path
-from datetime import datetime, timedelta
+import logging
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 import os
-import requests as http_requests
 from supabase import create_client, Client
 from fastapi import Header
+from app.services.off_database import get_connection
+from app.services.database_service import DATABASE_URL, get_database_service
+from app.services.gtin import barcode_forms, normalize_gtin
+from app.services import recent_scans, scan_log_queue
+from app.services.scan_log_queue import ScanEvent
+from app.services.product_resolver import resolve_product
+from app.services.product_service import ProductMatch
 
-DB_PATH = Path(__file__).resolve().parent.parent / "data" / "openfoodfacts.db"
+logger = logging.getLogger(__name__)
 
 OPENFOODFACTS_API_URL = "https://world.openfoodfacts.org/api/v2/product/{barcode}.json"
 
@@ -20,19 +26,17 @@ try:
     
     if SUPABASE_URL and SUPABASE_KEY:
         supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-        print("Supabase client initialized successfully")
+        logger.info("Supabase client initialized successfully")
     else:
         supabase = None
-        print("Warning: Supabase credentials not found. Scan logging disabled.")
+        logger.warning("Supabase credentials not found. Scan logging disabled.")
 except Exception as e:
     supabase = None
-    print(f"Warning: Failed to initialize Supabase: {e}")
-
+    logger.warning("Failed to initialize Supabase: %s", e)
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Gedeelde read-only connectie per thread, niet sluiten
+    return get_connection()
 
 
 def check_recent_scan(
@@ -58,17 +62,106 @@ def check_recent_scan(
         
         if result.data and len(result.data) > 0:
             last_scan_time = result.data[0]['scanned_at']
-            print(f"⏭Duplicate scan detected - User {user_id} already scanned {barcode} at {last_scan_time}")
+            logger.debug("Duplicate scan detected - user %s already scanned %s at %s", user_id, barcode, last_scan_time,
+                         extra={"sample": "duplicate_scan"})
             return True
         
         return False
         
     except Exception as e:
-        print(f"⚠ Error checking for duplicate scan: {e}")
+        logger.warning("Error checking for duplicate scan: %s", e)
         # Bij error, log wel om geen data te verliezen
         return False
 
 
+_gtin14_filled: Optional[bool] = None   # backfill_gtin gedraaid (trigger), eenmaal per proces gevraagd
+
+
+def _supabase_gtin14_filled() -> bool:
+    """Whether every products row has its gtin14 (products_gtin14_filled() from backfill_gtin)."""
+    global _gtin14_filled
+    if _gtin14_filled is None:
+        try:
+            _gtin14_filled = bool(supabase.rpc("products_gtin14_filled").execute().data)
+        except Exception:
+            _gtin14_filled = False   # functie bestaat niet: nog niet gebackfilld
+    return _gtin14_filled
+
+
+def _supabase_product_ids(barcodes: list) -> dict:
+    """
+    product_id per canonical key (GTIN-14, else the barcode) via the Supabase client: on
+    gtin14, plus the barcode forms for rows without it (databases not backfilled yet).
+    """
+    keys = {normalize_gtin(b) or b for b in barcodes}
+    gtins = [k for k in keys if normalize_gtin(k)]
+    others = [k for k in keys if not normalize_gtin(k)]
+    query = supabase.table("products").select("product_id, barcode, gtin14")
+    if gtins and _supabase_gtin14_filled():
+        # Elke GTIN staat op gtin14: tekstvormen enkel voor codes die geen GTIN zijn
+        forms = ",".join(f'"{key}"' for key in others)
+        if forms:
+            query = query.or_(f"gtin14.in.({','.join(gtins)}),barcode.in.({forms})")
+        else:
+            query = query.filter("gtin14", "in", f"({','.join(gtins)})")
+        rows = query.execute().data or []
+    else:
+        forms = ",".join(f'"{form}"' for key in keys for form in barcode_forms(key))
+        if not forms:
+            return {}
+        try:
+            if gtins:
+                query = query.or_(f"gtin14.in.({','.join(gtins)}),barcode.in.({forms})")
+            else:
+                query = query.filter("barcode", "in", f"({forms})")
+            rows = query.execute().data or []
+        except Exception:
+            # Oudere database zonder gtin14 kolom
+            rows = supabase.table("products").select("product_id, barcode") \
+                .filter("barcode", "in", f"({forms})").execute().data or []
+
+    product_ids = {}
+    for row in rows:
+        key = row.get("gtin14") or normalize_gtin(row["barcode"]) or row["barcode"]
+        product_ids.setdefault(key, row["product_id"])
+    return product_ids
+
+
+def insert_scan_supabase(barcode: str, user_id: str, scan_mode: str = "barcode", product_id=None) -> dict | None:
+    """Insert one scanned_items row via the Supabase client (product_id looked up when not given)."""
+    if product_id is None:
+        product_id = _supabase_product_ids([barcode]).get(normalize_gtin(barcode) or barcode)
+
+    scan_data = {
+        "user_id": user_id,
+        "barcode": barcode,
+        "scan_mode": scan_mode,
+        "product_id": str(product_id) if product_id is not None else None,
+        "scanned_at": datetime.now().isoformat(),
+    }
+    result = supabase.table("scanned_items").insert(scan_data).execute()
+    return result.data[0] if result.data else None
+
+
+def insert_scans_supabase(scans: list) -> int:
+    """Insert many scans with one multi-row insert via the Supabase client."""
+    missing = [s["barcode"] for s in scans if not s.get("product_id")]
+    product_ids = _supabase_product_ids(missing) if missing else {}
+
+    rows = []
+    for scan in scans:
+        product_id = scan.get("product_id") or product_ids.get(normalize_gtin(scan["barcode"]) or scan["barcode"])
+        rows.append({
+            "user_id": scan["user_id"],
+            "barcode": scan["barcode"],
+            "scan_mode": scan.get("scan_mode") or "barcode",
+            "product_id": str(product_id) if product_id is not None else None,
+            "scanned_at": scan["scanned_at"].isoformat(),
+        })
+    supabase.table("scanned_items").insert(rows).execute()
+    return len(rows)
+
+
 def log_scan_to_supabase(
     barcode: str,
     user_id: str,
@@ -81,7 +174,7 @@ def log_scan_to_supabase(
         return {"logged": False, "reason": "no_authenticated_user"}
     
     if not supabase:
-        print("Supabase not initialized, skipping scan log")
+        logger.debug("Supabase not initialized, skipping scan log", extra={"sample": "scan_log_disabled"})
         return {"logged": False, "reason": "supabase_not_initialized"}
     
     try:
@@ -95,176 +188,126 @@ def log_scan_to_supabase(
                     "reason": "duplicate_scan",
                     "message": f"Scan already logged within last {duplicate_window_minutes} minutes"
                 }
-            product_response = supabase.table("products") \
-            .select("product_id") \
-            .eq("barcode", barcode) \
-            .limit(1) \
-            .execute()
 
-        product_id = None
-
-        if product_response.data and len(product_response.data) > 0:
-            product_id = product_response.data[0]["product_id"]
-        
-        # Nieuwe scan loggen
-        scan_data = {
-            "user_id": user_id,
-            "barcode": barcode,
-            "scan_mode": scan_mode,
-            "product_id": product_id,
-            "scanned_at": datetime.now().isoformat(),
-        }
-        
-        result = supabase.table("scanned_items").insert(scan_data).execute()
-        print(f"Scan logged successfully for barcode: {barcode}, user: {user_id}")
+        data = insert_scan_supabase(barcode, user_id, scan_mode)
+        logger.debug("Scan logged for barcode %s, user %s", barcode, user_id, extra={"sample": "scan_logged"})
         
         return {
             "logged": True,
             "reason": "success",
-            "data": result.data[0] if result.data else None
+            "data": data
         }
         
     except Exception as e:
-        print(f"Error logging scan to Supabase: {e}")
+        logger.error("Error logging scan to Supabase: %s", e)
         return {"logged": False, "reason": "error", "error": str(e)}
 
 
-def _fetch_from_openfoodfacts_api(barcode: str) -> Optional[dict]:
-    """Fallback: haal product op via de publieke OpenFoodFacts API."""
+def to_scan_payload(match: ProductMatch) -> dict:
+    """Response shape of /food/barcode for a resolved product."""
+    return {
+        "barcode": match.barcode,
+        "name": match.product_name,
+        "brands": match.brands,
+        "nutriments": {
+            "energy_kcal": match.energy_kcal_100g,
+            "proteins": match.proteins_100g,
+            "carbohydrates": match.carbohydrates_100g,
+            "fat": match.fat_100g,
+            "sugars": match.sugars_100g,
+            "salt": match.salt_100g,
+        },
+        "image_url": match.image_url,
+    }
+
+
+# ==================== ASYNC SCAN LOGGING ====================
+
+async def is_duplicate_scan(barcode: str, user_id: str, window_minutes: int) -> bool:
+    """
+    Duplicate check via recent_scans (memory/Redis probe); scanned_items is only
+    queried while that store isn't warm for the whole window yet (cold start).
+    """
+    known = await recent_scans.is_recent(user_id, barcode, window_minutes)
+    if known is not None:
+        if known:
+            logger.debug("Duplicate scan detected - user %s already scanned %s", user_id, barcode,
+                         extra={"sample": "duplicate_scan"})
+        return known
+
+    if not DATABASE_URL:
+        return await asyncio.to_thread(check_recent_scan, barcode, user_id, window_minutes)
     try:
-        url = f"https://world.openfoodfacts.org/api/v2/product/{barcode}.json"
-        resp = http_requests.get(url, headers={"User-Agent": "MealPrepApp/1.0"}, timeout=5)
-        data = resp.json()
-        if data.get("status") != 1:
-            print(f"  OpenFoodFacts: barcode {barcode} niet gevonden.")
-            return None
-        p = data["product"]
-        n = p.get("nutriments", {})
-        img = p.get("image_front_url") or p.get("image_url")
-        print(f"  OpenFoodFacts match: {p.get('product_name', 'Onbekend')}")
-        return {
-            "barcode": barcode,
-            "name": p.get("product_name"),
-            "brands": p.get("brands"),
-            "nutriments": {
-                "energy_kcal": n.get("energy-kcal_100g"),
-                "proteins": n.get("proteins_100g"),
-                "carbohydrates": n.get("carbohydrates_100g"),
-                "fat": n.get("fat_100g"),
-                "sugars": n.get("sugars_100g"),
-                "salt": n.get("salt_100g"),
-            },
-            "image_url": img,
-        }
+        db = await get_database_service()
+        last_scan = await db.last_scan_at(user_id, barcode, window_minutes)
     except Exception as e:
-        print(f"  OpenFoodFacts API fout voor {barcode}: {e}")
-        return None
+        logger.warning("Error checking for duplicate scan: %s", e)
+        # Bij error, log wel om geen data te verliezen
+        return False
+    if last_scan is None:
+        return False
+    if last_scan.tzinfo is None:
+        last_scan = last_scan.replace(tzinfo=timezone.utc)
+    recent_scans.remember(user_id, barcode, last_scan.timestamp())
+    logger.debug("Duplicate scan detected - user %s already scanned %s at %s", user_id, barcode, last_scan,
+                 extra={"sample": "duplicate_scan"})
+    return True
 
 
-def get_product_by_barcode(
+async def get_product_by_barcode(
     barcode: str,
     user_id: str,
     log_scan: bool = True,
     allow_duplicate_scans: bool = False,
     duplicate_window_minutes: int = 1440
 ) -> dict | None:
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Try barcode variations: original, without leading zeros, 12→13 digit
-        barcode_variations = [barcode]
-        stripped = barcode.lstrip('0')
-        if stripped != barcode:
-            barcode_variations.append(stripped)
-        if len(barcode) == 12:
-            barcode_variations.append('0' + barcode)
-        if len(stripped) == 12:
-            barcode_variations.append('0' + stripped)
-
-        placeholders = ','.join(['?' for _ in barcode_variations])
-        cursor.execute(
-            f"""
-            SELECT
-                barcode,
-                product_name,
-                brands,
-                energy_kcal_100g,
-                proteins_100g,
-                carbohydrates_100g,
-                fat_100g,
-                sugars_100g,
-                salt_100g
-            FROM products
-            WHERE barcode IN ({placeholders})
-            LIMIT 1
-            """,
-            barcode_variations,
-        )
-
-        row = cursor.fetchone()
-        conn.close()
-
-        if not row:
-            # Fallback: OpenFoodFacts API
-            print(f"Barcode {barcode} niet in SQLite, OpenFoodFacts API wordt geprobeerd...")
-            off_product = _fetch_from_openfoodfacts_api(barcode)
-            if off_product is None:
-                return None
-            product = off_product
-        else:
-            product = {
-                "barcode": row["barcode"],
-                "name": row["product_name"],
-                "brands": row["brands"],
-                "nutriments": {
-                    "energy_kcal": row["energy_kcal_100g"],
-                    "proteins": row["proteins_100g"],
-                    "carbohydrates": row["carbohydrates_100g"],
-                    "fat": row["fat_100g"],
-                    "sugars": row["sugars_100g"],
-                    "salt": row["salt_100g"],
-                },
-            }
-
-        # Fetch image_url from Supabase if not already set (e.g. from OpenFoodFacts API)
-        if not product.get("image_url") and supabase:
-            try:
-                img_result = supabase.table("products") \
-                    .select("image_url") \
-                    .eq("barcode", barcode) \
-                    .limit(1) \
-                    .execute()
-                if img_result.data and len(img_result.data) > 0:
-                    product["image_url"] = img_result.data[0].get("image_url")
-                else:
-                    product["image_url"] = None
-            except Exception as e:
-                print(f"Warning: Could not fetch image_url from Supabase: {e}")
-                product["image_url"] = None
-        elif not product.get("image_url"):
-            product["image_url"] = None
-        
-        # Log de scan naar Supabase in achtergrond, falen blokkeert product niet
-        if log_scan:
-            scan_result = log_scan_to_supabase(
-                barcode, 
-                user_id,
-                allow_duplicates=allow_duplicate_scans,
-                duplicate_window_minutes=duplicate_window_minutes
-            )
-            # Voeg scan info toe aan product response
-            product["scan_logged"] = scan_result["logged"]
-            product["scan_status"] = scan_result["reason"]
-        else:
-            product["scan_logged"] = False
-            product["scan_status"] = "logging_disabled"
-        
-        return product
+    """
+    Resolve the product and decide on the scan log concurrently; the insert itself
+    is queued for the batched scan log flusher, so the response only waits for the product lookup.
+    """
+    logging_possible = log_scan and user_id and (DATABASE_URL or supabase)
+    duplicate_check = None
+    if logging_possible and not allow_duplicate_scans:
+        # Loopt gelijktijdig met de product resolutie
+        duplicate_check = asyncio.create_task(is_duplicate_scan(barcode, user_id, duplicate_window_minutes))
 
+    try:
+        # Eén resolutie over alle tiers, image_url en product_id zitten er al in
+        match = await resolve_product(barcode)
     except Exception as e:
-        print(f"Fout bij ophalen product uit DB: {e}")
+        logger.error("Fout bij ophalen product %s: %s", barcode, e)
+        match = None
+    if match is None:
+        if duplicate_check is not None:
+            duplicate_check.cancel()
         return None
-    
+    product = to_scan_payload(match)
+
+    if not log_scan:
+        product["scan_logged"] = False
+        product["scan_status"] = "logging_disabled"
+    elif not user_id:
+        product["scan_logged"] = False
+        product["scan_status"] = "no_authenticated_user"
+    elif not logging_possible:
+        logger.debug("Supabase not initialized, skipping scan log", extra={"sample": "scan_log_disabled"})
+        product["scan_logged"] = False
+        product["scan_status"] = "supabase_not_initialized"
+    elif duplicate_check is not None and await duplicate_check:
+        product["scan_logged"] = False
+        product["scan_status"] = "duplicate_scan"
+    else:
+        # Write-behind: de insert gebeurt gebundeld door de scan log flusher
+        status = scan_log_queue.enqueue(ScanEvent(user_id, barcode, "barcode", match.product_id))
+        logger.debug("Scan %s for barcode %s, user %s", status, barcode, user_id, extra={"sample": "scan_logged"})
+        if status != "dropped":
+            recent_scans.remember(user_id, barcode)
+        product["scan_logged"] = status != "dropped"
+        product["scan_status"] = status
+
+    return product
+
+
 def get_current_user(authorization: str | None = Header(None)):
-    print("RAW AUTH HEADER:", authorization)
+    # Nooit de header zelf loggen: die bevat het bearer token
+    logger.debug("Auth header present: %s", authorization is not None)
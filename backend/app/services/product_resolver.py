@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import time
+from dataclasses import replace
+from typing import Dict, List, Optional, Tuple
+
+from app.services import off_api_client, redis_cache
+from app.services.database_service import DATABASE_URL, get_database_service
+from app.services.gtin import is_valid_gtin, normalize_gtin
+from app.services.off_api_client import OffApiUnavailable
+from app.services.off_database import run_in_db_executor
+from app.services.single_flight import SingleFlight
+from app.services.product_service import (
+    ProductMatch,
+    cache_key,
+    fetch_local_matches,
+    memory_matches,
+    redis_matches,
+    remember_api_result,
+    stale_overlay_match,
+    remember_matches,
+)
+
+logger = logging.getLogger(__name__)
+
+# Eén async resolutiepad voor barcodes, met tiers in vaste volgorde:
+#   memory → redis → postgres (products) → sqlite (lokale OFF) → api (OpenFoodFacts)
+# Elke tier krijgt enkel de barcodes die de vorige tiers niet konden oplossen,
+# en werkt telkens op de hele batch tegelijk.
+
+TIERS = ("memory", "redis", "postgres", "sqlite", "api")
+
+_flights = SingleFlight("product_resolver")
+
+_tier_stats = {tier: {"calls": 0, "lookups": 0, "hits": 0, "total_ms": 0.0} for tier in TIERS}
+_tier_stats["api"]["invalid_gtin"] = 0   # niet gevraagd: checksum klopt niet
+
+
+def _record(tier: str, lookups: int, hits: int, started: float):
+    stats = _tier_stats[tier]
+    stats["calls"] += 1
+    stats["lookups"] += lookups
+    stats["hits"] += hits
+    stats["total_ms"] += (time.perf_counter() - started) * 1000
+
+
+def _postgres_row_to_match(row: dict) -> ProductMatch:
+    return ProductMatch(
+        barcode=row["barcode"],
+        product_name=row["product_name"],
+        brands=row["brand"],
+        energy_kcal_100g=row["energy_kcal"],
+        proteins_100g=row["proteins_g"],
+        carbohydrates_100g=row["carbohydrates_g"],
+        fat_100g=row["fat_g"],
+        sugars_100g=row["sugars_g"],
+        fiber_100g=row["fiber_g"],
+        salt_100g=row["salt_g"],
+        match_score=100.0,
+        image_url=row["image_url"],
+        product_id=str(row["product_id"]),
+    )
+
+
+async def _postgres_matches(barcodes: List[str]):
+    """
+    Postgres products by GTIN-14. Only rows with nutrition count as a hit: Colruyt
+    products without OpenFoodFacts match are stored with just a name. For the
+    other rows product_id and image_url are carried forward to the later tiers.
+    """
+    hits: Dict[str, ProductMatch] = {}
+    carried: Dict[str, dict] = {}
+    if not DATABASE_URL:
+        return hits, carried
+    gtins = {barcode: normalize_gtin(barcode) for barcode in barcodes}
+    try:
+        db = await get_database_service()
+        rows = await db.get_products_by_gtins([g for g in gtins.values() if g])
+    except Exception as e:
+        logger.warning("Product resolver: Postgres tier skipped: %s", e)
+        return hits, carried
+
+    by_gtin = {row["gtin14"]: row for row in rows}
+    for barcode, gtin in gtins.items():
+        row = by_gtin.get(gtin)
+        if row is None:
+            continue
+        if row["energy_kcal"] is not None:
+            hits[barcode] = _postgres_row_to_match(row)
+        else:
+            carried[barcode] = {"product_id": str(row["product_id"]), "image_url": row["image_url"]}
+    return hits, carried
+
+
+def _apply_carried(match: ProductMatch, carried: Optional[dict]) -> ProductMatch:
+    if not carried:
+        return match
+    return replace(
+        match,
+        product_id=match.product_id or carried["product_id"],
+        image_url=match.image_url or carried["image_url"],
+    )
+
+
+async def resolve_products(barcodes: List[str], use_api: bool = True) -> Dict[str, ProductMatch]:
+    """
+    Resolve many barcodes through the tiers, each tier in one batch call.
+    Concurrent requests for the same canonical barcode share one resolution.
+
+    Args:
+        barcodes: Product barcodes (EAN/GTIN), duplicates allowed
+        use_api: Whether the OpenFoodFacts API is the last tier
+
+    Returns:
+        Dict {input barcode: ProductMatch (incl. image_url, product_id if known)} for found barcodes
+    """
+    # Sleutel = canonieke barcode; use_api hoort erbij (zonder API kan het antwoord None zijn)
+    by_key: Dict[tuple, List[str]] = {}
+    for barcode in dict.fromkeys(b for b in barcodes if b):
+        by_key.setdefault((cache_key(barcode), use_api), []).append(barcode)
+
+    owned, waiting = _flights.claim(by_key)
+    resolved: Dict[tuple, Optional[ProductMatch]] = {}
+
+    async def resolve_owned():
+        found = await _resolve_tiers([by_key[key][0] for key in owned], use_api)
+        return {key: found.get(by_key[key][0]) for key in owned}
+
+    if owned:
+        resolved.update(await _flights.lead(owned, resolve_owned))
+    if waiting:
+        resolved.update(await _flights.wait(waiting))
+
+    # Iedere caller krijgt eigen kopieën (match_score e.d. mogen aangepast worden)
+    return {
+        barcode: replace(match)
+        for key, match in resolved.items() if match is not None
+        for barcode in by_key[key]
+    }
+
+
+async def _resolve_tiers(pending: List[str], use_api: bool) -> Dict[str, ProductMatch]:
+    results: Dict[str, ProductMatch] = {}
+
+    def take(found: Dict[str, Optional[ProductMatch]]):
+        # None = negatieve cache entry: bestaat nergens, verder zoeken is zinloos
+        for barcode, match in found.items():
+            if match is not None:
+                results[barcode] = match
+
+    started = time.perf_counter()
+    found, pending = memory_matches(pending)
+    take(found)
+    _record("memory", len(found) + len(pending), len(found), started)
+
+    if pending and redis_cache.available():
+        started = time.perf_counter()
+        found, pending = await asyncio.to_thread(redis_matches, pending)
+        take(found)
+        _record("redis", len(found) + len(pending), len(found), started)
+
+    carried: Dict[str, dict] = {}
+    if pending:
+        started = time.perf_counter()
+        hits, carried = await _postgres_matches(pending)
+        results.update(hits)
+        pending = [b for b in pending if b not in hits]
+        _record("postgres", len(hits) + len(pending), len(hits), started)
+        if hits:
+            await asyncio.to_thread(remember_matches, hits)
+
+    if pending:
+        started = time.perf_counter()
+        # openfoodfacts.db + overlay van eerdere API hits; None = API kende hem al niet
+        local = await run_in_db_executor(fetch_local_matches, pending, remember=False)
+        hits = {b: _apply_carried(m, carried.get(b)) for b, m in local.items() if m is not None}
+        results.update(hits)
+        pending = [b for b in pending if b not in local]
+        _record("sqlite", len(local) + len(pending), len(hits), started)
+        # Pas cachen met product_id/image_url uit Postgres erbij, anders verliezen herhaalde scans die
+        if local:
+            await asyncio.to_thread(remember_matches, {b: hits.get(b) for b in local})
+
+    if pending and use_api:
+        api = await asyncio.gather(*(resolve_via_api(b, carried.get(b)) for b in pending))
+        results.update({b: m for b, m in zip(pending, api) if m is not None})
+
+    return results
+
+
+async def resolve_product(barcode: str, use_api: bool = True) -> Optional[ProductMatch]:
+    """One barcode through all tiers; ProductMatch including image_url, or None."""
+    return (await resolve_products([barcode], use_api=use_api)).get(barcode)
+
+
+async def resolve_via_api(barcode: str, carried: Optional[dict] = None) -> Optional[ProductMatch]:
+    """
+    Only the OpenFoodFacts API tier (for barcodes the caller already resolved locally).
+    Codes with a wrong GS1 check digit (misreads, typos) can't be in OpenFoodFacts: no request.
+    """
+    if not is_valid_gtin(barcode):
+        _tier_stats["api"]["invalid_gtin"] += 1
+        return None
+    match, fresh = await _flights.do((cache_key(barcode), "api"), lambda: _fetch_via_api(barcode))
+    if match is None:
+        return None
+    if carried:
+        match = _apply_carried(replace(match), carried)
+        if fresh:
+            # remember_api_result cachete de match zonder de Postgres velden
+            await asyncio.to_thread(remember_matches, {barcode: match}, redis_cache.API_TTL)
+        return match
+    return replace(match)
+
+
+async def _fetch_via_api(barcode: str) -> Tuple[Optional[ProductMatch], bool]:
+    """(match, fresh): fresh is False for a stale overlay match served while the API is down."""
+    started = time.perf_counter()
+    try:
+        product = await off_api_client.fetch_product(barcode)
+    except OffApiUnavailable as e:
+        logger.warning("API error voor %s: %s", barcode, e)
+        _record("api", 1, 0, started)
+        return await asyncio.to_thread(stale_overlay_match, barcode), False
+    match = await asyncio.to_thread(remember_api_result, barcode, product)
+    _record("api", 1, int(match is not None), started)
+    return match, True
+
+
+def resolver_stats() -> Dict[str, dict]:
+    """Per tier: calls, barcodes looked up, hits, hit rate and average latency per call."""
+    return {
+        tier: {
+            **stats,
+            "total_ms": round(stats["total_ms"], 1),
+            "hit_rate": round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else None,
+            "avg_ms": round(stats["total_ms"] / stats["calls"], 2) if stats["calls"] else None,
+        }
+        for tier, stats in _tier_stats.items()
+    }
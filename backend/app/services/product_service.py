@@ -1,11 +1,15 @@
+import logging
 import sqlite3
-from pathlib import Path
-from typing import Optional, List
-from dataclasses import dataclass
-import requests
+from typing import Optional, List, Dict, Tuple
+from dataclasses import dataclass, asdict, replace
+from app.services import columnar_store, off_api_client, off_overlay, redis_cache
+from app.services.off_api_client import OffApiUnavailable
+from app.services.off_database import DB_PATH, current_generation, get_connection, has_column, has_table, version_tag
+from app.services.gtin import normalize_gtin
+from app.services.lookup_cache import LookupCache
+from app.services.text_normalization import tokenize
 
-# Database path
-DB_PATH = Path(__file__).parent.parent / "data" / "openfoodfacts.db"
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -23,13 +27,12 @@ class ProductMatch:
     salt_100g: Optional[float]
     match_score: Optional[float] = None
     image_url: Optional[str] = None
+    product_id: Optional[str] = None  # Postgres products.product_id, indien al bekend
 
 
 def get_db_connection():
-    """Create a database connection."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Return the pooled read-only connection of the current thread (do not close it)."""
+    return get_connection()
 
 
 def get_db_stats() -> dict:
@@ -39,7 +42,6 @@ def get_db_stats() -> dict:
         cursor = conn.cursor()
         cursor.execute("SELECT COUNT(*) FROM products")
         total = cursor.fetchone()[0]
-        conn.close()
         return {
             "status": "ok",
             "total_products": total,
@@ -52,10 +54,244 @@ def get_db_stats() -> dict:
         }
 
 
+PRODUCT_COLUMNS = """
+    barcode, product_name, brands,
+    energy_kcal_100g, proteins_100g, carbohydrates_100g,
+    fat_100g, sugars_100g, fiber_100g, salt_100g
+"""
+
+# SQLite limit op het aantal ? parameters per query (veilig onder de oude default van 999)
+BATCH_CHUNK_SIZE = 900
+
+# Opgeloste barcodes (lokaal of API) en negatieve entries voor barcodes die nergens bestaan.
+# Eerst het geheugen van deze worker, daarna Redis (gedeeld tussen workers).
+# Beide horen bij één versie van openfoodfacts.db: na een swap wordt het geheugen
+# leeggemaakt en krijgen de Redis keys een nieuwe prefix (oude entries verlopen vanzelf).
+# memory_matches, redis_matches, fetch_local_matches, remember_matches, remember_api_result
+# en stale_overlay_match zijn de tiers waarop product_resolver zijn resolutiepad bouwt.
+_match_cache = LookupCache("product_matches")
+_cache_generation: Optional[int] = None
+
+
+def cache_key(barcode: str) -> str:
+    return normalize_gtin(barcode) or barcode
+
+
+def _sync_generation():
+    global _cache_generation
+    generation = current_generation()
+    if generation != _cache_generation:
+        if _cache_generation is not None:
+            _match_cache.clear()
+            logger.info("openfoodfacts.db swapped: product match cache cleared")
+        _cache_generation = generation
+
+
+def _redis_key(key: str) -> str:
+    return f"{version_tag()}:{key}"
+
+
+_MISSING = object()
+
+
+def memory_matches(barcodes: List[str]) -> Tuple[Dict[str, Optional[ProductMatch]], List[str]]:
+    """
+    Look barcodes up in the in-process cache.
+    Returns ({barcode: ProductMatch copy, or None for "not found anywhere"}, uncached barcodes).
+    Callers get copies and may mutate them (e.g. match_score).
+    """
+    _sync_generation()
+    cached: Dict[str, Optional[ProductMatch]] = {}
+    missing = []
+    for barcode in barcodes:
+        found, match = _match_cache.get(cache_key(barcode))
+        if found:
+            cached[barcode] = replace(match) if match is not None else None
+        else:
+            missing.append(barcode)
+    return cached, missing
+
+
+def redis_matches(barcodes: List[str]) -> Tuple[Dict[str, Optional[ProductMatch]], List[str]]:
+    """Same as memory_matches but against Redis (one MGET); hits are copied into memory."""
+    cached: Dict[str, Optional[ProductMatch]] = {}
+    missing = []
+    keys = {barcode: cache_key(barcode) for barcode in barcodes}
+    remote = redis_cache.get_many(redis_cache.PRODUCTS, [_redis_key(key) for key in keys.values()])
+    for barcode, key in keys.items():
+        payload = remote.get(_redis_key(key), _MISSING)
+        if payload is _MISSING:
+            missing.append(barcode)
+            continue
+        match = ProductMatch(**payload) if payload is not None else None
+        _match_cache.put(key, match)
+        cached[barcode] = replace(match) if match is not None else None
+    return cached, missing
+
+
+def _cached_matches(barcodes: List[str]) -> Tuple[Dict[str, Optional[ProductMatch]], List[str]]:
+    """Memory, then Redis for all memory misses in one round trip."""
+    cached, missing = memory_matches(barcodes)
+    if missing:
+        remote, missing = redis_matches(missing)
+        cached.update(remote)
+    return cached, missing
+
+
+def fetch_local_matches(barcodes: List[str], remember: bool = True) -> Dict[str, Optional[ProductMatch]]:
+    """
+    Local lookup for uncached barcodes: openfoodfacts.db, then the overlay of earlier
+    OpenFoodFacts API results. Returns {barcode: ProductMatch, or None when the overlay
+    knows the API did not find it}; barcodes absent from the result need the API.
+    Everything found is cached, unless remember=False (the caller adds fields first).
+    """
+    store = columnar_store.get_store()
+    if store is not None:
+        # Memory-mapped kolommen: één searchsorted voor de hele batch, slot records, en
+        # de nutriënten van alle slots kolomgewijs in één keer gelezen
+        records = store.get_many(barcodes)
+        found: Dict[str, Optional[ProductMatch]] = {
+            barcode: _row_to_match(fields)
+            for barcode, fields in zip(records.keys(), store.fields(list(records.values())))
+        }
+        # Barcodes zonder GTIN zitten niet in de store
+        without_gtin = [b for b in barcodes if b not in found and not normalize_gtin(b)]
+        if without_gtin:
+            found.update((b, _row_to_match(row)) for b, row in _fetch_local_rows(without_gtin).items())
+    else:
+        found = {barcode: _row_to_match(row) for barcode, row in _fetch_local_rows(barcodes).items()}
+    missing = [b for b in barcodes if b not in found]
+    if missing:
+        try:
+            for barcode, row in off_overlay.lookup(missing).items():
+                found[barcode] = _overlay_row_to_match(row) if row is not None else None
+        except sqlite3.Error as e:
+            logger.warning("OFF overlay lookup failed: %s", e)
+    if remember:
+        remember_matches(found)
+    return {barcode: replace(match) if match else None for barcode, match in found.items()}
+
+
+def _overlay_row_to_match(row) -> ProductMatch:
+    return replace(_row_to_match(row), image_url=row["image_url"])
+
+
+def stale_overlay_match(barcode: str) -> Optional[ProductMatch]:
+    """Expired overlay entry, served when the API cannot be reached for a refresh."""
+    try:
+        row = off_overlay.lookup_stale(barcode)
+    except sqlite3.Error:
+        return None
+    return _overlay_row_to_match(row) if row else None
+
+
+def remember_matches(matches: Dict[str, Optional[ProductMatch]], ttl: int = redis_cache.PRODUCT_TTL):
+    """Store resolved barcodes (None = not found anywhere) in memory and Redis."""
+    _sync_generation()
+    payloads = {}
+    for barcode, match in matches.items():
+        key = cache_key(barcode)
+        _match_cache.put(key, match)
+        payloads[_redis_key(key)] = asdict(match) if match is not None else None
+    redis_cache.set_many(redis_cache.PRODUCTS, payloads, ttl)
+
+
+def _barcode_variations(barcode: str) -> List[str]:
+    """Barcode variations to try: original, without leading zeros, UPC-A (12) → EAN-13."""
+    barcode_variations = [barcode]
+
+    # Try without leading zeros
+    stripped = barcode.lstrip('0')
+    if stripped != barcode:
+        barcode_variations.append(stripped)
+
+    # Try with leading zero if it's 12 digits (UPC-A to EAN-13)
+    if len(barcode) == 12:
+        barcode_variations.append('0' + barcode)
+
+    # Try stripped version with leading zero
+    if len(stripped) == 12 and stripped != barcode:
+        barcode_variations.append('0' + stripped)
+
+    return barcode_variations
+
+
+def _row_to_match(row, match_score: Optional[float] = 100.0) -> ProductMatch:
+    return ProductMatch(
+        barcode=row["barcode"],
+        product_name=row["product_name"],
+        brands=row["brands"],
+        energy_kcal_100g=row["energy_kcal_100g"],
+        proteins_100g=row["proteins_100g"],
+        carbohydrates_100g=row["carbohydrates_100g"],
+        fat_100g=row["fat_100g"],
+        sugars_100g=row["sugars_100g"],
+        fiber_100g=row["fiber_100g"],
+        salt_100g=row["salt_100g"],
+        match_score=match_score
+    )
+
+
+def _fetch_rows_by_gtin(conn, barcodes: List[str]) -> Dict[str, object]:
+    """One equality probe per canonical GTIN-14 on the indexed gtin14 column."""
+    gtin_by_barcode = {b: normalize_gtin(b) for b in barcodes}
+    keys = list(dict.fromkeys(g for g in gtin_by_barcode.values() if g))
+
+    rows_by_gtin = {}
+    for i in range(0, len(keys), BATCH_CHUNK_SIZE):
+        chunk = keys[i:i + BATCH_CHUNK_SIZE]
+        placeholders = ','.join(['?' for _ in chunk])
+        for row in conn.execute(f"""
+            SELECT {PRODUCT_COLUMNS}, gtin14
+            FROM products
+            WHERE gtin14 IN ({placeholders})
+        """, chunk):
+            rows_by_gtin.setdefault(row["gtin14"], row)
+
+    return {b: rows_by_gtin[g] for b, g in gtin_by_barcode.items() if g in rows_by_gtin}
+
+
+def _fetch_rows_by_variations(conn, barcodes: List[str]) -> Dict[str, object]:
+    """Fallback for databases without gtin14 column: IN (...) over all barcode variations."""
+    variations_by_barcode = {b: _barcode_variations(b) for b in barcodes}
+    all_variations = list(dict.fromkeys(
+        v for variations in variations_by_barcode.values() for v in variations
+    ))
+
+    rows_by_barcode = {}
+    for i in range(0, len(all_variations), BATCH_CHUNK_SIZE):
+        chunk = all_variations[i:i + BATCH_CHUNK_SIZE]
+        placeholders = ','.join(['?' for _ in chunk])
+        for row in conn.execute(f"""
+            SELECT {PRODUCT_COLUMNS}
+            FROM products
+            WHERE barcode IN ({placeholders})
+        """, chunk):
+            rows_by_barcode[row["barcode"]] = row
+
+    # Map back to the input barcodes, preferring the variation order of the single lookup
+    rows = {}
+    for barcode, variations in variations_by_barcode.items():
+        for variation in variations:
+            row = rows_by_barcode.get(variation)
+            if row is not None:
+                rows[barcode] = row
+                break
+    return rows
+
+
+def _fetch_local_rows(barcodes: List[str]) -> Dict[str, object]:
+    conn = get_db_connection()
+    if has_column("products", "gtin14"):
+        return _fetch_rows_by_gtin(conn, barcodes)
+    return _fetch_rows_by_variations(conn, barcodes)
+
+
 def find_product_by_barcode(barcode: str) -> Optional[ProductMatch]:
     """
     Find a product by its barcode in the OpenFoodFacts database.
-    Tries multiple barcode variations (with/without leading zeros).
+    Uses the canonical GTIN-14 key (with/without leading zeros, UPC-A/EAN-13
+    all map to the same key); older databases fall back to barcode variations.
 
     Args:
         barcode: The product barcode (EAN/GTIN)
@@ -63,106 +299,158 @@ def find_product_by_barcode(barcode: str) -> Optional[ProductMatch]:
     Returns:
         ProductMatch if found, None otherwise
     """
+    cached, _ = _cached_matches([barcode])
+    if barcode in cached:
+        return cached[barcode]
+
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        local = fetch_local_matches([barcode])
+        if barcode in local:
+            return local[barcode]  # Exact barcode match (of overlay: API vond hem niet)
+
+        # Not found locally → try OpenFoodFacts API as fallback (cache al gecontroleerd)
+        return _fetch_product_api(barcode)
 
-        # Generate barcode variations to try
-        barcode_variations = [barcode]
+    except Exception as e:
+        logger.error("Error finding product by barcode: %s", e)
+        return None
 
-        # Try without leading zeros
-        stripped = barcode.lstrip('0')
-        if stripped != barcode:
-            barcode_variations.append(stripped)
 
-        # Try with leading zero if it's 12 digits (UPC-A to EAN-13)
-        if len(barcode) == 12:
-            barcode_variations.append('0' + barcode)
+def find_products_by_barcodes(barcodes: List[str]) -> Dict[str, ProductMatch]:
+    """
+    Resolve many barcodes at once against the local OpenFoodFacts database
+    with a few chunked set-based queries instead of one query per barcode.
+    Only the local database is used (no API fallback).
 
-        # Try stripped version with leading zero
-        if len(stripped) == 12:
-            barcode_variations.append('0' + stripped)
+    Args:
+        barcodes: Product barcodes (EAN/GTIN), duplicates allowed
 
-        # Search for any of the variations
-        placeholders = ','.join(['?' for _ in barcode_variations])
-        cursor.execute(f"""
-            SELECT barcode, product_name, brands,
-                   energy_kcal_100g, proteins_100g, carbohydrates_100g,
-                   fat_100g, sugars_100g, fiber_100g, salt_100g
-            FROM products
-            WHERE barcode IN ({placeholders})
-        """, barcode_variations)
-
-        row = cursor.fetchone()
-        conn.close()
-
-        if row:
-            return ProductMatch(
-                barcode=row["barcode"],
-                product_name=row["product_name"],
-                brands=row["brands"],
-                energy_kcal_100g=row["energy_kcal_100g"],
-                proteins_100g=row["proteins_100g"],
-                carbohydrates_100g=row["carbohydrates_100g"],
-                fat_100g=row["fat_100g"],
-                sugars_100g=row["sugars_100g"],
-                fiber_100g=row["fiber_100g"],
-                salt_100g=row["salt_100g"],
-                match_score=100.0  # Exact barcode match
-            )
-
-        # Not found locally → try OpenFoodFacts API as fallback
-        return find_product_by_barcode_api(barcode)
+    Returns:
+        Dict {input barcode: ProductMatch} for every barcode that was found
+    """
+    unique_barcodes = list(dict.fromkeys(b for b in barcodes if b))
+    if not unique_barcodes:
+        return {}
+
+    try:
+        cached, missing = _cached_matches(unique_barcodes)
+        # None in de cache: negatieve entry, bestaat nergens
+        results = {barcode: match for barcode, match in cached.items() if match is not None}
+        if not missing:
+            return results
+
+        results.update((b, m) for b, m in fetch_local_matches(missing).items() if m is not None)
+        return results
 
     except Exception as e:
-        print(f"Error finding product by barcode: {e}")
-        return None
+        logger.error("Error finding products by barcodes: %s", e)
+        return {}
+
 
 def find_product_by_barcode_api(barcode: str) -> Optional[ProductMatch]:
     """
     Fallback: zoek product via de OpenFoodFacts API als het niet in de lokale DB zit.
+    "Niet gevonden" wordt negatief gecachet; netwerkfouten niet.
     """
-    url = f"https://world.openfoodfacts.org/api/v2/product/{barcode}.json"
+    cached, _ = _cached_matches([barcode])
+    if barcode in cached:
+        return cached[barcode]
+    return _fetch_product_api(barcode)
 
-    try:
-        print(f"  API lookup voor barcode {barcode}...")
-        response = requests.get(url, headers={"User-Agent": "MealPrepApp/1.0"}, timeout=5)
-        data = response.json()
-
-        if data.get("status") == 1:
-            product = data["product"]
-            nutriments = product.get("nutriments", {})
-
-            print(f"  API match gevonden: {product.get('product_name', 'Onbekend')}")
-
-            # Kies beste afbeelding: front_url > image_url > None
-            img = product.get("image_front_url") or product.get("image_url")
-
-            return ProductMatch(
-                barcode=barcode,
-                product_name=product.get("product_name"),
-                brands=product.get("brands"),
-                energy_kcal_100g=nutriments.get("energy-kcal_100g"),
-                proteins_100g=nutriments.get("proteins_100g"),
-                carbohydrates_100g=nutriments.get("carbohydrates_100g"),
-                fat_100g=nutriments.get("fat_100g"),
-                sugars_100g=nutriments.get("sugars_100g"),
-                fiber_100g=nutriments.get("fiber_100g"),
-                salt_100g=nutriments.get("salt_100g"),
-                match_score=100.0,
-                image_url=img,
-            )
-        else:
-            print(f"  API: barcode {barcode} niet gevonden.")
-            return None
 
-    except Exception as e:
-        print(f"  API error voor {barcode}: {e}")
+def _fetch_product_api(barcode: str) -> Optional[ProductMatch]:
+    try:
+        logger.debug("API lookup voor barcode %s", barcode, extra={"sample": "api_lookup"})
+        product = off_api_client.fetch_product_sync(barcode)
+    except OffApiUnavailable as e:
+        # Niet negatief cachen: OFF kon niet antwoorden
+        logger.warning("API error voor %s: %s", barcode, e)
+        return stale_overlay_match(barcode)
+    return remember_api_result(barcode, product)
+
+
+def remember_api_result(barcode: str, product: Optional[dict]) -> Optional[ProductMatch]:
+    """Convert an OFF API product to a ProductMatch and cache it ("not found" negatively)."""
+    if product is None:
+        logger.debug("API: barcode %s niet gevonden", barcode, extra={"sample": "api_not_found"})
+        remember_matches({barcode: None})
+        _save_to_overlay(barcode, None)
         return None
 
+    nutriments = product.get("nutriments", {})
+    logger.debug("API match gevonden: %s", product.get('product_name', 'Onbekend'), extra={"sample": "api_found"})
+
+    # Kies beste afbeelding: front_url > image_url > None
+    img = product.get("image_front_url") or product.get("image_url")
+
+    match = ProductMatch(
+        barcode=barcode,
+        product_name=product.get("product_name"),
+        brands=product.get("brands"),
+        energy_kcal_100g=nutriments.get("energy-kcal_100g"),
+        proteins_100g=nutriments.get("proteins_100g"),
+        carbohydrates_100g=nutriments.get("carbohydrates_100g"),
+        fat_100g=nutriments.get("fat_100g"),
+        sugars_100g=nutriments.get("sugars_100g"),
+        fiber_100g=nutriments.get("fiber_100g"),
+        salt_100g=nutriments.get("salt_100g"),
+        match_score=100.0,
+        image_url=img,
+    )
+    remember_matches({barcode: match}, ttl=redis_cache.API_TTL)
+    _save_to_overlay(barcode, match)
+    return replace(match)
+
+
+def _save_to_overlay(barcode: str, match: Optional[ProductMatch]):
+    """Write-back: the next lookup of this barcode is local (see off_overlay)."""
+    try:
+        off_overlay.save(barcode, asdict(match) if match else None)
+    except sqlite3.Error as e:
+        logger.warning("OFF overlay write failed for %s: %s", barcode, e)
+
+
+def _token_similarity(query_tokens: List[str], row) -> float:
+    """Dice coefficient (0-100) between the query tokens and the product name + brand tokens."""
+    query = set(query_tokens)
+    candidate = set(tokenize(row["product_name"])) | set(tokenize(row["brands"]))
+    if not query or not candidate:
+        return 0.0
+    return round(200.0 * len(query & candidate) / (len(query) + len(candidate)), 1)
+
+
+def _search_fts(conn, query_tokens: List[str], limit: int):
+    """
+    Ranked bm25 candidates from products_fts (name weighs more than brands).
+    First all tokens (AND, small posting list intersection), then any token (OR).
+    """
+    quoted = [f'"{token}"' for token in query_tokens]
+    rows = _query_fts(conn, " AND ".join(quoted), limit)
+    if not rows and len(quoted) > 1:
+        rows = _query_fts(conn, " OR ".join(quoted), limit)
+    return rows
+
+
+def _query_fts(conn, match_expr: str, limit: int):
+    return conn.execute("""
+        SELECT p.barcode, p.product_name, p.brands,
+               p.energy_kcal_100g, p.proteins_100g, p.carbohydrates_100g,
+               p.fat_100g, p.sugars_100g, p.fiber_100g, p.salt_100g,
+               bm25(products_fts, 1.0, 0.5) AS rank
+        FROM products_fts
+        JOIN products p ON p.rowid = products_fts.rowid
+        WHERE products_fts MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    """, (match_expr, limit)).fetchall()
+
+
 def find_product_by_name(name: str, limit: int = 5, min_score: float = 70.0) -> List[ProductMatch]:
     """
-    Find products by name using fuzzy matching.
+    Find products by name via the FTS5 index (products_fts, see
+    app/scripts/build_fts_index.py): bm25 ranks the candidates, match_score is
+    the token similarity between the search name and the product name + brand.
+    Without the index a LIKE search is used.
 
     Args:
         name: The product name to search for
@@ -174,44 +462,31 @@ def find_product_by_name(name: str, limit: int = 5, min_score: float = 70.0) ->
     """
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Simple LIKE search for now - can be improved with FTS5 or external fuzzy library
-        search_term = f"%{name}%"
-        cursor.execute("""
-            SELECT barcode, product_name, brands,
-                   energy_kcal_100g, proteins_100g, carbohydrates_100g,
-                   fat_100g, sugars_100g, fiber_100g, salt_100g
-            FROM products
-            WHERE product_name LIKE ?
-            LIMIT ?
-        """, (search_term, limit))
+        query_tokens = tokenize(name)
+        if not query_tokens:
+            return []
 
-        rows = cursor.fetchall()
-        conn.close()
+        if has_table("products_fts"):
+            # Ruimere kandidatenset dan limit zodat de herscoring de beste overhoudt
+            rows = _search_fts(conn, query_tokens, max(limit * 10, 50))
+        else:
+            search_term = f"%{name}%"
+            rows = conn.execute(f"""
+                SELECT {PRODUCT_COLUMNS}
+                FROM products
+                WHERE product_name LIKE ?
+                LIMIT ?
+            """, (search_term, limit)).fetchall()
 
         results = []
         for row in rows:
-            # Simple score based on name similarity (placeholder)
-            score = 75.0 if name.lower() in (row["product_name"] or "").lower() else 50.0
-
+            score = _token_similarity(query_tokens, row)
             if score >= min_score:
-                results.append(ProductMatch(
-                    barcode=row["barcode"],
-                    product_name=row["product_name"],
-                    brands=row["brands"],
-                    energy_kcal_100g=row["energy_kcal_100g"],
-                    proteins_100g=row["proteins_100g"],
-                    carbohydrates_100g=row["carbohydrates_100g"],
-                    fat_100g=row["fat_100g"],
-                    sugars_100g=row["sugars_100g"],
-                    fiber_100g=row["fiber_100g"],
-                    salt_100g=row["salt_100g"],
-                    match_score=score
-                ))
-
-        return sorted(results, key=lambda x: x.match_score or 0, reverse=True)
+                results.append(_row_to_match(row, match_score=score))
+
+        # sorted() is stabiel: bij gelijke score blijft de bm25 volgorde behouden
+        return sorted(results, key=lambda x: x.match_score or 0, reverse=True)[:limit]
 
     except Exception as e:
-        print(f"Error finding product by name: {e}")
+        logger.error("Error finding product by name: %s", e)
         return []
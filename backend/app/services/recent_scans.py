@@ -0,0 +1,141 @@
+import asyncio
+import os
+import time
+from typing import Iterable, Optional, Tuple
+
+from app.services import redis_cache
+from app.services.gtin import normalize_gtin
+from app.services.lookup_cache import LookupCache
+
+# Duplicate scan detectie zonder scanned_items query: de laatste scan per
+# (user_id, canonieke barcode) staat met een TTL in Redis (gedeeld over workers)
+# en in een in-process cache.
+#
+# Een hit (recente scan) is altijd sluitend. Een miss enkel als Redis aantoonbaar
+# elke gelogde scan van het venster heeft: _since is het begin van de periode waarin
+# dat zo is. Die key leeft langer dan elk venster (elke publish verlengt hem) en wordt
+# enkel op "nu" gezet door een worker die een gat kent (scan gespild of gelogd terwijl
+# Redis onbereikbaar was) of Redis keys ziet evicten; tot het venster daarna verstreken
+# is beslist de tabel. Scan keys leven iets langer dan het langste venster.
+# De lokale LRU (evict, kent enkel de scans van deze worker) geeft nooit "nee".
+
+TTL_SECONDS = int(os.getenv("RECENT_SCANS_TTL_SECONDS", str(24 * 3600)))   # langste venster dat de cache beantwoordt
+KEY_TTL_SECONDS = TTL_SECONDS + 3600         # scan keys: marge boven het venster (klokverschil, flush vertraging)
+SINCE_TTL_SECONDS = 2 * KEY_TTL_SECONDS      # _since: verlengd bij elke publish, verloopt enkel zonder scans
+MAX_ENTRIES = int(os.getenv("RECENT_SCANS_MAX_ENTRIES", "50000"))
+EVICTION_CHECK_SECONDS = float(os.getenv("RECENT_SCANS_EVICTION_CHECK_SECONDS", "30"))
+
+_SINCE_KEY = "_since"   # sinds wanneer Redis alle scans bijhoudt
+
+_local = LookupCache("recent_scans", max_entries=MAX_ENTRIES, ttl=TTL_SECONDS)
+_gap = False                            # gelogde scans van deze worker die niet in Redis staan
+_evicted_keys: Optional[int] = None     # laatst geziene Redis evicted_keys teller
+_eviction_checked_at = 0.0
+_stats = {"duplicates": 0, "not_duplicates": 0, "unknown": 0, "epochs": 0}
+
+
+def _key(user_id: str, barcode: str) -> str:
+    return f"{user_id}:{normalize_gtin(barcode) or barcode}"
+
+
+def remember(user_id: str, barcode: str, scanned_at: Optional[float] = None):
+    """Record a logged scan in this worker (unix timestamp, default now)."""
+    _local.put(_key(user_id, barcode), scanned_at if scanned_at is not None else time.time())
+
+
+def mark_incomplete():
+    """Scans were logged (or will be, e.g. spilled) without reaching Redis: no "certainly not" answers for now."""
+    global _gap
+    _gap = True
+
+
+def _start_epoch():
+    """Redis may miss scans from before now: "not a duplicate" only for windows starting later."""
+    _stats["epochs"] += 1
+    redis_cache.set_many(redis_cache.SCANS, {_SINCE_KEY: time.time()}, SINCE_TTL_SECONDS)
+
+
+def _evictions_seen() -> bool:
+    """Whether Redis evicted keys since the last check (then scan keys may be missing)."""
+    global _evicted_keys, _eviction_checked_at
+    now = time.monotonic()
+    if now - _eviction_checked_at < EVICTION_CHECK_SECONDS and _evicted_keys is not None:
+        return False
+    evicted = redis_cache.evicted_keys()
+    _eviction_checked_at = now
+    if evicted is None:
+        return True
+    # Eerste meting: eerdere evictions kunnen na _since gevallen zijn
+    seen = evicted > (_evicted_keys if _evicted_keys is not None else 0)
+    _evicted_keys = evicted
+    return seen
+
+
+def publish(scans: Iterable[Tuple[str, str, float]]):
+    """Share logged scans (user_id, barcode, timestamp) with the other workers in one pipeline."""
+    global _gap
+    if not redis_cache.available():
+        mark_incomplete()
+        return
+    values = {}
+    for user_id, barcode, scanned_at in scans:
+        key = _key(user_id, barcode)
+        values[key] = max(scanned_at, values.get(key, 0))
+    if _gap:
+        _gap = False
+        _start_epoch()
+    redis_cache.set_many(redis_cache.SCANS, values, KEY_TTL_SECONDS)
+    # _since blijft leven zolang er gescand wordt (bestaat hij niet, dan zet _check_redis hem)
+    redis_cache.expire(redis_cache.SCANS, _SINCE_KEY, SINCE_TTL_SECONDS)
+    if not redis_cache.available():
+        # Schrijven mislukt: deze scans (en een eventuele nieuwe _since) staan er niet
+        _gap = True
+
+
+def _check_redis(key: str, threshold: float) -> Optional[bool]:
+    global _gap
+    values = redis_cache.get_many(redis_cache.SCANS, [key, _SINCE_KEY])
+    scanned_at = values.get(key)
+    if scanned_at is not None and scanned_at >= threshold:
+        _local.put(key, scanned_at)
+        return True
+    if not redis_cache.available():
+        return None
+    if _gap or _evictions_seen():
+        # Redis mist mogelijk scans: nieuw begin, tot dan beslist de tabel
+        _gap = False
+        _start_epoch()
+        if not redis_cache.available():
+            _gap = True
+        return None
+    since = values.get(_SINCE_KEY)
+    if since is None:
+        # Eerste gebruik, verlopen of Redis leeggemaakt: vanaf nu worden scans bijgehouden
+        redis_cache.set_if_absent(redis_cache.SCANS, _SINCE_KEY, time.time(), SINCE_TTL_SECONDS)
+        return None
+    return False if since <= threshold else None
+
+
+async def is_recent(user_id: str, barcode: str, window_minutes: int) -> Optional[bool]:
+    """
+    True if the user scanned the barcode within window_minutes, False if certainly not
+    (only from Redis, see above), None when the store can't tell: no Redis, cold start,
+    a possible gap, or a window longer than the TTL.
+    """
+    window = window_minutes * 60
+    result = None
+    if window <= TTL_SECONDS:
+        key = _key(user_id, barcode)
+        threshold = time.time() - window
+        found, scanned_at = _local.get(key)
+        if found and scanned_at is not None and scanned_at >= threshold:
+            result = True
+        elif redis_cache.available():
+            result = await asyncio.to_thread(_check_redis, key, threshold)
+
+    _stats["unknown" if result is None else "duplicates" if result else "not_duplicates"] += 1
+    return result
+
+
+def stats() -> dict:
+    return dict(_stats)
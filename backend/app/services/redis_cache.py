@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# Gedeelde product cache in Redis (REDIS_URL), zodat alle uvicorn workers dezelfde
+# warme lookups zien. Elke fout degradeert naar "cache miss": Redis is nooit verplicht.
+
+REDIS_URL = os.getenv("REDIS_URL")
+KEY_PREFIX = os.getenv("REDIS_KEY_PREFIX", "mp:")
+SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.25"))     # seconden
+RETRY_AFTER_SECONDS = float(os.getenv("REDIS_RETRY_SECONDS", "30"))   # pauze na een fout
+
+# TTL per soort payload (seconden)
+PRODUCT_TTL = int(os.getenv("REDIS_PRODUCT_TTL", str(24 * 3600)))
+API_TTL = int(os.getenv("REDIS_API_TTL", str(7 * 24 * 3600)))        # OFF API resultaten zijn duur
+NEGATIVE_TTL = int(os.getenv("REDIS_NEGATIVE_TTL", str(30 * 60)))
+
+# Namespaces
+PRODUCTS = "product"    # ProductMatch velden (incl. image_url) per GTIN-14
+SCANS = "scan"          # laatste scan timestamp per user_id:GTIN-14 (duplicate detectie)
+VERSIONS = "version"    # versie tokens van lijsten/promoties/favorieten (ETags)
+RATES = "rate"          # tellers per tijdsvenster (gedeelde rate limits)
+
+_client: Optional[redis.Redis] = None
+_client_lock = threading.Lock()
+_down_until = 0.0
+_stats = {"hits": 0, "misses": 0, "writes": 0, "errors": 0}
+
+
+def _get_client() -> Optional[redis.Redis]:
+    global _client
+    if not REDIS_URL or time.monotonic() < _down_until:
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = redis.Redis.from_url(
+                    REDIS_URL,
+                    socket_timeout=SOCKET_TIMEOUT,
+                    socket_connect_timeout=SOCKET_TIMEOUT,
+                    health_check_interval=30,
+                )
+    return _client
+
+
+def available() -> bool:
+    """Whether Redis is configured and not in its post-failure pause."""
+    return bool(REDIS_URL) and time.monotonic() >= _down_until
+
+
+def _mark_down(e: Exception):
+    global _down_until
+    _stats["errors"] += 1
+    if time.monotonic() >= _down_until:
+        logger.warning("Redis not available, continuing without shared cache for %.0fs: %s", RETRY_AFTER_SECONDS, e)
+    _down_until = time.monotonic() + RETRY_AFTER_SECONDS
+
+
+def _key(namespace: str, key: str) -> str:
+    return f"{KEY_PREFIX}{namespace}:{key}"
+
+
+def _dumps(value) -> bytes:
+    # Compact: geen spaties, None blijft "null" (= negatieve entry)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def get_many(namespace: str, keys: Iterable[str]) -> Dict[str, object]:
+    """
+    Fetch many keys in one MGET round trip.
+    Returns {key: value} for the keys that are cached; value None is a negative entry.
+    """
+    keys = list(dict.fromkeys(k for k in keys if k))
+    client = _get_client()
+    if not keys or client is None:
+        return {}
+    try:
+        raw = client.mget([_key(namespace, k) for k in keys])
+    except redis.RedisError as e:
+        _mark_down(e)
+        return {}
+
+    found = {}
+    for key, value in zip(keys, raw):
+        if value is not None:
+            found[key] = json.loads(value)
+    _stats["hits"] += len(found)
+    _stats["misses"] += len(keys) - len(found)
+    return found
+
+
+def get(namespace: str, key: str):
+    """
+    Plain GET, not counted in hits/misses (those size the product cache); None when the key
+    doesn't exist or Redis isn't available.
+    """
+    client = _get_client()
+    if client is None:
+        return None
+    try:
+        raw = client.get(_key(namespace, key))
+    except redis.RedisError as e:
+        _mark_down(e)
+        return None
+    return json.loads(raw) if raw is not None else None
+
+
+def set_many(namespace: str, values: Dict[str, object], ttl: int = PRODUCT_TTL):
+    """Write many keys in one pipelined round trip; None values get NEGATIVE_TTL."""
+    client = _get_client()
+    if not values or client is None:
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        for key, value in values.items():
+            pipe.set(_key(namespace, key), _dumps(value), ex=NEGATIVE_TTL if value is None else ttl)
+        pipe.execute()
+        _stats["writes"] += len(values)
+    except redis.RedisError as e:
+        _mark_down(e)
+
+
+def set_if_absent(namespace: str, key: str, value, ttl: Optional[int] = None) -> bool:
+    """SET NX: write the key only when it doesn't exist yet; True if it was written."""
+    client = _get_client()
+    if client is None:
+        return False
+    try:
+        written = client.set(_key(namespace, key), _dumps(value), ex=ttl, nx=True)
+        _stats["writes"] += 1 if written else 0
+        return bool(written)
+    except redis.RedisError as e:
+        _mark_down(e)
+        return False
+
+
+def expire(namespace: str, key: str, ttl: int) -> bool:
+    """Reset the TTL of an existing key (value unchanged); False when it doesn't exist or Redis is down."""
+    client = _get_client()
+    if client is None:
+        return False
+    try:
+        return bool(client.expire(_key(namespace, key), ttl))
+    except redis.RedisError as e:
+        _mark_down(e)
+        return False
+
+
+def incr(namespace: str, key: str, ttl: int) -> Optional[int]:
+    """INCR a shared counter (expires after ttl); None when Redis isn't available."""
+    client = _get_client()
+    if client is None:
+        return None
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.incr(_key(namespace, key))
+        pipe.expire(_key(namespace, key), ttl)
+        count, _ = pipe.execute()
+        return int(count)
+    except redis.RedisError as e:
+        _mark_down(e)
+        return None
+
+
+def evicted_keys() -> Optional[int]:
+    """Redis' evicted_keys counter (keys dropped under maxmemory); None when unknown."""
+    client = _get_client()
+    if client is None:
+        return None
+    try:
+        return int(client.info("stats").get("evicted_keys", 0))
+    except redis.ResponseError:
+        return None   # INFO niet toegelaten (managed Redis): onbekend, Redis zelf werkt wel
+    except redis.RedisError as e:
+        _mark_down(e)
+        return None
+
+
+def stats() -> dict:
+    return {
+        "configured": bool(REDIS_URL),
+        "available": available(),
+        **_stats,
+    }
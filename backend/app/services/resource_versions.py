@@ -0,0 +1,87 @@
+import asyncio
+import os
+import uuid
+from typing import Iterable, Optional
+
+from app.services import redis_cache
+
+# Versie stamps voor conditional GETs (ETag / If-None-Match) zonder database:
+#   list:<list_id>          items van een lijst, gebumpt bij elke item write
+#   promotions:<store_name> actieve promoties per winkel, gebumpt door de ingestion
+#   promotions:*            alle winkels samen
+#   favorites:<user_id>     favorieten van een gebruiker
+#
+# Een versie is een willekeurig token in Redis (gedeeld over workers). Zonder Redis
+# is er geen versie: de endpoints antwoorden dan gewoon volledig, nooit 304 op een
+# versie die een andere worker niet kent. De TTL begrenst hoe lang een gemiste bump
+# (Redis fout net na een write) kan doorwerken.
+
+VERSION_TTL = int(os.getenv("RESOURCE_VERSION_TTL_SECONDS", str(24 * 3600)))
+
+LIST = "list"
+PROMOTIONS = "promotions"
+FAVORITES = "favorites"
+ALL_STORES = "*"
+
+_stats = {"not_modified": 0, "full": 0, "bumps": 0}
+
+
+def _key(kind: str, key: str) -> str:
+    return f"{kind}:{key}"
+
+
+def _new_token() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def _current(key: str) -> Optional[str]:
+    version = redis_cache.get(redis_cache.VERSIONS, key)
+    if version is None and redis_cache.available():
+        # Nog geen versie (nieuw of verlopen): er een maken; wint een andere worker, diens token
+        token = _new_token()
+        if redis_cache.set_if_absent(redis_cache.VERSIONS, key, token, VERSION_TTL):
+            return token
+        version = redis_cache.get(redis_cache.VERSIONS, key)
+    return version
+
+
+async def etag(kind: str, key: str) -> Optional[str]:
+    """ETag for the resource's current version; None when versions aren't available (no Redis)."""
+    if not redis_cache.available():
+        return None
+    version = await asyncio.to_thread(_current, _key(kind, key))
+    return f'"{kind[0]}-{version}"' if version else None
+
+
+async def bump(kind: str, keys: Iterable[str]):
+    """New version for these resources (call after the write has committed)."""
+    if not redis_cache.available():
+        return
+    values = {_key(kind, str(key)): _new_token() for key in keys}
+    if values:
+        await asyncio.to_thread(redis_cache.set_many, redis_cache.VERSIONS, values, VERSION_TTL)
+        _stats["bumps"] += len(values)
+
+
+def headers(current: Optional[str]) -> dict:
+    """Response headers for a versioned resource: clients revalidate with If-None-Match."""
+    return {"ETag": current, "Cache-Control": "no-cache"} if current else {}
+
+
+def not_modified(if_none_match: Optional[str], current: Optional[str]) -> bool:
+    """Whether an If-None-Match header matches the current ETag (weak comparison)."""
+    if not if_none_match or not current:
+        if current:
+            _stats["full"] += 1
+        return False
+    if if_none_match.strip() == "*":
+        matched = True
+    else:
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        matched = current in candidates
+    _stats["not_modified" if matched else "full"] += 1
+    return matched
+
+
+def stats() -> dict:
+    return dict(_stats)
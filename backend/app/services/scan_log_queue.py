@@ -0,0 +1,319 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+
+from app.services import recent_scans, redis_cache
+from app.services.database_service import DATABASE_URL, get_database_service
+
+logger = logging.getLogger(__name__)
+
+# Write-behind scan logging: de request enqueuet een event (O(1)), een achtergrond
+# flusher schrijft ze per batch weg met één multi-row insert in scanned_items.
+# Optioneel worden events die niet weggeschreven raken naar een lokaal JSONL bestand
+# gespild en bij de volgende start opnieuw aangeboden. Een replay werkt op een hernoemde
+# kopie (.replay-*) onder een flock: blijft die achter na een crash, dan neemt de
+# volgende start hem over; bij een shutdown gaat de rest terug naar het spill bestand.
+
+BATCH_SIZE = int(os.getenv("SCAN_LOG_BATCH_SIZE", "200"))            # flush na M events...
+FLUSH_INTERVAL_MS = int(os.getenv("SCAN_LOG_FLUSH_MS", "500"))        # ...of na N ms
+MAX_PENDING = int(os.getenv("SCAN_LOG_MAX_PENDING", "10000"))         # begrensd geheugen
+SPILL_PATH = os.getenv("SCAN_LOG_SPILL_PATH")                         # leeg = geen spill
+SHUTDOWN_TIMEOUT = float(os.getenv("SCAN_LOG_SHUTDOWN_TIMEOUT", "10"))
+
+
+@dataclass
+class ScanEvent:
+    user_id: str
+    barcode: str
+    scan_mode: str = "barcode"
+    product_id: Optional[str] = None
+    scanned_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+    def to_json(self) -> str:
+        return json.dumps({**asdict(self), "scanned_at": self.scanned_at.isoformat()})
+
+    @classmethod
+    def from_json(cls, line: str) -> "ScanEvent":
+        data = json.loads(line)
+        data["scanned_at"] = datetime.fromisoformat(data["scanned_at"])
+        return cls(**data)
+
+
+_pending: deque = deque()                     # nog niet weggeschreven events
+_has_events: Optional[asyncio.Event] = None    # wekt de flusher bij het eerste event
+_batch_full: Optional[asyncio.Event] = None    # BATCH_SIZE bereikt: niet op het interval wachten
+_flusher: Optional[asyncio.Task] = None
+_inflight: Optional[asyncio.Task] = None       # batch die nu weggeschreven wordt
+_stopping = False
+_to_spill: List[ScanEvent] = []                # overloop bij een volle queue, wacht op de spill thread
+_spiller: Optional[asyncio.Task] = None
+_spill_lock = threading.Lock()                 # één schrijver tegelijk in het spill bestand
+_stats = {"enqueued": 0, "written": 0, "batches": 0, "dropped": 0, "spilled": 0, "replayed": 0,
+          "failed_batches": 0, "corrupt_spill_lines": 0}
+
+
+def _ensure_started():
+    global _has_events, _batch_full, _flusher, _stopping
+    if _has_events is None:
+        _has_events = asyncio.Event()
+        _batch_full = asyncio.Event()
+    if _flusher is None or _flusher.done():
+        _stopping = False
+        _flusher = asyncio.create_task(_flush_loop())
+
+
+def enqueue(event: ScanEvent) -> str:
+    """
+    Queue a scan for the background flusher, never blocks. Returns "queued", or when
+    MAX_PENDING is reached (backpressure) "spilled" (written to the spill file) or "dropped".
+    """
+    global _spiller
+    _ensure_started()
+    if len(_pending) >= MAX_PENDING:
+        # Schrijven + fsync gebeurt in een thread, nooit op de event loop
+        if SPILL_PATH and len(_to_spill) < MAX_PENDING:
+            _to_spill.append(event)
+            recent_scans.mark_incomplete()
+            if _spiller is None or _spiller.done():
+                _spiller = asyncio.create_task(_drain_spill())
+            return "spilled"
+        _stats["dropped"] += 1
+        logger.warning("Scan log queue full (%d), scan dropped: %s", MAX_PENDING, event.barcode)
+        return "dropped"
+    _pending.append(event)
+    _stats["enqueued"] += 1
+    _has_events.set()
+    if len(_pending) >= BATCH_SIZE:
+        _batch_full.set()
+    return "queued"
+
+
+def _take_batch() -> List[ScanEvent]:
+    batch = [_pending.popleft() for _ in range(min(BATCH_SIZE, len(_pending)))]
+    if len(_pending) < BATCH_SIZE:
+        _batch_full.clear()
+    if not _pending:
+        _has_events.clear()
+    return batch
+
+
+async def _write_batch(events: List[ScanEvent]):
+    if DATABASE_URL:
+        db = await get_database_service()
+        await db.insert_scans([asdict(e) for e in events])
+    else:
+        # Zonder DATABASE_URL via de Supabase client (lazy import: die module enqueuet zelf)
+        from app.services.openfoodfacts_service import insert_scans_supabase
+        await asyncio.to_thread(insert_scans_supabase, [asdict(e) for e in events])
+
+
+async def _flush(events: List[ScanEvent]):
+    try:
+        await _write_batch(events)
+    except Exception as e:
+        _stats["failed_batches"] += 1
+        logger.error("Error logging %d scans: %s", len(events), e)
+        recent_scans.mark_incomplete()
+        if not await asyncio.to_thread(_spill, events):
+            _stats["dropped"] += len(events)
+        return
+    _stats["written"] += len(events)
+    _stats["batches"] += 1
+    # Gelogde scans delen met de andere workers (duplicate detectie), één pipeline per batch;
+    # zonder Redis onthoudt publish() dat Redis ze mist
+    await asyncio.to_thread(
+        recent_scans.publish, [(e.user_id, e.barcode, e.scanned_at.timestamp()) for e in events]
+    )
+
+
+async def _flush_loop():
+    global _inflight
+    await _replay_spill()
+    # Events blijven in _pending tot ze in een batch gaan: stoppen verliest er geen
+    while not _stopping:
+        await _has_events.wait()
+        if len(_pending) < BATCH_SIZE and not _stopping:
+            try:
+                await asyncio.wait_for(_batch_full.wait(), FLUSH_INTERVAL_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+        if _stopping:
+            break
+        # Shield: een shutdown onderbreekt nooit een lopende insert, stop() wacht erop
+        _inflight = asyncio.create_task(_flush(_take_batch()))
+        await asyncio.shield(_inflight)
+
+
+# ==================== SPILL FILE ====================
+
+def _spill(events: List[ScanEvent]) -> bool:
+    """Append events to the spill file (blocking: run it in a thread); False when disabled or failed."""
+    if not SPILL_PATH or not events:
+        return False
+    try:
+        path = Path(SPILL_PATH)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with _spill_lock, open(path, "a", encoding="utf-8") as f:
+            f.write("".join(e.to_json() + "\n" for e in events))
+            f.flush()
+            os.fsync(f.fileno())
+    except OSError as e:
+        logger.error("Scan log spill failed: %s", e)
+        return False
+    _stats["spilled"] += len(events)
+    return True
+
+
+async def _drain_spill():
+    """Write the overflow of a full queue to the spill file, in batches, off the event loop."""
+    while _to_spill:
+        batch = _to_spill[:]
+        del _to_spill[:len(batch)]
+        if not await asyncio.to_thread(_spill, batch):
+            _stats["dropped"] += len(batch)
+
+
+def _read_spill(path: Path) -> List[ScanEvent]:
+    events = []
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                events.append(ScanEvent.from_json(line))
+            except (ValueError, TypeError, KeyError) as e:
+                # Afgebroken schrijfactie of manuele edit: regel overslaan, de rest wel replayen
+                _stats["corrupt_spill_lines"] += 1
+                logger.warning("Scan log spill %s line %d skipped: %s", path.name, number, e)
+    return events
+
+
+def _lock(path: Path):
+    """Open and exclusively flock path, None when another live process holds it (or it's gone)."""
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return None
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def _claim_replay_files() -> list:
+    """
+    Spill files to replay, each as (path, locked file): replays left behind by a crashed or
+    stopped worker (their lock died with them), then the current spill file, renamed first
+    (atomic: new spills go to a fresh file). Locks are released when the process dies.
+    """
+    spill = Path(SPILL_PATH)
+    claimed = []
+    for path in sorted(spill.parent.glob(spill.name + ".replay-*")):
+        f = _lock(path)
+        if f is not None:
+            claimed.append((path, f))
+    if spill.exists():
+        replaying = spill.with_name(f"{spill.name}.replay-{os.getpid()}-{time.time_ns()}")
+        try:
+            os.replace(spill, replaying)
+        except OSError:
+            return claimed
+        # Een andere worker kan hem net als leftover gelockt hebben: dan replayt die hem
+        f = _lock(replaying)
+        if f is not None:
+            claimed.append((replaying, f))
+    return claimed
+
+
+async def _replay_spill():
+    """Offer events spilled by an earlier run (or another worker) to the database again."""
+    if not SPILL_PATH:
+        return
+    for path, lock in await asyncio.to_thread(_claim_replay_files):
+        try:
+            await _replay_file(path)
+        finally:
+            lock.close()
+
+
+async def _replay_file(path: Path):
+    events = await asyncio.to_thread(_read_spill, path)
+    done = 0
+    try:
+        while done < len(events) and not _stopping:
+            await _flush(events[done:done + BATCH_SIZE])
+            done = min(done + BATCH_SIZE, len(events))
+    except asyncio.CancelledError:
+        # Shutdown timeout: niet halverwege verliezen (de lopende batch kan dubbel komen)
+        _respill(path, events[done:])
+        raise
+    if done < len(events):
+        # Gestopt: de rest terug naar het spill bestand, de volgende start pakt hem op
+        await asyncio.to_thread(_respill, path, events[done:])
+    else:
+        path.unlink(missing_ok=True)
+    _stats["replayed"] += done
+    logger.info("Scan log: %d of %d spilled scans replayed (%s)", done, len(events), path.name)
+
+
+def _respill(path: Path, events: List[ScanEvent]):
+    """Put unreplayed events back in the spill file; the replay file stays when that fails."""
+    if _spill(events):
+        path.unlink(missing_ok=True)
+    else:
+        logger.error("Scan log: %d unreplayed scans left in %s", len(events), path)
+
+
+# ==================== LIFECYCLE ====================
+
+async def start():
+    """Start the flusher at startup (replays the spill file right away)."""
+    _ensure_started()
+
+
+async def stop():
+    """Flush what is still queued (called on shutdown); spill whatever doesn't make it in time."""
+    global _flusher, _stopping
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    if _flusher is not None:
+        _stopping = True
+        _has_events.set()
+        _batch_full.set()
+        await asyncio.wait([_flusher], timeout=SHUTDOWN_TIMEOUT)
+        _flusher.cancel()
+        _flusher = None
+    if _inflight is not None and not _inflight.done():
+        await asyncio.wait([_inflight], timeout=max(deadline - time.monotonic(), 0))
+
+    while _pending:
+        remaining = deadline - time.monotonic()
+        batch = _take_batch()
+        try:
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            await asyncio.wait_for(_flush(batch), remaining)
+        except asyncio.TimeoutError:
+            logger.warning("Scan log flush on shutdown timed out, %d scans left", len(batch) + len(_pending))
+            _to_spill.extend(batch + list(_pending))
+            recent_scans.mark_incomplete()
+            _pending.clear()
+
+    # Overloop die nog naar het spill bestand moet
+    if _spiller is not None and not _spiller.done():
+        await _spiller
+    await _drain_spill()
+
+
+def stats() -> dict:
+    return {**_stats, "pending": len(_pending), "spill_pending": len(_to_spill), "spill": bool(SPILL_PATH)}
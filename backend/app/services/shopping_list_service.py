@@ -1,193 +1,594 @@
-from http.client import HTTPException
-from supabase import Client
-from app.services.product_service import find_product_by_barcode
+from typing import Any, Dict, List, Optional, Tuple
+from app.services.database_service import DATABASE_URL, get_database_service, products_have_gtin14
+from app.services.product_service import ProductMatch
+from app.services.gtin import normalize_gtin
+from app.services import redis_cache, resource_versions
+from app.scripts import migrate_shopping_lists
+import asyncio
+import logging
+import os
+import time
 import uuid
 
-def create_list(supabase: Client, user_id: str, list_name: str):
-    result = supabase.table("shopping_lists").insert({
-        "user_id": user_id,
-        "list_name": list_name,
-        "status": "active"
-    }).execute()
+logger = logging.getLogger(__name__)
 
-    return result.data[0]
+# Boodschappenlijsten op de gedeelde asyncpg pool: elke operatie is één transactie
+# op één gepoolde connectie. Eigenaarschap (user_id) zit in dezelfde statements.
+# De prijsregel per lijn staat in Postgres (shopping_line_pricing, view
+# shopping_list_item_lines; zie app.scripts.migrate_shopping_lists): er gaan geen
+# rijen naar Python om te prijzen. De totals van een lijst worden per bewerking met
+# een delta bijgewerkt (O(1)); een periodieke reconciliatie rekent ze volledig na.
+# Zonder die migratie faalt elke item endpoint: ensure_schema() bij startup.
 
-def get_product_id_by_barcode(supabase: Client, barcode: str) -> str | None:
-    """Zoek een product_id op basis van de barcode"""
-    result = supabase.table("products").select("product_id").eq("barcode", barcode).limit(1).execute()
-    print(f"[DEBUG] Barcode lookup '{barcode}': {result.data}")
-    if result.data and len(result.data) > 0:
-        return result.data[0]["product_id"]
-    return None
+MIGRATE_ON_STARTUP = os.getenv("SHOPPING_LISTS_MIGRATE_ON_STARTUP", "1") == "1"
 
+RECONCILE_INTERVAL_SECONDS = float(os.getenv("LIST_TOTALS_RECONCILE_SECONDS", "21600"))   # 0 = uit
+RECONCILE_BATCH_SIZE = int(os.getenv("LIST_TOTALS_RECONCILE_BATCH_SIZE", "500"))
+_RECONCILE_LOCK_KEY = 0x4D50_4C54   # pg advisory lock: één worker tegelijk
 
-def get_or_create_product(supabase: Client, barcode: str) -> str | None:
-    match = find_product_by_barcode(barcode)
-    if not match:
-        return None
+_reconcile_task: Optional[asyncio.Task] = None
+_reconcile_stats = {"runs": 0, "skipped": 0, "lists_checked": 0, "lists_corrected": 0, "last_run_seconds": None}
 
-    existing = get_product_id_by_barcode(supabase, match.barcode)
-    if existing:
-        # Update image_url als die nog ontbreekt
-        if match.image_url:
-            supabase.table("products").update({
-                "image_url": match.image_url,
-            }).eq("product_id", existing).is_("image_url", "null").execute()
-        return existing
-
-    result = supabase.table("products").upsert({
-        "product_id": str(uuid.uuid4()),
-        "barcode": match.barcode,
-        "product_name": match.product_name or f"Onbekend ({match.barcode})",
-        "brand": match.brands,
-        "energy_kcal": match.energy_kcal_100g,
-        "proteins_g": match.proteins_100g,
-        "carbohydrates_g": match.carbohydrates_100g,
-        "fat_g": match.fat_100g,
-        "sugars_g": match.sugars_100g,
-        "image_url": match.image_url,
-    }, on_conflict="barcode").execute()
-
-    if result.data:
-        return result.data[0]["product_id"]
-    return None
-
-
-def add_item_by_barcode(supabase: Client, list_id: str, barcode: str, quantity: int = 1):
-    product_id = get_or_create_product(supabase, barcode)
-    if not product_id:
-        return {"error": f"Product met barcode {barcode} niet gevonden in OpenFoodFacts"}
 
-    existing = supabase.table("shopping_list_items") \
-        .select("item_id, quantity") \
-        .eq("list_id", list_id) \
-        .eq("product_id", product_id) \
-        .execute()
-
-    if existing.data:
-        item = existing.data[0]
-        new_quantity = item["quantity"] + quantity
-        supabase.table("shopping_list_items") \
-            .update({"quantity": new_quantity}) \
-            .eq("item_id", item["item_id"]) \
-            .execute()
-        return {"updated": True, "item_id": item["item_id"]}
-    else:
-        insert_result = supabase.table("shopping_list_items").insert({
-            "list_id": list_id,
-            "product_id": product_id,
-            "quantity": quantity,
-            "is_checked": False
-        }).execute()
-        return {"created": True, "item_id": insert_result.data[0]["item_id"]}
-
-
-def get_list_items_with_names(supabase: Client, list_id: str):
-    result = supabase.table("shopping_list_items") \
-        .select("""
-            item_id,
-            product_id,
-            quantity,
-            is_checked,
-            has_promo,
-            promo_id,
-            price_per_unit,
-            products!inner(product_name, barcode, price, brand, image_url),
-            promotions(promo_id, discount_percentage, original_price, promo_price, deal_quantity, is_meerdere_artikels)
-        """) \
-        .eq("list_id", list_id) \
-        .execute()
-
-    if not result.data:
-        return []
+# Laatste CTEs van een schrijvend statement: telt het verschil van de gewijzigde lijnen op
+# bij de list totals, in hetzelfde statement. Verwacht een CTE "changed" met per lijn de
+# oude en nieuwe toestand (old_quantity NULL = nieuw item, new_quantity NULL = verwijderd).
+_APPLY_TOTALS_DELTA = """
+, delta AS (
+    SELECT c.list_id,
+           sum(COALESCE(n.line_total, 0) - COALESCE(o.line_total, 0)) AS total_delta,
+           sum(COALESCE(n.savings, 0) - COALESCE(o.savings, 0)) AS savings_delta
+    FROM changed c
+    LEFT JOIN LATERAL shopping_line_contribution(c.product_id, c.old_promo_id, c.old_has_promo, c.old_quantity) o ON true
+    LEFT JOIN LATERAL shopping_line_contribution(c.product_id, c.new_promo_id, c.new_has_promo, c.new_quantity) n ON true
+    GROUP BY c.list_id
+), totals AS (
+    UPDATE shopping_lists sl
+    SET estimated_total_price = round((COALESCE(sl.estimated_total_price, 0) + d.total_delta)::numeric, 2),
+        estimated_savings = round((COALESCE(sl.estimated_savings, 0) + d.savings_delta)::numeric, 2)
+    FROM delta d
+    WHERE sl.list_id = d.list_id AND (d.total_delta <> 0 OR d.savings_delta <> 0)
+)
+"""
+
+# Volledige totals van lijsten uit de view, zonder rijen naar Python (lijst zonder items = 0)
+_LIST_TOTALS = """
+    SELECT l.list_id,
+           round(COALESCE(sum(v.line_total), 0)::numeric, 2)::float8 AS total,
+           round(COALESCE(sum(v.savings), 0)::numeric, 2)::float8 AS savings
+    FROM shopping_lists l
+    LEFT JOIN shopping_list_item_lines v ON v.list_id = l.list_id
+"""
+
+
+async def _lock_list_of_item(conn, item_id: str, user_id: str):
+    """
+    Lock the list the item belongs to (if it's the user's); its list_id or None. Every write
+    locks the list row before its items, like add_items_by_barcodes and set_item: no deadlocks.
+    """
+    return await conn.fetchval(
+        """
+        SELECT sl.list_id
+        FROM shopping_lists sl
+        JOIN shopping_list_items sli ON sli.list_id = sl.list_id
+        WHERE sli.item_id = $1::uuid AND sl.user_id = $2::uuid
+        FOR UPDATE OF sl
+        """,
+        item_id, user_id
+    )
+
+
+# ==================== LISTS ====================
+
+async def create_list(user_id: str, list_name: str) -> Dict[str, Any]:
+    db = await get_database_service()
+    async with db.pool.acquire() as conn:
+        row = await conn.fetchrow(
+            """
+            INSERT INTO shopping_lists (user_id, list_name, status)
+            VALUES ($1::uuid, $2, 'active')
+            RETURNING *
+            """,
+            user_id, list_name
+        )
+    return dict(row)
+
+
+async def get_user_lists(user_id: str) -> List[Dict[str, Any]]:
+    db = await get_database_service()
+    async with db.pool.acquire() as conn:
+        rows = await conn.fetch("SELECT * FROM shopping_lists WHERE user_id = $1::uuid", user_id)
+    return [dict(row) for row in rows]
+
+
+async def owns_list(list_id: str, user_id: str) -> bool:
+    """Whether list_id is one of the user's lists (False for anything that isn't a UUID)."""
+    try:
+        uuid.UUID(list_id)
+    except ValueError:
+        return False
+    db = await get_database_service()
+    async with db.pool.acquire() as conn:
+        return await conn.fetchval(
+            "SELECT EXISTS (SELECT 1 FROM shopping_lists WHERE list_id = $1::uuid AND user_id = $2::uuid)",
+            list_id, user_id
+        )
+
+
+async def delete_list(list_id: str, user_id: str) -> bool:
+    """Delete the user's list; False when it doesn't exist or isn't theirs."""
+    db = await get_database_service()
+    async with db.pool.acquire() as conn:
+        deleted = await conn.fetchval(
+            "DELETE FROM shopping_lists WHERE list_id = $1::uuid AND user_id = $2::uuid RETURNING list_id",
+            list_id, user_id
+        )
+    if deleted is None:
+        return False
+    await resource_versions.bump(resource_versions.LIST, [list_id])
+    return True
+
+
+async def recalculate_list_totals(conn, list_id: str):
+    """
+    Herbereken estimated_total_price en estimated_savings van een shopping list volledig,
+    met één UPDATE ... FROM (aggregaat over de view) op de connectie van de caller.
+    Bewerkingen van items passen enkel een delta toe; dit is voor herprijzen en reconciliatie.
+    """
+    await recalculate_lists_totals(conn, [list_id])
+
+
+async def recalculate_lists_totals(conn, list_ids: List[str]) -> int:
+    """Full recalculation of many lists in one statement; returns the number of lists updated."""
+    result = await conn.execute(
+        f"""
+        UPDATE shopping_lists sl
+        SET estimated_total_price = t.total,
+            estimated_savings = t.savings
+        FROM ({_LIST_TOTALS}
+              WHERE l.list_id = ANY($1::uuid[])
+              GROUP BY l.list_id) t
+        WHERE sl.list_id = t.list_id
+        """,
+        list_ids
+    )
+    return int(result.split()[-1])
+
+
+# ==================== ITEMS ====================
+
+async def get_list_items_with_names(list_id: str, user_id: str) -> List[Dict[str, Any]]:
+    """Items of the user's list with product and promotion details and line totals (from the view)."""
+    db = await get_database_service()
+    async with db.pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT v.item_id, v.product_id, v.product_name, v.barcode, v.brand, v.image_url,
+                   v.quantity, v.is_checked, v.has_promo, v.price_per_unit, v.original_price,
+                   v.promo_price, v.line_total, v.savings_per_unit, v.discount_label, v.deal_quantity
+            FROM shopping_list_item_lines v
+            JOIN shopping_lists sl ON sl.list_id = v.list_id
+            WHERE v.list_id = $1::uuid AND sl.user_id = $2::uuid
+            """,
+            list_id, user_id
+        )
 
     items_with_names = []
-    for row in result.data:
-        promo = row.get("promotions") or {}
-        product = row.get("products") or {}
-
-        original_price = promo.get("original_price") or (product.get("price") if product else None)
-        promo_price = promo.get("promo_price")
-        deal_quantity = promo.get("deal_quantity")
-        is_meerdere_artikels = promo.get("is_meerdere_artikels", False)
-
-        quantity = row["quantity"]
-        has_promo = row.get("has_promo", False)
-
-        # Bereken line_total, price_per_unit en savings correct op basis van promotietype
-        line_total = None
-        savings_per_unit = None
-
-        if has_promo and original_price and promo_price:
-            if is_meerdere_artikels and deal_quantity and deal_quantity > 1:
-                # "2e aan -X% vanaf Y st" type:
-                # Elke complete groep van `deal_quantity` items kost allemaal `promo_price` per stuk.
-                # Items buiten een complete groep kosten `original_price`.
-                complete_groups = quantity // deal_quantity
-                remaining = quantity % deal_quantity
-                line_total = round(
-                    complete_groups * deal_quantity * promo_price
-                    + remaining * original_price,
-                    2
-                )
-                # price_per_unit: promo_price als alle items in complete groepen zitten, anders origineel
-                price_per_unit = promo_price if (complete_groups > 0 and remaining == 0) else original_price
-                # Totale besparing gedeeld door quantity zodat frontend (savings_per_unit * quantity) klopt
-                total_savings = complete_groups * deal_quantity * (original_price - promo_price)
-                savings_per_unit = round(total_savings / quantity, 4) if quantity > 0 else 0
-            else:
-                # Gewone korting: elke unit aan promo prijs
-                price_per_unit = promo_price
-                line_total = round(promo_price * quantity, 2)
-                savings_per_unit = round(original_price - promo_price, 2)
-        else:
-            price_per_unit = original_price
-            if original_price:
-                line_total = round(original_price * quantity, 2)
-
-        items_with_names.append({
+    for row in rows:
+        item = dict(row)
+        item["product_name"] = item["product_name"] or "Onbekend"
+        item["has_promo"] = item["has_promo"] or False
+        items_with_names.append(item)
+    return items_with_names
+
+
+async def bump_lists_with_products(product_ids: List[str]) -> int:
+    """
+    New version for every list with an item on these products, after their name, image or
+    price changed (the items endpoint shows those through the view); number of lists bumped.
+    """
+    if not product_ids or not redis_cache.available():
+        return 0
+    db = await get_database_service()
+    async with db.pool.acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT DISTINCT list_id FROM shopping_list_items WHERE product_id = ANY($1::uuid[])",
+            list(dict.fromkeys(str(p) for p in product_ids))
+        )
+    await resource_versions.bump(resource_versions.LIST, [row["list_id"] for row in rows])
+    return len(rows)
+
+
+async def _get_or_create_products(conn, matches: List[ProductMatch]) -> Dict[str, str]:
+    """
+    product_id per barcode voor (via product_resolver) opgeloste producten: ontbrekende
+    worden in één multi-row upsert aangemaakt, ontbrekende image_urls in één update aangevuld.
+    """
+    product_ids = {m.barcode: str(m.product_id) for m in matches if m.product_id}
+
+    with_image = [m for m in matches if m.product_id and m.image_url]
+    if with_image:
+        await conn.execute(
+            """
+            UPDATE products p SET image_url = t.image_url
+            FROM unnest($1::uuid[], $2::text[]) AS t(product_id, image_url)
+            WHERE p.product_id = t.product_id AND p.image_url IS NULL
+            """,
+            [str(m.product_id) for m in with_image], [m.image_url for m in with_image]
+        )
+
+    # Eén rij per canonieke barcode: een upsert mag dezelfde rij geen twee keer raken
+    missing = {}
+    for m in matches:
+        if not m.product_id:
+            missing.setdefault(normalize_gtin(m.barcode) or m.barcode, m)
+    if missing:
+        new = list(missing.values())
+        # Zonder gtin14 kolom (oudere database) wordt de sleutel niet geschreven
+        has_gtin14 = await products_have_gtin14(conn)
+        rows = await conn.fetch(
+            f"""
+            INSERT INTO products (
+                product_id, barcode, {"gtin14, " if has_gtin14 else ""}product_name, brand,
+                energy_kcal, proteins_g, carbohydrates_g, fat_g, sugars_g, image_url
+            )
+            SELECT gen_random_uuid(), t.barcode, {"t.gtin14, " if has_gtin14 else ""}t.product_name, t.brand,
+                   t.energy_kcal, t.proteins_g, t.carbohydrates_g, t.fat_g, t.sugars_g, t.image_url
+            FROM unnest($1::text[], $2::text[], $3::text[], $4::text[], $5::float8[],
+                        $6::float8[], $7::float8[], $8::float8[], $9::float8[], $10::text[])
+                 AS t(barcode, gtin14, product_name, brand, energy_kcal,
+                      proteins_g, carbohydrates_g, fat_g, sugars_g, image_url)
+            ON CONFLICT (barcode) DO UPDATE SET
+                product_name = EXCLUDED.product_name,
+                brand = EXCLUDED.brand,
+                energy_kcal = EXCLUDED.energy_kcal,
+                proteins_g = EXCLUDED.proteins_g,
+                carbohydrates_g = EXCLUDED.carbohydrates_g,
+                fat_g = EXCLUDED.fat_g,
+                sugars_g = EXCLUDED.sugars_g,
+                image_url = COALESCE(products.image_url, EXCLUDED.image_url)
+                {", gtin14 = COALESCE(products.gtin14, EXCLUDED.gtin14)" if has_gtin14 else ""}
+            RETURNING barcode, product_id
+            """,
+            [m.barcode for m in new],
+            [normalize_gtin(m.barcode) for m in new],
+            [m.product_name or f"Onbekend ({m.barcode})" for m in new],
+            [m.brands for m in new],
+            [m.energy_kcal_100g for m in new],
+            [m.proteins_100g for m in new],
+            [m.carbohydrates_100g for m in new],
+            [m.fat_100g for m in new],
+            [m.sugars_100g for m in new],
+            [m.image_url for m in new],
+        )
+        created = {row["barcode"]: str(row["product_id"]) for row in rows}
+        for m in matches:
+            if not m.product_id:
+                product_ids[m.barcode] = created[missing[normalize_gtin(m.barcode) or m.barcode].barcode]
+    return product_ids
+
+
+async def add_items_by_barcodes(
+    list_id: str, user_id: str, items: List[Tuple[str, int]], matches: Dict[str, ProductMatch]
+) -> Optional[Dict[str, Any]]:
+    """
+    Add many (barcode, quantity) pairs to the user's list in one transaction: missing products
+    in one upsert, items merged with one INSERT ... ON CONFLICT (quantities are added up),
+    totals adjusted in the same statement. matches: product_resolver.resolve_products() for the barcodes.
+    None when the list doesn't exist or isn't the user's.
+    """
+    found = [(barcode, quantity) for barcode, quantity in items if barcode in matches]
+    not_found = list(dict.fromkeys(barcode for barcode, _ in items if barcode not in matches))
+
+    db = await get_database_service()
+    async with db.pool.acquire() as conn, conn.transaction():
+        owner = await conn.fetchval(
+            "SELECT list_id FROM shopping_lists WHERE list_id = $1::uuid AND user_id = $2::uuid FOR UPDATE",
+            list_id, user_id
+        )
+        if owner is None:
+            return None
+        if not found:
+            return {"added": [], "not_found": not_found}
+
+        product_ids = await _get_or_create_products(conn, list({b: matches[b] for b, _ in found}.values()))
+
+        # Zelfde product via verschillende barcodes: in SQL per product_id opgeteld.
+        # Bestond het item al, dan was de oude quantity de nieuwe min de toegevoegde.
+        rows = await conn.fetch(
+            f"""
+            WITH added AS (
+                SELECT t.product_id, sum(t.quantity)::int AS quantity
+                FROM unnest($2::uuid[], $3::int[]) AS t(product_id, quantity)
+                GROUP BY t.product_id
+            ), merged AS (
+                INSERT INTO shopping_list_items (list_id, product_id, quantity, is_checked)
+                SELECT $1::uuid, product_id, quantity, false FROM added
+                ON CONFLICT (list_id, product_id) DO UPDATE
+                    SET quantity = shopping_list_items.quantity + EXCLUDED.quantity
+                RETURNING item_id, list_id, product_id, quantity, has_promo, promo_id, (xmax = 0) AS created
+            ), changed AS (
+                SELECT m.list_id, m.product_id,
+                       m.promo_id AS old_promo_id, m.has_promo AS old_has_promo,
+                       NULLIF(m.quantity - a.quantity, 0) AS old_quantity,
+                       m.promo_id AS new_promo_id, m.has_promo AS new_has_promo, m.quantity AS new_quantity
+                FROM merged m
+                JOIN added a ON a.product_id = m.product_id
+            )
+            {_APPLY_TOTALS_DELTA}
+            SELECT item_id, product_id, created FROM merged
+            """,
+            list_id,
+            [product_ids[matches[barcode].barcode] for barcode, _ in found],
+            [quantity for _, quantity in found],
+        )
+    await resource_versions.bump(resource_versions.LIST, [list_id])
+
+    by_product = {str(row["product_id"]): row for row in rows}
+    added = []
+    for barcode in dict.fromkeys(barcode for barcode, _ in found):
+        row = by_product[product_ids[matches[barcode].barcode]]
+        added.append({
+            "barcode": barcode,
             "item_id": row["item_id"],
             "product_id": row["product_id"],
-            "product_name": product.get("product_name", "Onbekend"),
-            "barcode": product.get("barcode"),
-            "brand": product.get("brand"),
-            "image_url": product.get("image_url"),
-            "quantity": quantity,
-            "is_checked": row["is_checked"],
-            "has_promo": has_promo,
-            "price_per_unit": price_per_unit,
-            "original_price": original_price,
-            "promo_price": promo_price,
-            "line_total": line_total,
-            "savings_per_unit": savings_per_unit,
-            "discount_label": promo.get("discount_percentage"),
-            "deal_quantity": deal_quantity,
+            "created": row["created"],
         })
+    return {"added": added, "not_found": not_found}
+
+
+async def add_item_by_barcode(list_id: str, user_id: str, barcode: str, match: Optional[ProductMatch], quantity: int = 1):
+    if not match:
+        return {"error": f"Product met barcode {barcode} niet gevonden in OpenFoodFacts"}
+
+    result = await add_items_by_barcodes(list_id, user_id, [(barcode, quantity)], {barcode: match})
+    if result is None:
+        return {"error": "Lijst niet gevonden"}
+
+    item = result["added"][0]
+    if item["created"]:
+        return {"created": True, "item_id": item["item_id"]}
+    return {"updated": True, "item_id": item["item_id"]}
+
+
+async def set_item(
+    conn,
+    list_id: str,
+    product_id: str,
+    quantity: int,
+    has_promo: bool = False,
+    promo_id: Optional[str] = None,
+    price_per_unit: Optional[float] = None,
+):
+    """
+    Put a product on the list with this quantity (insert, or overwrite the quantity of the
+    existing item; promo info is only replaced when given), totals adjusted in the same statement.
+    Runs on the caller's transaction: bump the list version after it commits.
+    """
+    await conn.execute(
+        f"""
+        WITH old AS (
+            SELECT product_id, quantity, has_promo, promo_id FROM shopping_list_items
+            WHERE list_id = $1::uuid AND product_id = $2::uuid
+            FOR UPDATE
+        ), merged AS (
+            INSERT INTO shopping_list_items (list_id, product_id, quantity, has_promo, promo_id, price_per_unit)
+            VALUES ($1::uuid, $2::uuid, $3, $4, $5::uuid, $6)
+            ON CONFLICT (list_id, product_id) DO UPDATE SET
+                quantity = EXCLUDED.quantity,
+                has_promo = CASE WHEN $4 THEN true ELSE shopping_list_items.has_promo END,
+                promo_id = COALESCE($5::uuid, shopping_list_items.promo_id),
+                price_per_unit = COALESCE($6, shopping_list_items.price_per_unit)
+            RETURNING list_id, product_id, quantity, has_promo, promo_id
+        ), changed AS (
+            SELECT m.list_id, m.product_id,
+                   o.promo_id AS old_promo_id, o.has_promo AS old_has_promo, o.quantity AS old_quantity,
+                   m.promo_id AS new_promo_id, m.has_promo AS new_has_promo, m.quantity AS new_quantity
+            FROM merged m
+            LEFT JOIN old o ON o.product_id = m.product_id
+        )
+        {_APPLY_TOTALS_DELTA}
+        SELECT 1
+        """,
+        list_id, product_id, quantity, has_promo, promo_id, price_per_unit
+    )
+
+
+async def update_item(item_id: str, user_id: str, is_checked: Optional[bool] = None, quantity: Optional[int] = None):
+    """Update is_checked and/or quantity of an item on the user's list; None when not found."""
+    db = await get_database_service()
+    async with db.pool.acquire() as conn, conn.transaction():
+        list_id = await _lock_list_of_item(conn, item_id, user_id)
+        if list_id is None:
+            return None
+        # old: de rij vóór de update (gelockt); totals enkel bijgewerkt als quantity wijzigt
+        row = await conn.fetchrow(
+            f"""
+            WITH old AS (
+                SELECT item_id, quantity
+                FROM shopping_list_items
+                WHERE item_id = $1::uuid AND list_id = $2::uuid
+                FOR UPDATE
+            ), updated AS (
+                UPDATE shopping_list_items sli
+                SET is_checked = COALESCE($3, sli.is_checked),
+                    quantity = COALESCE($4, sli.quantity)
+                FROM old
+                WHERE sli.item_id = old.item_id
+                RETURNING sli.*, old.quantity AS old_quantity
+            ), changed AS (
+                SELECT list_id, product_id,
+                       promo_id AS old_promo_id, has_promo AS old_has_promo, old_quantity,
+                       promo_id AS new_promo_id, has_promo AS new_has_promo, quantity AS new_quantity
+                FROM updated
+                WHERE quantity <> old_quantity
+            )
+            {_APPLY_TOTALS_DELTA}
+            SELECT * FROM updated
+            """,
+            item_id, list_id, is_checked, quantity
+        )
+    if row is None:
+        return None
+    await resource_versions.bump(resource_versions.LIST, [row["list_id"]])
+    item = dict(row)
+    item.pop("old_quantity")
+    return item
+
+
+async def delete_item(item_id: str, user_id: str) -> bool:
+    db = await get_database_service()
+    async with db.pool.acquire() as conn, conn.transaction():
+        if await _lock_list_of_item(conn, item_id, user_id) is None:
+            return False
+        list_id = await conn.fetchval(
+            f"""
+            WITH deleted AS (
+                DELETE FROM shopping_list_items
+                WHERE item_id = $1::uuid
+                RETURNING *
+            ), changed AS (
+                SELECT list_id, product_id,
+                       promo_id AS old_promo_id, has_promo AS old_has_promo, quantity AS old_quantity,
+                       NULL::uuid AS new_promo_id, NULL::boolean AS new_has_promo, NULL::int AS new_quantity
+                FROM deleted
+            )
+            {_APPLY_TOTALS_DELTA}
+            SELECT list_id FROM deleted
+            """,
+            item_id
+        )
+    if list_id is None:
+        return False
+    await resource_versions.bump(resource_versions.LIST, [list_id])
+    return True
+
+
+# ==================== SCHEMA ====================
+
+async def ensure_schema():
+    """
+    Make sure the migrate_shopping_lists objects exist (called on startup): apply the
+    migration (idempotent, serialized across workers), or with
+    SHOPPING_LISTS_MIGRATE_ON_STARTUP=0 refuse to start when they are missing.
+    """
+    if not DATABASE_URL:
+        return
+    db = await get_database_service()
+    async with db.pool.acquire() as conn:
+        if MIGRATE_ON_STARTUP:
+            try:
+                merged = await migrate_shopping_lists.apply(conn)
+            except Exception as e:
+                raise RuntimeError(
+                    f"Shopping list migration failed at startup ({e}); run python -m "
+                    "app.scripts.migrate_shopping_lists with a role that may create indexes, functions and views"
+                ) from e
+            if merged:
+                logger.warning("Shopping list migration: %d duplicate items merged", merged)
+            return
+        missing = await migrate_shopping_lists.missing_objects(conn)
+    if missing:
+        raise RuntimeError(
+            f"Postgres is missing {', '.join(missing)}: run python -m app.scripts.migrate_shopping_lists "
+            "before starting (or set SHOPPING_LISTS_MIGRATE_ON_STARTUP=1)"
+        )
 
-    return items_with_names
 
+# ==================== RECONCILIATION ====================
 
-def recalculate_list_totals(supabase: Client, list_id: str):
+async def reconcile_list_totals(batch_size: int = RECONCILE_BATCH_SIZE) -> Dict[str, Any]:
     """
-    Herbereken estimated_total_price en estimated_savings voor een shopping list
-    en sla ze op in de shopping_lists tabel.
-    Houdt rekening met 'meerdere artikels' promoties (bv. 2e aan -25%).
+    Recompute the totals of every list from its items (view shopping_list_item_lines) and
+    correct the lists whose maintained (delta) totals drifted. Per batch one transaction:
+    lock the lists, then compute and fix them in a second statement, whose snapshot
+    includes every edit committed before the lock; later edits apply their delta after it.
     """
-    items = get_list_items_with_names(supabase, list_id)
+    start = time.perf_counter()
+    checked = corrected = 0
+    db = await get_database_service()
+    async with db.pool.acquire() as conn:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", _RECONCILE_LOCK_KEY):
+            _reconcile_stats["skipped"] += 1
+            return {"skipped": True}
+        try:
+            last_id = None
+            while True:
+                # Per batch één transactie met twee statements. Eerst de lijsten locken: het
+                # tweede statement krijgt een snapshot van na de locks, dus ziet het alle items
+                # van edits die vóór de lock committeerden en wachten latere edits erop.
+                async with conn.transaction():
+                    rows = await conn.fetch(
+                        """
+                        SELECT list_id FROM shopping_lists
+                        WHERE $1::uuid IS NULL OR list_id > $1::uuid
+                        ORDER BY list_id
+                        LIMIT $2
+                        FOR UPDATE
+                        """,
+                        last_id, batch_size
+                    )
+                    if not rows:
+                        break
+                    list_ids = [row["list_id"] for row in rows]
+                    # Totals uit de view vergelijken met de bijgehouden waarden, enkel afwijkende bijwerken
+                    result = await conn.execute(
+                        f"""
+                        WITH computed AS ({_LIST_TOTALS}
+                            WHERE l.list_id = ANY($1::uuid[])
+                            GROUP BY l.list_id
+                        )
+                        UPDATE shopping_lists sl
+                        SET estimated_total_price = c.total, estimated_savings = c.savings
+                        FROM computed c
+                        WHERE sl.list_id = c.list_id
+                          AND (abs(COALESCE(sl.estimated_total_price, 0) - c.total) >= 0.01
+                               OR abs(COALESCE(sl.estimated_savings, 0) - c.savings) >= 0.01)
+                        """,
+                        list_ids
+                    )
+                last_id = list_ids[-1]
+                checked += len(list_ids)
+                corrected += int(result.split()[-1])
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", _RECONCILE_LOCK_KEY)
+
+    elapsed = time.perf_counter() - start
+    _reconcile_stats["runs"] += 1
+    _reconcile_stats["lists_checked"] += checked
+    _reconcile_stats["lists_corrected"] += corrected
+    _reconcile_stats["last_run_seconds"] = round(elapsed, 3)
+    if corrected:
+        logger.warning("List totals reconciliation: %d of %d lists corrected in %.1fs", corrected, checked, elapsed)
+    else:
+        logger.info("List totals reconciliation: %d lists checked in %.1fs", checked, elapsed)
+    return {"checked": checked, "corrected": corrected, "seconds": elapsed}
+
+
+async def _reconcile_loop():
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL_SECONDS)
+        try:
+            await reconcile_list_totals()
+        except Exception as e:
+            logger.error("List totals reconciliation failed: %s", e)
+
+
+def start_totals_reconciler():
+    """Reconcile the maintained list totals every RECONCILE_INTERVAL_SECONDS (called on startup)."""
+    global _reconcile_task
+    if DATABASE_URL and RECONCILE_INTERVAL_SECONDS > 0 and _reconcile_task is None:
+        _reconcile_task = asyncio.create_task(_reconcile_loop())
 
-    total_price = 0.0
-    total_savings = 0.0
 
-    for item in items:
-        line_total = item.get("line_total") or 0.0
-        savings_per_unit = item.get("savings_per_unit") or 0.0
-        quantity = item.get("quantity", 1)
+async def stop_totals_reconciler():
+    """Cancel the reconciler and wait until a running pass has released its connection."""
+    global _reconcile_task
+    if _reconcile_task is not None:
+        _reconcile_task.cancel()
+        await asyncio.gather(_reconcile_task, return_exceptions=True)
+        _reconcile_task = None
 
-        total_price += line_total
-        # savings_per_unit is al berekend als total_savings / quantity (zie get_list_items_with_names)
-        total_savings += savings_per_unit * quantity
 
-    supabase.table("shopping_lists").update({
-        "estimated_total_price": round(total_price, 2),
-        "estimated_savings": round(total_savings, 2),
-    }).eq("list_id", list_id).execute()
\ No newline at end of file
+def reconcile_stats() -> dict:
+    return dict(_reconcile_stats)
@@ -0,0 +1,104 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, List, Tuple
+
+# Request coalescing: gelijktijdige lookups van dezelfde sleutel delen één
+# lopende resolutie (future) i.p.v. elk apart de backend te raken.
+# De resolutie draait in een eigen task: valt de request die ze startte weg
+# (client disconnect → CancelledError), dan loopt ze door voor de wachtenden.
+
+_groups: List["SingleFlight"] = []
+
+
+class SingleFlight:
+    """In-flight deduplication per key on the running event loop."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.leaders = 0      # sleutels die effectief opgelost werden
+        self.coalesced = 0    # sleutels die op een lopende resolutie wachtten
+        _groups.append(self)
+
+    def claim(self, keys: Iterable[Hashable]) -> Tuple[List[Hashable], Dict[Hashable, asyncio.Future]]:
+        """
+        Split keys into the ones this caller must resolve (it becomes their leader and
+        resolves them with lead()) and futures of keys already in flight.
+        """
+        loop = asyncio.get_running_loop()
+        owned, waiting = [], {}
+        for key in dict.fromkeys(keys):
+            future = self._inflight.get(key)
+            if future is not None and not future.done():
+                waiting[key] = future
+            else:
+                self._inflight[key] = loop.create_future()
+                owned.append(key)
+        self.leaders += len(owned)
+        self.coalesced += len(waiting)
+        return owned, waiting
+
+    def resolve(self, key: Hashable, value):
+        future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(value)
+
+    def fail(self, keys: Iterable[Hashable], error: BaseException):
+        """Propagate the leader's error to the waiters (no one waiting is fine)."""
+        for key in keys:
+            future = self._inflight.pop(key, None)
+            if future is not None and not future.done():
+                if isinstance(error, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(error)
+                    future.add_done_callback(lambda f: f.exception())  # geen "never retrieved" warning
+
+    async def lead(self, owned: List[Hashable], fn: Callable[[], Awaitable[Dict[Hashable, object]]]) -> Dict[Hashable, object]:
+        """
+        Resolve the owned keys with fn() ({key: value}; it may resolve() keys early) in its
+        own task. Cancelling the caller does not cancel that task, so waiters still get
+        the result; the caller just stops waiting for it.
+        """
+        task = asyncio.ensure_future(self._settle(owned, fn))
+        task.add_done_callback(_retrieve)
+        return await asyncio.shield(task)
+
+    async def _settle(self, owned: List[Hashable], fn: Callable[[], Awaitable[Dict[Hashable, object]]]):
+        try:
+            values = await fn()
+        except BaseException as e:
+            self.fail(owned, e)
+            raise
+        for key in owned:
+            self.resolve(key, values.get(key))
+        return values
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        """Run fn() for key, or share the result of the call already in flight."""
+        owned, waiting = self.claim([key])
+        if waiting:
+            return (await self.wait(waiting))[key]
+
+        async def one():
+            return {key: await fn()}
+
+        return (await self.lead(owned, one))[key]
+
+    @staticmethod
+    async def wait(futures: Dict[Hashable, asyncio.Future]) -> Dict[Hashable, object]:
+        """Await in-flight results; cancelling a waiter never cancels the shared resolution."""
+        values = await asyncio.gather(*(asyncio.shield(f) for f in futures.values()))
+        return dict(zip(futures.keys(), values))
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._inflight), "leaders": self.leaders, "coalesced": self.coalesced}
+
+
+def _retrieve(task: asyncio.Future):
+    # Geen "exception was never retrieved" als de leader-caller al weg is
+    if not task.cancelled():
+        task.exception()
+
+
+def all_stats() -> Dict[str, dict]:
+    return {group.name: group.stats() for group in _groups}
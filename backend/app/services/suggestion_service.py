@@ -1,11 +1,14 @@
 from google import genai
 import json
+import logging
 import os
 import asyncio
 from typing import Optional
 from app.services.database_service import get_database_service
 from app.services.user_services import get_user_settings
 
+logger = logging.getLogger(__name__)
+
 client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
 
 
@@ -167,7 +170,7 @@ Antwoord UITSLUITEND in dit JSON formaat:
         return result
 
     except Exception as e:
-        print(f"ERROR: Gemini suggestion failed: {e}")
+        logger.error("Gemini suggestion failed: %s", e)
         return {
             "suggestions": [],
             "meal_tip": "",
@@ -0,0 +1,60 @@
+import re
+import unicodedata
+from typing import List
+
+# Normalisatie van productnamen voor zoeken/matchen (Nederlands + Frans):
+# lowercase, accenten weg, ligaturen uitschrijven, Franse elisies (l', d', ...) weg.
+
+_LIGATURES = str.maketrans({
+    "œ": "oe", "Œ": "oe",
+    "æ": "ae", "Æ": "ae",
+    "ß": "ss",
+    "ĳ": "ij", "Ĳ": "ij",
+    "’": "'", "`": "'", "´": "'",
+})
+
+# l'huile, d'olive, j'aime, qu'il, ...
+_ELISION = re.compile(r"\b(?:l|d|j|m|n|s|t|c|qu)'(?=\w)")
+_NON_ALNUM = re.compile(r"[^a-z0-9.]+")
+# "1,5 l" → "1.5 l" zodat hoeveelheden één token blijven; andere punten worden scheidingstekens
+_DECIMAL_COMMA = re.compile(r"(?<=\d),(?=\d)")
+_LOOSE_DOT = re.compile(r"(?<!\d)\.|\.(?!\d)")
+
+# Lidwoorden/voegwoorden zonder onderscheidend vermogen. "zonder"/"sans" blijven bewust staan.
+STOPWORDS = frozenset({
+    # Nederlands
+    "de", "het", "een", "en", "van", "met", "in", "op", "voor", "of", "te", "aan", "uit",
+    # Frans
+    "le", "la", "les", "du", "des", "un", "une", "et", "au", "aux", "a", "avec", "pour", "sur", "ou",
+})
+
+
+def unaccent(text: str) -> str:
+    if text.isascii():
+        return text
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def normalize_text(text) -> str:
+    """Lowercase, unaccented, ligature- and elision-free text with single spaces."""
+    if not text:
+        return ""
+    text = unaccent(str(text).translate(_LIGATURES)).lower()
+    text = _ELISION.sub("", text)
+    text = _DECIMAL_COMMA.sub(".", text)
+    text = _NON_ALNUM.sub(" ", text)
+    text = _LOOSE_DOT.sub(" ", text)
+    return " ".join(text.split())
+
+
+def tokenize(text, drop_stopwords: bool = True) -> List[str]:
+    """Split normalized text into tokens (single letters dropped, optional stopwords)."""
+    tokens = []
+    for token in normalize_text(text).split():
+        if len(token) < 2 and not token.isdigit():
+            continue
+        if drop_stopwords and token in STOPWORDS:
+            continue
+        tokens.append(token)
+    return tokens
@@ -1,9 +1,12 @@
+import logging
 import os
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
@@ -12,8 +15,8 @@ supabase: Client | None = None
 try:
     if SUPABASE_URL and SUPABASE_KEY:
         supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-        print("Supabase client initialized successfully")
+        logger.info("Supabase client initialized successfully")
     else:
-        print("Supabase credentials missing")
+        logger.warning("Supabase credentials missing")
 except Exception as e:
-    print(f"Failed to initialize Supabase: {e}")
+    logger.warning("Failed to initialize Supabase: %s", e)
@@ -0,0 +1,112 @@
+"""
+price_lines() (numpy, herprijzen na een promotie-ingestion) en shopping_line_pricing()
+(SQL, view en reconciler) moeten dezelfde bedragen geven, anders blijft de reconciler
+lijsten "corrigeren". De SQL vergelijking draait tegen een Postgres uit TEST_DATABASE_URL;
+de functie wordt alleen in pg_temp aangemaakt, er zijn geen tabellen nodig.
+
+    cd backend && TEST_DATABASE_URL=postgresql://... python -m pytest -q tests
+"""
+import asyncio
+import itertools
+import os
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+import pytest
+
+from app.scripts.migrate_shopping_lists import LINE_PRICING_FUNCTION
+from app.services.list_repricing import _round_cents, price_lines
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+QUANTITIES = [0, 1, 2, 3, 4, 5, 7, 10, 13]
+PRICES = [None, 0.0, 0.01, 0.335, 0.99, 1.005, 1.49, 2.5, 2.675, 3.33, 4.445, 12.49]
+DEAL_QUANTITIES = [None, 0, 1, 2, 3, 4]
+FLAGS = [None, False, True]
+
+
+def _numeric_round(value: float) -> float:
+    # round(value::numeric, 2)::float8: float8 -> numeric houdt 15 significante cijfers
+    return float(Decimal(format(value, ".15g")).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP))
+
+
+def _grid():
+    return list(itertools.product(QUANTITIES, FLAGS, PRICES, PRICES, DEAL_QUANTITIES, FLAGS))
+
+
+def _price_grid(rows):
+    # Zoals reprice_lists_for_promotions de kolommen aanlevert: NULL prijzen als NaN,
+    # NULL deal_quantity als 0, NULL vlaggen als false
+    quantity, has_promo, original, promo, deal_quantity, meerdere = zip(*rows)
+    return price_lines(
+        np.array(quantity, dtype=np.int64),
+        np.array([bool(flag) for flag in has_promo]),
+        np.array(original, dtype=float),
+        np.array(promo, dtype=float),
+        np.array([deal or 0 for deal in deal_quantity], dtype=np.int64),
+        np.array([bool(flag) for flag in meerdere]),
+    )
+
+
+def test_round_cents_matches_numeric_round():
+    prices = [price for price in PRICES if price]
+    values = []
+    for a, b in itertools.product(prices, repeat=2):
+        for quantity in range(30):
+            values += [a * quantity, (a - b) * quantity, 3 * quantity * b + quantity * a]
+    values += [0.04499999999999987, 5.074999999999995, 0.005, 1e-12, 0.0]
+    values += [-value for value in values]
+
+    expected = np.array([_numeric_round(value) for value in values])
+    np.testing.assert_array_equal(_round_cents(np.array(values)), expected)
+
+
+def test_price_lines_without_price_is_zero():
+    line_total, savings = price_lines(
+        np.array([2, 2]), np.array([True, False]), np.array([np.nan, 0.0]),
+        np.array([1.0, np.nan]), np.array([0, 0]), np.array([False, False]),
+    )
+    np.testing.assert_array_equal(line_total, [0.0, 0.0])
+    np.testing.assert_array_equal(savings, [0.0, 0.0])
+
+
+async def _sql_prices(rows):
+    import asyncpg
+
+    conn = await asyncpg.connect(TEST_DATABASE_URL)
+    try:
+        await conn.execute(LINE_PRICING_FUNCTION.replace(
+            "FUNCTION shopping_line_pricing(", "FUNCTION pg_temp.shopping_line_pricing(", 1
+        ))
+        # NULL line_total telt als 0, zoals in shopping_line_contribution()
+        return await conn.fetch(
+            """
+            SELECT COALESCE(c.line_total, 0) AS line_total, COALESCE(c.savings, 0) AS savings
+            FROM unnest($1::int[], $2::bool[], $3::float8[], $4::float8[], $5::int[], $6::bool[])
+                 WITH ORDINALITY AS t(quantity, has_promo, original_price, promo_price,
+                                      deal_quantity, is_meerdere_artikels, idx)
+            CROSS JOIN LATERAL pg_temp.shopping_line_pricing(
+                t.quantity, t.has_promo, t.original_price, t.promo_price,
+                t.deal_quantity, t.is_meerdere_artikels
+            ) c
+            ORDER BY t.idx
+            """,
+            *[list(column) for column in zip(*rows)]
+        )
+    finally:
+        await conn.close()
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL not set")
+def test_price_lines_matches_shopping_line_pricing():
+    rows = _grid()
+    line_total, savings = _price_grid(rows)
+    sql = asyncio.run(_sql_prices(rows))
+
+    mismatches = [
+        (row, (float(line_total[i]), float(savings[i])), (record["line_total"], record["savings"]))
+        for i, (row, record) in enumerate(zip(rows, sql))
+        if (line_total[i], savings[i]) != (record["line_total"], record["savings"])
+    ]
+    assert len(sql) == len(rows)
+    assert not mismatches, mismatches[:10]
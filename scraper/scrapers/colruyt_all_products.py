@@ -121,6 +121,12 @@ def fetch_barcode_from_rti(technical_article_nr: str) -> str | None:
 def is_valid_ean(barcode: str) -> bool:
     """Validate whether a barcode has a valid EAN-13 format."""
     return bool(barcode and re.match(r'^\d{8,14}$', barcode))
+
+
+def gtin14(barcode: str | None) -> str | None:
+    """Canonical GTIN-14 key (products.gtin14): digits zero-padded to 14, None for other codes."""
+    digits = re.sub(r'[\s-]', '', barcode or '')
+    return digits.zfill(14) if re.match(r'^\d{1,14}$', digits) else None
  
  
 # save to db
@@ -177,19 +183,20 @@ async def save_product_to_db(pool: asyncpg.Pool, product: dict, barcode: str | N
                         colruyt_technical_nr = COALESCE($7, colruyt_technical_nr),
                         colruyt_commercial_nr = COALESCE($8, colruyt_commercial_nr),
                         price = COALESCE($9, price),
-                        barcode = COALESCE($10, barcode)
+                        barcode = $10,
+                        gtin14 = $11
                     WHERE colruyt_product_id = $1
                 """,
                     colruyt_product_id, product_name, brand, image_url,
                     content, colruyt_category, colruyt_technical_nr,
-                    colruyt_commercial_nr, price, effective_barcode
+                    colruyt_commercial_nr, price, effective_barcode, gtin14(effective_barcode)
                 )
                 return "updated"
             else:
-                # Check if barcode already exists
+                # Check if barcode already exists (same GTIN-14, also with/without leading zeros)
                 existing_barcode = await conn.fetchrow(
-                    "SELECT product_id FROM products WHERE barcode = $1",
-                    effective_barcode
+                    "SELECT product_id FROM products WHERE barcode = $1 OR gtin14 = $2 LIMIT 1",
+                    effective_barcode, gtin14(effective_barcode)
                 )
  
                 if existing_barcode:
@@ -203,9 +210,9 @@ async def save_product_to_db(pool: asyncpg.Pool, product: dict, barcode: str | N
                             content = COALESCE($6, content),
                             price = COALESCE($7, price),
                             image_url = COALESCE($8, image_url)
-                        WHERE barcode = $1
+                        WHERE product_id = $1
                     """,
-                        effective_barcode, colruyt_product_id,
+                        existing_barcode["product_id"], colruyt_product_id,
                         colruyt_technical_nr, colruyt_commercial_nr,
                         colruyt_category, content, price, image_url
                     )
@@ -216,12 +223,12 @@ async def save_product_to_db(pool: asyncpg.Pool, product: dict, barcode: str | N
                         INSERT INTO products (
                             product_id, barcode, product_name, brand, image_url,
                             content, colruyt_category, colruyt_product_id,
-                            colruyt_technical_nr, colruyt_commercial_nr, price
-                        ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+                            colruyt_technical_nr, colruyt_commercial_nr, price, gtin14
+                        ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12)
                     """,
                         product_id, effective_barcode, product_name, brand,
                         image_url, content, colruyt_category, colruyt_product_id,
-                        colruyt_technical_nr, colruyt_commercial_nr, price
+                        colruyt_technical_nr, colruyt_commercial_nr, price, gtin14(effective_barcode)
                     )
                     return "inserted"
  
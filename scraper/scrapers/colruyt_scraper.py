@@ -380,8 +380,8 @@ def run(playwright: Playwright):
                     info_soup = BeautifulSoup(page_obj.content(), "html.parser")
 
                     def normalize_barcode(raw: str) -> str:
-                        """Strip leading zeros to match how barcodes are stored in the products table."""
-                        return raw.lstrip('0') if raw else raw
+                        """Barcode as given (whitespace removed): the backend keys products on the zero-padded GTIN-14."""
+                        return raw.strip() if raw else raw
 
                     # Method 1: Find ALL elements with data-gtin attribute
                     gtin_elements = info_soup.find_all(attrs={"data-gtin": True})